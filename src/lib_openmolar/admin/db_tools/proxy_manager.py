@@ -49,6 +49,7 @@ class ProxyManager(object):
     '''
 
     _proxy_clients = []
+    _jobs = {}
     selected_index = 0
 
     #:
@@ -121,6 +122,7 @@ class ProxyManager(object):
 
     def forget_proxies(self):
         self._proxy_clients = []
+        self._jobs = {}
 
     def om_connect(self):
         '''
@@ -173,6 +175,89 @@ class ProxyManager(object):
         LOGGER.warning("ProxyManager.switch_server_user should be overwritten")
         return False
 
+    @property
+    def active_jobs(self):
+        '''
+        a list of (proxy_client, job_id, description) for the server side
+        jobs being tracked.
+        '''
+        return [(client, job_id, job["description"])
+            for (client, job_id), job in sorted(self._jobs.items())]
+
+    def track_job(self, proxy_client, job_id, description):
+        '''
+        remember a job started on an openmolar server, so that poll_jobs
+        reports its progress.
+        '''
+        LOGGER.info("tracking job %s on %s - %s"% (
+            job_id, proxy_client.brief_name, description))
+        self._jobs[(proxy_client, job_id)] = {
+            "description" : description, "log_offset" : 0}
+
+    @user_perms
+    def submit_job(self, func, *args):
+        '''
+        start a function in the background on the selected server.
+        returns the job id.
+        '''
+        job_id = self.selected_client.submit_job(func, *args)
+        if job_id is not None:
+            self.track_job(self.selected_client, job_id,
+                u"%s %s"% (func, " ".join([str(arg) for arg in args])))
+        return job_id
+
+    def cancel_job(self, proxy_client, job_id):
+        '''
+        ask the server to cancel a job
+        '''
+        return proxy_client.cancel_job(job_id)
+
+    def poll_jobs(self):
+        '''
+        poll the servers for the progress of all tracked jobs.
+        each call makes one short request per job, so this can be called
+        periodically (eg. by a timer) without blocking.
+        returns the number of jobs still in progress.
+        '''
+        for (client, job_id), job in self._jobs.items():
+            try:
+                status = client.job_status(job_id, job["log_offset"])
+            except Exception:
+                LOGGER.exception("unable to poll job %s - forgetting it"%
+                    job_id)
+                self._jobs.pop((client, job_id))
+                continue
+            if status is None:
+                continue
+            job["log_offset"] = status["log_offset"]
+            for line in status["log"]:
+                LOGGER.info(u"%s - %s"% (job["description"], line))
+            self.job_progress(job["description"], status)
+            if status["status"] in ("finished", "failed", "cancelled"):
+                self._jobs.pop((client, job_id))
+                self.job_completed(job["description"], status)
+        return len(self._jobs)
+
+    def job_progress(self, description, status):
+        '''
+        called by poll_jobs with the status of each job in progress
+        this function can be overwritten.
+        '''
+        LOGGER.debug("%s %s %s%%"% (description, status["status"],
+            status["progress"]))
+
+    def job_completed(self, description, status):
+        '''
+        called by poll_jobs when a job has completed
+        this function can be overwritten.
+        '''
+        if status["status"] == "finished":
+            self.advise(u"%s<hr />%s"% (description, _("completed")), 1)
+        else:
+            self.advise(u"%s<hr />%s %s"% (description, status["status"],
+                status["error"] or ""), 2)
+        self.display_proxy_message()
+
     def create_demo_database(self):
         '''
         initiates the demo database
@@ -148,6 +148,11 @@ class AdminMainWindow(PostgresMainWindow, ProxyManager):
         self.connect_signals()
         self.show()
 
+        #: polls the openmolar servers for the progress of background jobs
+        self.job_timer = QtCore.QTimer(self)
+        self.job_timer.setInterval(1000)
+        self.job_timer.timeout.connect(self.poll_jobs)
+
         QtCore.QTimer.singleShot(100, self.setBriefMessageLocation)
         QtCore.QTimer.singleShot(1000, self._init_proxies)
 
@@ -316,13 +321,17 @@ class AdminMainWindow(PostgresMainWindow, ProxyManager):
         dl = ManageDatabaseDialog(dbname, self.selected_client , self)
         dl.waiting.connect(self.wait)
         dl.function_completed.connect(self.display_proxy_message)
+        dl.job_submitted.connect(self.track_job)
         dl.exec_()
 
     def manage_pg_users(self, dbname):
         '''
         raise a dialog, and provide database management tools
         '''
-        dl = ManagePGUsersDialog(dbname, self.selected_client , self)
+        dbnames = self.selected_client.get_databases()
+        if not isinstance(dbnames, list):
+            dbnames = None
+        dl = ManagePGUsersDialog(dbname, self.selected_client , self, dbnames)
         dl.waiting.connect(self.wait)
         dl.function_completed.connect(self.display_proxy_message)
         dl.exec_()
@@ -435,6 +444,30 @@ _("Version"), SETTINGS.VERSION,
             return True
         return False
 
+    def track_job(self, proxy_client, job_id, description):
+        '''
+        overwrites :doc:`ProxyManager` function
+        so that the job timer runs whilst jobs are in progress.
+        '''
+        ProxyManager.track_job(self, proxy_client, job_id, description)
+        self.job_timer.start()
+
+    def poll_jobs(self):
+        '''
+        overwrites :doc:`ProxyManager` function
+        '''
+        n_jobs = ProxyManager.poll_jobs(self)
+        if n_jobs == 0:
+            self.job_timer.stop()
+        return n_jobs
+
+    def job_progress(self, description, status):
+        '''
+        overwrites :doc:`ProxyManager` function
+        '''
+        self.statusbar.showMessage(u"%s - %s %s%%"% (
+            description, status["status"], status["progress"]), 5000)
+
     def display_proxy_message(self):
         '''
         display the proxy message.
@@ -476,6 +509,8 @@ _("Version"), SETTINGS.VERSION,
             self.add_pg_user()
         elif url == 'drop_pg_user':
             self.remove_pg_user()
+        elif url == "show server log":
+            self.show_server_log()
         else:
             if not self.message_link(url):
                 self.advise(
@@ -495,6 +530,13 @@ _("Version"), SETTINGS.VERSION,
         if result:
             self.add_postgres_user(user, password)
 
+    def show_server_log(self):
+        '''
+        raise a dialog which follows the server log
+        '''
+        dl = ServerLogDialog(self.selected_client, self)
+        dl.exec_()
+
     def remove_pg_user(self):
         '''
         ask for confirmation, then remove the user
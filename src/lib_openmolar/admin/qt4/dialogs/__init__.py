@@ -10,6 +10,7 @@ from configure_db_dialog import ConfigureDatabaseDialog
 from manage_pg_users_dialog import ManagePGUsersDialog
 from import_progress_dialog import ImportProgressDialog
 from drop_pg_user_dialog import DropPGUserDialog
+from server_log_dialog import ServerLogDialog
 
 __all__ = ["PopulateDemoDialog",
             "PlainTextDialog",
@@ -20,4 +21,5 @@ __all__ = ["PopulateDemoDialog",
             "ManagePGUsersDialog",
             "ImportProgressDialog",
             "DropPGUserDialog",
+            "ServerLogDialog",
             ]
\ No newline at end of file
@@ -40,7 +40,8 @@ class ManageDatabaseDialog(ServerFunctionDialog):
         label = QtGui.QLabel("%s<br /><em>%s</em>"% (
             _('The following remote functions can be called.'),
             _('''Please note - some of these functions
-            may take a long time to execute and give little feedback''')
+            may take a long time to execute,
+            these are run in the background and their progress is logged''')
             ))
         label.setWordWrap(True)
 
@@ -48,7 +49,15 @@ class ManageDatabaseDialog(ServerFunctionDialog):
         self.insertWidget(label)
 
 
-        for func, desc in self.proxy_client.get_management_functions():
+        functions = self.proxy_client.get_management_functions() or []
+
+        # fetch the warnings for all functions in one request
+        payloads = self.proxy_client.call_many(
+            [("pre_execution_warning", (func,)) for func, desc in functions])
+        self.warnings = dict([(func, payload.payload)
+            for (func, desc), payload in zip(functions, payloads)])
+
+        for func, desc in functions:
             but = QtGui.QPushButton(desc)
             but.func_name = func
             self.insertWidget(but)
@@ -67,15 +76,20 @@ class ManageDatabaseDialog(ServerFunctionDialog):
     def but_clicked(self):
         but = self.sender()
 
-        warning = self.proxy_client.pre_execution_warning(but.func_name)
+        warning = self.warnings.get(but.func_name)
         if warning and not self.get_confirm(warning):
             return
+        background = but.func_name in self.proxy_client.job_methods
         attempting = True
-        result = None
+        result, job_id = None, None
         while attempting:
             try:
                 self.waiting.emit(True)
-                result = self.proxy_client.call(but.func_name, self.dbname)
+                if background:
+                    job_id = self.proxy_client.submit_job(
+                        but.func_name, self.dbname)
+                else:
+                    result = self.proxy_client.call(but.func_name, self.dbname)
                 attempting = False
             except ProxyClient.PermissionError:
                 LOGGER.info("user '%s' can not perform function '%s'"% (
@@ -84,7 +98,12 @@ class ManageDatabaseDialog(ServerFunctionDialog):
                 attempting = self.switch_to_admin_user()
             finally:
                 self.waiting.emit(False)
-        if result is not None:
+        if job_id is not None:
+            self.job_submitted.emit(self.proxy_client, job_id,
+                u"%s (%s)"% (but.text(), self.dbname))
+            QtGui.QMessageBox.information(self, _("info"),
+                _("This function is running in the background"))
+        elif result is not None:
             LOGGER.debug(result)
             QtGui.QMessageBox.information(self, "result",
                 "%s"% result.payload)
@@ -28,11 +28,22 @@ from lib_openmolar.common.connect.proxy_client import ProxyClient
 SUPERUSERS = ("openmolar", "postgres")
 
 class ManagePGUsersDialog(ServerFunctionDialog):
-
-    def __init__(self, dbname, proxy_client, parent=None):
+    '''
+    a grid of the permissions of each user on each database.
+    the permissions are loaded, and saved, in a single request.
+    '''
+    def __init__(self, dbname, proxy_client, parent=None, dbnames=None):
         ServerFunctionDialog.__init__(self, dbname, proxy_client, parent)
 
-        header = u"%s %s"% (_("Manage User Permissions for database"), dbname)
+        if dbnames is None:
+            dbnames = [dbname]
+        elif dbname in dbnames:
+            # the chosen database is shown first
+            dbnames = [dbname] + [db for db in dbnames if db != dbname]
+        self.dbnames = dbnames
+
+        header = u"%s %s"% (_("Manage User Permissions for database"),
+            ", ".join(dbnames))
 
         self.setWindowTitle(header)
 
@@ -52,10 +63,14 @@ class ManagePGUsersDialog(ServerFunctionDialog):
         self.insertWidget(header_label)
 
         frame = QtGui.QFrame()
-        self.insertWidget(frame)
+        scroll_area = QtGui.QScrollArea()
+        scroll_area.setWidgetResizable(True)
+        scroll_area.setWidget(frame)
+        self.insertWidget(scroll_area)
         self.set_advanced_but_text(_("Help"))
         self.add_advanced_widget(help_label)
 
+        # checkboxes keyed by (user, dbname)
         self.privileged_cbs = {}
         self.standard_cbs = {}
 
@@ -63,22 +78,31 @@ class ManagePGUsersDialog(ServerFunctionDialog):
 
         label = QtGui.QLabel(u"<b>%s</b>"% _("User"))
         label.setAlignment(QtCore.Qt.AlignCenter)
-        layout.addWidget(label, 0, 0)
-
-        label = QtGui.QLabel(u"<b>%s</b>"% _("Privilege Level"))
-        label.setAlignment(QtCore.Qt.AlignCenter)
-        layout.addWidget(label, 0, 1, 1, 2)
-
-        label = QtGui.QLabel(u"<b>%s</b>"% _("Full"))
-        label.setAlignment(QtCore.Qt.AlignRight)
-        layout.addWidget(label, 1, 1)
-
-        label = QtGui.QLabel(u"<b>%s</b>"% _("Standard"))
-        label.setAlignment(QtCore.Qt.AlignLeft)
-        layout.addWidget(label, 1, 2)
-
-
-        self.users = self.proxy_client.get_pg_user_list()
+        layout.addWidget(label, 0, 0, 2, 1)
+
+        for i, db in enumerate(self.dbnames):
+            column = i * 2 + 1
+            if len(self.dbnames) == 1:
+                text = _("Privilege Level")
+            else:
+                text = db
+            label = QtGui.QLabel(u"<b>%s</b>"% text)
+            label.setAlignment(QtCore.Qt.AlignCenter)
+            layout.addWidget(label, 0, column, 1, 2)
+
+            label = QtGui.QLabel(u"<b>%s</b>"% _("Full"))
+            label.setAlignment(QtCore.Qt.AlignRight)
+            layout.addWidget(label, 1, column)
+
+            label = QtGui.QLabel(u"<b>%s</b>"% _("Standard"))
+            label.setAlignment(QtCore.Qt.AlignLeft)
+            layout.addWidget(label, 1, column + 1)
+
+        self.users = self.proxy_client.get_pg_user_list() or []
+        # get the permissions of all users on all databases in one request
+        self.loaded_perms = self.proxy_client.get_pg_perms_matrix(
+            [user for user in self.users if user not in SUPERUSERS],
+            self.dbnames)
         for i, user in enumerate(self.users):
             row = i+2
 
@@ -91,28 +115,30 @@ class ManagePGUsersDialog(ServerFunctionDialog):
                 su_label = QtGui.QLabel("N/A - superuser")
                 su_label.setAlignment(QtCore.Qt.AlignCenter)
                 su_label.setEnabled(False)
-                layout.addWidget(su_label, row, 1, 1, 2)
+                layout.addWidget(su_label, row, 1, 1, len(self.dbnames) * 2)
                 continue
 
-            perms = self.proxy_client.get_pg_user_perms(user, self.dbname)
+            for j, db in enumerate(self.dbnames):
+                perms = self.loaded_perms.get(user, {}).get(db, {})
 
-            cb1 = QtGui.QCheckBox()
-            cb1.setLayoutDirection(QtCore.Qt.RightToLeft)
-            cb1.setChecked(perms.get("admin", False))
-            self.privileged_cbs[user] = cb1
+                cb1 = QtGui.QCheckBox()
+                cb1.setLayoutDirection(QtCore.Qt.RightToLeft)
+                cb1.setChecked(perms.get("admin", False))
+                self.privileged_cbs[(user, db)] = cb1
 
-            cb2 = QtGui.QCheckBox()
-            cb2.setChecked(perms.get("client", False))
-            self.standard_cbs[user] = cb2
+                cb2 = QtGui.QCheckBox()
+                cb2.setChecked(perms.get("client", False))
+                self.standard_cbs[(user, db)] = cb2
 
-            layout.addWidget(cb1, row, 1)
-            layout.addWidget(cb2, row, 2)
+                layout.addWidget(cb1, row, j * 2 + 1)
+                layout.addWidget(cb2, row, j * 2 + 2)
 
-            cb1.toggled.connect(self._enable)
-            cb2.toggled.connect(self._enable)
+                cb1.toggled.connect(self._enable)
+                cb2.toggled.connect(self._enable)
 
     def sizeHint(self):
-        return QtCore.QSize(300,300)
+        return QtCore.QSize(min(300 + 160 * (len(self.dbnames) - 1), 1000),
+            400)
 
     def _enable(self):
         self.enableApply(True)
@@ -140,15 +166,22 @@ class ManagePGUsersDialog(ServerFunctionDialog):
         self.function_completed.emit()
 
     def apply_changes(self):
-        for user in self.users:
-            if user in SUPERUSERS:
-                continue
-            admin = self.privileged_cbs[user].isChecked()
-            client = self.standard_cbs[user].isChecked()
-            self.proxy_client.grant_pg_user_perms(
-                user, self.dbname, admin, client)
-
-        return True
+        '''
+        send the permissions which have been changed in one request.
+        '''
+        changes = {}
+        for (user, db), cb in self.privileged_cbs.items():
+            perms = {
+                "admin": cb.isChecked(),
+                "client": self.standard_cbs[(user, db)].isChecked()
+                }
+            loaded = self.loaded_perms.get(user, {}).get(db, {})
+            if perms != dict([(group, loaded.get(group, False))
+            for group in perms]):
+                changes.setdefault(user, {})[db] = perms
+        if not changes:
+            return True
+        return self.proxy_client.grant_pg_perms_matrix(changes)
 
 def _test():
     app = QtGui.QApplication([])
@@ -33,6 +33,10 @@ class ServerFunctionDialog(ExtendableDialog):
     waiting = QtCore.pyqtSignal(object)
     function_completed = QtCore.pyqtSignal()
 
+    #: emitted with (proxy_client, job_id, description)
+    #: when a function is started in the background
+    job_submitted = QtCore.pyqtSignal(object, object, object)
+
     def __init__(self, dbname, proxy_client, parent=None):
         ExtendableDialog.__init__(self, parent)
 
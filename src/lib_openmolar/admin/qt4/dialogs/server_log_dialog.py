@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+from PyQt4 import QtCore, QtGui
+
+#: the most lines kept in the viewer
+MAX_BLOCKS = 20000
+
+class ServerLogDialog(QtGui.QDialog):
+    '''
+    a viewer for the server log, which polls the server for lines written
+    since the last poll and appends them (rather than refetching the log).
+    '''
+    #: milliseconds between polls
+    interval = 2000
+
+    def __init__(self, proxy_client, parent=None):
+        QtGui.QDialog.__init__(self, parent)
+        self.proxy_client = proxy_client
+        self.setWindowTitle(_("Server Log"))
+        self.setMinimumWidth(800)
+        self.setMinimumHeight(400)
+
+        self.text_browser = QtGui.QPlainTextEdit()
+        self.text_browser.setReadOnly(True)
+        self.text_browser.setMaximumBlockCount(MAX_BLOCKS)
+        self.text_browser.setLineWrapMode(QtGui.QPlainTextEdit.NoWrap)
+        self.text_browser.setFont(QtGui.QFont("courier", 10))
+
+        self.level_box = QtGui.QComboBox()
+        self.level_box.addItems(["DEBUG", "INFO", "WARNING", "ERROR"])
+
+        self.follow_checkbox = QtGui.QCheckBox(_("Follow"))
+        self.follow_checkbox.setChecked(True)
+
+        close_button = QtGui.QPushButton(_("Close"))
+
+        frame = QtGui.QFrame()
+        layout = QtGui.QHBoxLayout(frame)
+        layout.setMargin(0)
+        layout.addWidget(QtGui.QLabel(_("Level")))
+        layout.addWidget(self.level_box)
+        layout.addStretch()
+        layout.addWidget(self.follow_checkbox)
+        layout.addWidget(close_button)
+
+        layout = QtGui.QVBoxLayout(self)
+        layout.addWidget(self.text_browser)
+        layout.addWidget(frame)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(self.interval)
+        self.timer.timeout.connect(self.poll)
+
+        self.level_box.currentIndexChanged.connect(self.reload)
+        close_button.clicked.connect(self.accept)
+
+        self.reload()
+
+    def reload(self):
+        '''
+        clear the viewer, and start again from the last few lines of the log.
+        '''
+        self.offset, self.inode = -1, None
+        self.text_browser.clear()
+        self.poll()
+        self.timer.start()
+
+    def poll(self):
+        '''
+        append any lines written since the last poll.
+        '''
+        level = unicode(self.level_box.currentText())
+        more = True
+        while more:
+            try:
+                result = self.proxy_client.tail_log(self.offset, level,
+                    self.inode)
+            except Exception:
+                LOGGER.exception("unable to poll the server log")
+                result = None
+            if not result:
+                self.timer.stop()
+                self.text_browser.appendPlainText(
+                    _("Unable to read the server log"))
+                return
+            if result["rotated"]:
+                self.text_browser.appendPlainText(
+                    "---- %s ----"% _("log rotated"))
+            self.offset, self.inode = result["offset"], result["inode"]
+            if result["lines"]:
+                self.text_browser.appendPlainText(
+                    "\n".join(result["lines"]))
+            more = result["more"]
+
+        if self.follow_checkbox.isChecked():
+            vsb = self.text_browser.verticalScrollBar()
+            vsb.setValue(vsb.maximum())
+
+    def done(self, result):
+        self.timer.stop()
+        QtGui.QDialog.done(self, result)
+
+def _test():
+    app = QtGui.QApplication([])
+    from lib_openmolar.common.connect.proxy_client import _test_instance
+    proxy_client = _test_instance()
+    dl = ServerLogDialog(proxy_client)
+    dl.exec_()
+
+if __name__ == "__main__":
+    import lib_openmolar.admin # set up LOGGER
+    from gettext import gettext as _
+    _test()
@@ -18,6 +18,7 @@ from lib_openmolar.client.db_orm.client_contracted_practitioner import Contracte
 from lib_openmolar.client.db_orm.notes_model import NotesModel
 from lib_openmolar.client.db_orm.treatment_model import TreatmentModel
 from lib_openmolar.client.db_orm.patient_model import PatientModel
+from lib_openmolar.client.db_orm.patient_cache import PatientCache
 
 
 __all__ = [ 'AddressObjects',
@@ -37,4 +38,5 @@ __all__ = [ 'AddressObjects',
             'TeethPresentDB',
             'TelephoneDB',
             'TreatmentModel',
-            'PatientModel']
\ No newline at end of file
+            'PatientModel',
+            'PatientCache']
\ No newline at end of file
@@ -29,6 +29,11 @@ from PyQt4 import QtSql, QtCore
 
 from lib_openmolar.common.db_orm import InsertableRecord
 from lib_openmolar.common.datatypes import EditableField, OMType
+from lib_openmolar.client.db_orm.patient_loader import query_records
+
+# this query LOOKS simple.. but the underlying view is VERY complex.
+QUERY = '''
+    select * from view_addresses where patient_id=? order by mailing_pref'''
 
 
 class AddressRecord(InsertableRecord):
@@ -159,28 +164,22 @@ class AddressObjects(object):
     grabs a list of :doc:`AddressRecord` types using the
     view_addresses pseudo table
     '''
-    def __init__(self, patient_id):
+    def __init__(self, patient_id, records=None):
         #: a pointer to the id of the :doc:`PatientModel`
         self.patient_id = patient_id
-        self.get_records()
+        self.get_records(records)
 
-    def get_records(self):
+    def get_records(self, records=None):
         '''
         poll the database to get all address records associated with the
         patient_id given at init
+        (unless the records have already been loaded)
         '''
         self.record_list, self.orig_record_list = [], []
 
-        # this query LOOKS simple.. but the underlying view is VERY complex.
-        query = '''
-    select * from view_addresses where patient_id=? order by mailing_pref'''
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(self.patient_id)
-        q_query.exec_()
-        while q_query.next():
-            record = q_query.record()
-
+        if records is None:
+            records = query_records(QUERY, self.patient_id)
+        for record in records:
             #make a copy
             orig = QtSql.QSqlRecord(record)
             new = AddressRecord(record)
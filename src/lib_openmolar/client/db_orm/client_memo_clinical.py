@@ -27,12 +27,16 @@ gets/sets a record in the clinical memo table
 from PyQt4 import QtCore, QtSql
 
 from lib_openmolar.common.db_orm import InsertableRecord
+from lib_openmolar.client.db_orm.patient_loader import query_records
 
 
 TABLENAME = "clinical_memos"
 
+QUERY = '''SELECT * from %s
+WHERE patient_id = ? order by ix desc limit 1'''% TABLENAME
+
 class MemoClinicalDB(InsertableRecord):
-    def __init__(self, patient_id):
+    def __init__(self, patient_id, records=None):
 
         self.tablename = TABLENAME
         #:
@@ -41,17 +45,11 @@ class MemoClinicalDB(InsertableRecord):
         #:
         self.exists_in_db = True
 
-        query = '''SELECT * from %s
-        WHERE patient_id = ? order by ix desc limit 1'''% TABLENAME
-
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(patient_id)
-        q_query.exec_()
-
-        if not q_query.next(): # no memos exist.
+        if records is None:
+            records = query_records(QUERY, patient_id)
+        if records == []: # no memos exist.
             self.exists_in_db = False
-        record = q_query.record()
+        record = records.first()
         QtSql.QSqlQuery.__init__(self, record)
 
         ## make a copy (a marker of database state)
@@ -26,14 +26,23 @@ This module provides the NotesClericalDB Class
 
 '''
 
+TABLENAME = "notes_clerical"
+
 from PyQt4 import QtCore, QtSql
+from lib_openmolar.common.db_orm import InsertableRecord
+from lib_openmolar.client.db_orm.patient_loader import query_records
+
+QUERY = '''SELECT * from %s WHERE patient_id = ?
+ORDER BY open_time'''% TABLENAME
 
 class NotesClericalDB(object):
     _new_note = None
     _records = None
-    def __init__(self, patient_id):
+    def __init__(self, patient_id, records=None):
         #:
         self.patient_id = patient_id
+        if records is not None:
+            self.get_records(records)
 
     def has_new_note(self):
         return self._new_note is not None
@@ -68,23 +77,19 @@ class NotesClericalDB(object):
             return False
         return self._new_note.value("line").toString() != ""
 
-    def get_records(self):
+    def get_records(self, records=None):
         '''
-        get the records from the database.
+        get the records from the database
+        (unless they have already been loaded).
 
         .. note:
             A property of is_clinical is added to each record, and set as False
         '''
         self._records = []
 
-        query = '''SELECT * from notes_clerical WHERE patient_id = ?
-        ORDER BY open_time'''
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(self.patient_id)
-        q_query.exec_()
-        while q_query.next():
-            record = q_query.record()
+        if records is None:
+            records = query_records(QUERY, self.patient_id)
+        for record in records:
             record.is_clinical = False
             self._records.append(record)
 
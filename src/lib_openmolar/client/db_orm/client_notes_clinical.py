@@ -29,13 +29,18 @@ TABLENAME = "notes_clinical"
 
 from PyQt4 import QtCore, QtSql
 from lib_openmolar.common.db_orm import InsertableRecord
+from lib_openmolar.client.db_orm.patient_loader import query_records
+
+QUERY = 'SELECT * from %s WHERE patient_id = ? order by open_time'% TABLENAME
 
 class NotesClinicalDB(object):
     _new_note = None
     _records = None
-    def __init__(self, patient_id):
+    def __init__(self, patient_id, records=None):
         #:
         self.patient_id = patient_id
+        if records is not None:
+            self.get_records(records)
 
     @property
     def is_dirty(self):
@@ -71,22 +76,18 @@ class NotesClinicalDB(object):
             self._records.append(self._new_note)
         return True
 
-    def get_records(self):
+    def get_records(self, records=None):
         '''
         get the records from the database
+        (unless they have already been loaded)
 
         .. note:
             A property of is_clinical is added to each record, and set as True
         '''
         self._records = []
-        query = 'SELECT * from %s WHERE patient_id = ? order by open_time'% (
-            TABLENAME)
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(self.patient_id)
-        q_query.exec_()
-        while q_query.next():
-            record = q_query.record()
+        if records is None:
+            records = query_records(QUERY, self.patient_id)
+        for record in records:
             record.is_clinical = True
             self._records.append(record)
 
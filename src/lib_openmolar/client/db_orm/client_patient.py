@@ -30,9 +30,12 @@ from PyQt4 import QtCore, QtSql
 from lib_openmolar.common.datatypes import EditableField
 
 from lib_openmolar.common.db_orm import InsertableRecord
+from lib_openmolar.client.db_orm.patient_loader import query_records
 
 TABLENAME = "patients"
 
+QUERY = 'SELECT * from %s WHERE ix = ?'% TABLENAME
+
 class PatientNotFoundError(Exception):
     pass
 
@@ -96,20 +99,17 @@ class DuckPatient(object):
         return u"patient - %s"% self.full_name
 
 class PatientDB(QtSql.QSqlRecord):
-    def __init__(self, patient_id):
+    def __init__(self, patient_id, records=None):
 
         #:
         self.patient_id = patient_id
 
-        query = 'SELECT * from %s WHERE ix = ?'% TABLENAME
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(patient_id)
-        q_query.exec_()
-        if not q_query.next():
+        if records is None:
+            records = query_records(QUERY, patient_id)
+        if records == []:
             raise PatientNotFoundError
         else:
-            record = q_query.record()
+            record = records[0]
             QtSql.QSqlQuery.__init__(self, record)
 
             ## make a copy (a marker of database state)
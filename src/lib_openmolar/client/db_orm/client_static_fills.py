@@ -26,9 +26,13 @@ Provides StaticFillsDB class
 
 from PyQt4 import QtSql
 from lib_openmolar.common.db_orm import InsertableRecord
+from lib_openmolar.client.db_orm.patient_loader import query_records
 
 TABLENAME = "static_fills"
 
+QUERY = '''select tooth, surfaces, material, comment
+from %s where patient_id=?'''% TABLENAME
+
 class FillRecord(InsertableRecord):
     def __init__(self):
         InsertableRecord.__init__(self, SETTINGS.psql_conn, TABLENAME)
@@ -54,23 +58,16 @@ class StaticFillsDB(object):
     '''
     class to get static chart information
     '''
-    def __init__(self, patient_id):
+    def __init__(self, patient_id, records=None):
         #:
         self.patient_id = patient_id
         #:
         self.record_list = []
         self._orig_record_list = []
 
-        query = '''select tooth, surfaces, material, comment
-        from %s where patient_id=?'''% TABLENAME
-
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(patient_id)
-        q_query.exec_()
-        while q_query.next():
-            record = q_query.record()
-
+        if records is None:
+            records = query_records(QUERY, patient_id)
+        for record in records:
             new = FillRecord()
             QtSql.QSqlQuery.__init__(new, record)
 
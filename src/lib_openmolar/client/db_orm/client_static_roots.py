@@ -26,10 +26,14 @@ Provides StaticRootsDB class
 
 from PyQt4 import QtSql
 from lib_openmolar.common.db_orm import InsertableRecord
+from lib_openmolar.client.db_orm.patient_loader import query_records
 
 
 TABLENAME = "static_roots"
 
+QUERY = '''select tooth, description, comment
+from %s where patient_id=?'''% TABLENAME
+
 class RootRecord(InsertableRecord):
     def __init__(self):
         InsertableRecord.__init__(self, SETTINGS.psql_conn, TABLENAME)
@@ -52,23 +56,16 @@ class StaticRootsDB(object):
     '''
     class to get static chart information
     '''
-    def __init__(self, patient_id):
+    def __init__(self, patient_id, records=None):
         #:
         self.patient_id = patient_id
         #:
         self.record_list = []
         self._orig_record_list = []
 
-        query = '''select tooth, description, comment
-        from %s where patient_id=?'''% TABLENAME
-
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(patient_id)
-        q_query.exec_()
-        while q_query.next():
-            record = q_query.record()
-
+        if records is None:
+            records = query_records(QUERY, patient_id)
+        for record in records:
             new = RootRecord()
             QtSql.QSqlQuery.__init__(new, record)
 
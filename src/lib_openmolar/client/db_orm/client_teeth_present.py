@@ -28,24 +28,23 @@ This module provides the PatientDB Class
 from PyQt4 import QtCore, QtSql
 
 from lib_openmolar.common.db_orm import InsertableRecord
+from lib_openmolar.client.db_orm.patient_loader import query_records
 
 TABLENAME = "teeth_present"
 
+QUERY = '''SELECT * from %s WHERE patient_id = ?
+order by ix desc limit 1'''% TABLENAME
+
 class TeethPresentDB(InsertableRecord):
-    def __init__(self, patient_id):
+    def __init__(self, patient_id, records=None):
         InsertableRecord.__init__(self, SETTINGS.psql_conn,
             TABLENAME)
 
         #:
         self.patient_id = patient_id
-        query = '''SELECT * from %s WHERE patient_id = ?
-        order by ix desc limit 1'''% TABLENAME
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(patient_id)
-        q_query.exec_()
-        q_query.next()
-        record = q_query.record()
+        if records is None:
+            records = query_records(QUERY, patient_id)
+        record = records.first()
         QtSql.QSqlQuery.__init__(self, record)
 
         ## make a copy (a marker of database state)
@@ -27,24 +27,22 @@ telephone and telephone_link orms, to return a list of values.
 
 from PyQt4 import QtSql
 
+from lib_openmolar.client.db_orm.patient_loader import query_records
+
 phone = '''<img height='20' width='20' alt="edit phone"
 align='right' src='qrc:/icons/phone.png' />'''
 
 TABLENAME = "telephone"
 
-class TelephoneDB(object):
-    def __init__(self, patient_id):
-        self.record_list = []
-        query = '''SELECT number, sms_capable, checked_date, tel_cat
+QUERY = '''SELECT number, sms_capable, checked_date, tel_cat
 from %s join telephone_link on telephone.ix = telephone_link.tel_id
 WHERE patient_id = ? order by checked_date desc'''% TABLENAME
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(patient_id)
-        q_query.exec_()
-        while q_query.next():
-            record = q_query.record()
-            self.record_list.append(record)
+
+class TelephoneDB(object):
+    def __init__(self, patient_id, records=None):
+        if records is None:
+            records = query_records(QUERY, patient_id)
+        self.record_list = list(records)
 
     @property
     def records(self):
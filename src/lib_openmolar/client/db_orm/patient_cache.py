@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+This module provides the PatientCache Class, which keeps recently opened
+(and prefetched) patients in memory, so that flicking between them does not
+mean loading every record again.
+'''
+
+from collections import OrderedDict
+
+from lib_openmolar.client.db_orm.patient_loader import records_size
+from lib_openmolar.client.db_orm.patient_model import (patient_loader,
+    PatientModel)
+
+#: the number of patients kept
+CACHE_SIZE = 10
+
+#: the memory (in bytes) which may be used by prefetched record sets
+PREFETCH_BUDGET = 8 * 1024 * 1024
+
+class PatientCache(object):
+    '''
+    a least recently used cache of :doc:`PatientModel` instances.
+
+    prefetched patients are kept as record sets (up to a memory budget),
+    and only become a :doc:`PatientModel` when they are opened.
+
+    a patient taken from the cache is checked against the database with a
+    single query for the digests of its record sets, and only the record
+    sets which have changed are fetched again.
+    '''
+    def __init__(self, size=CACHE_SIZE, prefetch_budget=PREFETCH_BUDGET):
+        #: the maximum number of patients kept
+        self.size = size
+        #: the maximum size (in bytes) of the prefetched record sets
+        self.prefetch_budget = prefetch_budget
+        self._patients = OrderedDict()
+        self._prefetched = OrderedDict()
+        self._connection = None
+
+    def __len__(self):
+        return len(self._patients) + len(self._prefetched)
+
+    def __contains__(self, patient_id):
+        return patient_id in self._patients or patient_id in self._prefetched
+
+    @property
+    def patient_ids(self):
+        '''
+        the ids of the patients held (opened or prefetched)
+        '''
+        return self._patients.keys() + self._prefetched.keys()
+
+    @property
+    def prefetched_size(self):
+        '''
+        the approximate size (in bytes) of the prefetched record sets
+        '''
+        return sum([records_size(records)
+            for records in self._prefetched.values()])
+
+    def _check_connection(self):
+        if self._connection is not SETTINGS.psql_conn:
+            self.clear()
+            self._connection = SETTINGS.psql_conn
+
+    def add(self, patient):
+        '''
+        keep patient (unless it has unsaved changes, or is not fully loaded)
+        returns True if the patient was cached.
+        '''
+        self._check_connection()
+        if not patient.is_loaded or patient.is_dirty:
+            self.discard(patient.patient_id)
+            return False
+        self._prefetched.pop(patient.patient_id, None)
+        self._patients.pop(patient.patient_id, None)
+        self._patients[patient.patient_id] = patient
+        while len(self._patients) > self.size:
+            self._patients.popitem(last=False)
+        return True
+
+    def add_records(self, patient_id, records):
+        '''
+        keep the record sets of a prefetched patient, the oldest prefetched
+        patients are forgotten if the prefetch budget is exceeded.
+        returns True if the records were cached.
+        '''
+        self._check_connection()
+        if patient_id in self._patients:
+            return False
+        self._prefetched.pop(patient_id, None)
+        self._prefetched[patient_id] = records
+        while self._prefetched and self.prefetched_size > self.prefetch_budget:
+            self._prefetched.popitem(last=False)
+        return patient_id in self._prefetched
+
+    def discard(self, patient_id):
+        '''
+        forget patient_id (if cached)
+        '''
+        self._patients.pop(patient_id, None)
+        self._prefetched.pop(patient_id, None)
+
+    def clear(self):
+        '''
+        forget all patients
+        '''
+        self._patients.clear()
+        self._prefetched.clear()
+
+    def get(self, patient_id):
+        '''
+        take patient_id from the cache, brought up to date with the database.
+        returns None if the patient is not cached, or can not be revalidated.
+        '''
+        if self._connection is not SETTINGS.psql_conn:
+            self.clear()
+            return None
+        patient = self._patients.pop(patient_id, None)
+        records = self._prefetched.pop(patient_id, None)
+        if patient is not None:
+            known_digests = patient.digests
+        elif records is not None:
+            known_digests = dict([(key, records[key].digest)
+                for key in records])
+        else:
+            return None
+
+        loader = patient_loader()
+        try:
+            digests = loader.digests(patient_id)
+            stale = [key for key in digests if digests[key] is None or
+                digests[key] != known_digests.get(key)]
+            fetched = loader.load(patient_id, stale) if stale else {}
+        except (IOError, ValueError) as exc:
+            LOGGER.warning("unable to revalidate patient %s %s"% (
+                patient_id, exc))
+            return None
+
+        if fetched.get("patient") == []:
+            # the patient has been deleted
+            return None
+        LOGGER.debug("patient %s restored from cache, reloaded %s"% (
+            patient_id, stale))
+        if patient is None:
+            records.update(fetched)
+            return PatientModel(patient_id, records)
+        patient.restore(fetched)
+        return patient
+
+if __name__ == "__main__":
+
+    from lib_openmolar.client.connect import DemoClientConnection
+    cc = DemoClientConnection()
+    cc.connect()
+
+    cache = PatientCache(2)
+    for patient_id in (1, 2, 3):
+        cache.add(PatientModel(patient_id))
+    print 1 in cache, len(cache)
+    print cache.get(3)
@@ -0,0 +1,316 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+This module provides the PatientLoader Class, which fetches all the record
+sets of a patient (from the patients, addresses, notes, treatments ... tables)
+in a single round trip to the database.
+
+each record set is aggregated to json by the server, and the json is turned
+back into QSqlRecords with the same fields (and field types) as those
+returned by the per-table queries, so the ORM classes can not tell the
+difference.
+the field definitions are learned from the per-table queries, which are used
+for the first patient loaded, and whenever the batched query fails (eg. on a
+postgres server older than 9.3, which has no json_agg function).
+
+the server also returns a digest of each record set, so that a copy of a
+patient held by the client can be checked (see :func:`PatientLoader.digests`)
+and only the record sets which have changed need to be fetched again.
+'''
+
+import json
+import re
+
+from PyQt4 import QtCore, QtSql
+
+_DATETIME_RE = re.compile(r"(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)"
+    r"(?:\.(\d+))?(Z|[+-]\d\d(?::?\d\d)?)?$")
+
+_TIME_RE = re.compile(r"(\d\d):(\d\d):(\d\d)(?:\.(\d+))?")
+
+#: an md5 of the text of every row of a record set (aliased as t).
+#: the rows are sorted, so that the digest does not change with the order in
+#: which the server happens to return rows the query does not order.
+DIGEST = "md5(coalesce(string_agg(t::text, '|' ORDER BY t::text), ''))"
+
+#: the guessed size of a field, for record sets not loaded as json
+FIELD_BYTES = 32
+
+class RecordSet(list):
+    '''
+    a list of QSqlRecords, with a template record (the fields of the query,
+    all values null) which is what QSqlQuery.record() returns when the query
+    is not positioned on a valid row.
+    '''
+    def __init__(self, template, records=(), digest=None, size=None):
+        list.__init__(self, records)
+        #:
+        self.template = template
+        #: the server's digest of the records (None if unknown)
+        self.digest = digest
+        #: the (approximate) size of the records in bytes
+        self.size = size
+        if size is None:
+            self.size = len(self) * template.count() * FIELD_BYTES
+
+    def first(self):
+        '''
+        the first record, or the template if there are no records
+        '''
+        if self == []:
+            return QtSql.QSqlRecord(self.template)
+        return self[0]
+
+def query_records(query, patient_id, connection=None):
+    '''
+    execute query (which has a single placeholder, the patient_id)
+    and return the result as a :doc:`RecordSet`
+    '''
+    if connection is None:
+        connection = SETTINGS.psql_conn
+    q_query = QtSql.QSqlQuery(connection)
+    q_query.prepare(query)
+    q_query.addBindValue(patient_id)
+    q_query.exec_()
+    records = []
+    while q_query.next():
+        records.append(q_query.record())
+    return RecordSet(q_query.record(), records)
+
+def _msecs(fraction):
+    if not fraction:
+        return 0
+    return int((fraction + "00")[:3])
+
+def _to_datetime(value):
+    match = _DATETIME_RE.match(value)
+    if not match:
+        return None
+    year, month, day, hour, minute, second = [
+        int(group) for group in match.groups()[:6]]
+    dt = QtCore.QDateTime(QtCore.QDate(year, month, day),
+        QtCore.QTime(hour, minute, second, _msecs(match.group(7))))
+    offset = match.group(8)
+    if offset:
+        # a timestamp with time zone, show it in local time (as QPSQL does)
+        seconds = 0
+        if offset != "Z":
+            digits = offset[1:].replace(":", "")
+            seconds = int(digits[:2]) * 3600 + int(digits[2:] or 0) * 60
+            if offset[0] == "-":
+                seconds = -seconds
+        dt = dt.addSecs(-seconds)
+        dt.setTimeSpec(QtCore.Qt.UTC)
+        dt = dt.toLocalTime()
+    return dt
+
+def _to_time(value):
+    match = _TIME_RE.match(value)
+    if not match:
+        return None
+    hour, minute, second = [int(group) for group in match.groups()[:3]]
+    return QtCore.QTime(hour, minute, second, _msecs(match.group(4)))
+
+def _pg_array(value):
+    '''
+    a json array in the text form QPSQL returns for postgres arrays
+    '''
+    items = []
+    for item in value:
+        if item is None:
+            items.append("NULL")
+        elif isinstance(item, list):
+            items.append(_pg_array(item))
+        elif isinstance(item, bool):
+            items.append("t" if item else "f")
+        elif isinstance(item, basestring):
+            if item == "" or re.search(r'[\s{},"\\]', item) or (
+            item.upper() == "NULL"):
+                item = '"%s"'% item.replace("\\", "\\\\").replace('"', '\\"')
+            items.append(item)
+        else:
+            items.append(unicode(item))
+    return u"{%s}"% ",".join(items)
+
+def json_value(value, field_type):
+    '''
+    convert a value decoded from json to a QVariant of field_type.
+    '''
+    if isinstance(value, list):
+        return QtCore.QVariant(_pg_array(value))
+    if isinstance(value, dict):
+        return QtCore.QVariant(json.dumps(value))
+    if field_type == QtCore.QVariant.Date:
+        return QtCore.QVariant(
+            QtCore.QDate.fromString(value[:10], QtCore.Qt.ISODate))
+    if field_type == QtCore.QVariant.DateTime:
+        dt = _to_datetime(value)
+        if dt is not None:
+            return QtCore.QVariant(dt)
+    elif field_type == QtCore.QVariant.Time:
+        time_ = _to_time(value)
+        if time_ is not None:
+            return QtCore.QVariant(time_)
+    elif field_type == QtCore.QVariant.ByteArray:
+        if value.startswith("\\x"):
+            return QtCore.QVariant(
+                QtCore.QByteArray.fromHex(str(value[2:])))
+    elif field_type == QtCore.QVariant.Bool:
+        return QtCore.QVariant(bool(value))
+    elif field_type == QtCore.QVariant.Double:
+        return QtCore.QVariant(float(value))
+    if isinstance(value, basestring):
+        return QtCore.QVariant(unicode(value))
+    return QtCore.QVariant(value)
+
+def records_size(record_sets):
+    '''
+    the approximate size (in bytes) of a dictionary of record sets
+    '''
+    return sum([record_set.size for record_set in record_sets.values()])
+
+def json_records(template, rows, digest=None, size=None):
+    '''
+    convert rows (a list of dictionaries decoded from json) to a
+    :doc:`RecordSet` of QSqlRecords with the fields of template
+    '''
+    records = []
+    for row in rows:
+        record = QtSql.QSqlRecord(template)
+        for i in range(record.count()):
+            value = row.get(unicode(record.fieldName(i)))
+            if value is None:
+                record.setNull(i)
+            else:
+                record.setValue(i,
+                    json_value(value, record.field(i).type()))
+        records.append(record)
+    return RecordSet(template, records, digest, size)
+
+class PatientLoader(object):
+    '''
+    queries is a list of (key, query) pairs, each query having a single
+    placeholder for the patient id.
+    load returns a dictionary {key: :doc:`RecordSet`}
+    '''
+    def __init__(self, queries, connection=None):
+        if connection is None:
+            connection = SETTINGS.psql_conn
+        #:
+        self.connection = connection
+        #:
+        self.queries = queries
+        #: set to False if the server cannot run the batched query
+        self.batched = True
+        self._templates = {}
+
+    def batched_query(self, queries):
+        '''
+        a single statement returning every record set as a json array,
+        followed by its digest
+        '''
+        return "SELECT * FROM %s"% ",\n".join(
+            ["(SELECT coalesce(json_agg(t), '[]')::text, %s FROM (%s) t) t%d"%
+            (DIGEST, query, i) for i, (key, query) in enumerate(queries)])
+
+    def digest_query(self, queries):
+        '''
+        a single statement returning the digest of every record set
+        '''
+        return "SELECT %s"% ",\n".join(
+            ["(SELECT %s FROM (%s) t)"% (DIGEST, query)
+            for key, query in queries])
+
+    def digests(self, patient_id, keys=None):
+        '''
+        the current digests {key: digest} of the record sets of patient_id
+        (all of them, or only those named in keys)
+        raises IOError if the server cannot provide them.
+        '''
+        queries = [(key, query) for key, query in self.queries
+            if keys is None or key in keys]
+        q_query = self._exec(self.digest_query(queries), patient_id, queries)
+        digests = {}
+        for i, (key, query) in enumerate(queries):
+            digests[key] = unicode(q_query.value(i).toString())
+        return digests
+
+    def load(self, patient_id, keys=None):
+        '''
+        get the record sets for patient_id.
+        (all of them, or only those named in keys)
+        '''
+        queries = [(key, query) for key, query in self.queries
+            if keys is None or key in keys]
+        known = [key for key, query in queries if key in self._templates]
+        if self.batched and len(known) == len(queries):
+            try:
+                return self._load_batched(patient_id, queries)
+            except (IOError, ValueError) as exc:
+                LOGGER.warning(
+                    "batched patient load failed, using per-table queries %s"%
+                    exc)
+                self.batched = False
+        return self._load_per_table(patient_id, queries)
+
+    def _load_per_table(self, patient_id, queries):
+        record_sets = {}
+        for key, query in queries:
+            record_sets[key] = query_records(query, patient_id,
+                self.connection)
+            self._templates[key] = record_sets[key].template
+        return record_sets
+
+    def _exec(self, statement, patient_id, queries):
+        q_query = QtSql.QSqlQuery(self.connection)
+        q_query.prepare(statement)
+        for key, query in queries:
+            q_query.addBindValue(patient_id)
+        if not (q_query.exec_() and q_query.next()):
+            raise IOError(q_query.lastError().text())
+        return q_query
+
+    def _load_batched(self, patient_id, queries):
+        q_query = self._exec(self.batched_query(queries), patient_id, queries)
+        record_sets = {}
+        for i, (key, query) in enumerate(queries):
+            text = unicode(q_query.value(2 * i).toString())
+            digest = unicode(q_query.value(2 * i + 1).toString())
+            record_sets[key] = json_records(self._templates[key],
+                json.loads(text), digest, len(text))
+        return record_sets
+
+if __name__ == "__main__":
+
+    from lib_openmolar.client.connect import DemoClientConnection
+    cc = DemoClientConnection()
+    cc.connect()
+
+    loader = PatientLoader([
+        ("patient", "SELECT * from patients WHERE ix = ?"),
+        ("notes", "SELECT * from notes_clinical WHERE patient_id = ?")])
+
+    for i in range(2):
+        record_sets = loader.load(1)
+        print record_sets["patient"].first().value("last_name").toString()
+        print len(record_sets["notes"])
@@ -28,6 +28,56 @@ functionality from all the ORM classes as and when required.
 from PyQt4 import QtCore, QtSql
 
 from lib_openmolar.client.db_orm import *
+from lib_openmolar.client.db_orm import (client_patient, client_address,
+    client_telephone, client_teeth_present, client_static_fills,
+    client_static_crowns, client_static_roots, client_static_comments,
+    client_memo_clinical, client_memo_clerical, treatment_model,
+    client_notes_clinical, client_notes_clerical, client_perio_bpe,
+    client_perio_pocketing, client_contracted_practitioner)
+from lib_openmolar.client.db_orm.patient_loader import PatientLoader
+
+#: the record sets of a patient, fetched together by a :doc:`PatientLoader`
+PATIENT_QUERIES = [
+    ("patient", client_patient.QUERY),
+    ("addresses", client_address.QUERY),
+    ("telephone", client_telephone.QUERY),
+    ("teeth_present", client_teeth_present.QUERY),
+    ("static_fills", client_static_fills.QUERY),
+    ("static_crowns", client_static_crowns.QUERY),
+    ("static_roots", client_static_roots.QUERY),
+    ("static_comments", client_static_comments.QUERY),
+    ("memo_clinical", client_memo_clinical.QUERY),
+    ("memo_clerical", client_memo_clerical.QUERY),
+    ("treatments", treatment_model.QUERY),
+    ("treatment_metadata", treatment_model.METADATA_QUERY),
+    ("notes_clinical", client_notes_clinical.QUERY),
+    ("notes_clerical", client_notes_clerical.QUERY),
+    ("perio_bpe", client_perio_bpe.QUERY),
+    ("perio_pocketing", client_perio_pocketing.QUERY),
+    ("contracted_practitioners", client_contracted_practitioner.QUERY),
+    ]
+
+#: the record sets of a patient, in the order they are needed by the
+#: interface (the details, then the charts, the notes and the treatments)
+LOAD_STAGES = (
+    ("patient", "addresses", "telephone", "memo_clerical",
+        "contracted_practitioners"),
+    ("teeth_present", "static_fills", "static_crowns", "static_roots",
+        "static_comments", "memo_clinical", "perio_bpe", "perio_pocketing"),
+    ("notes_clinical", "notes_clerical"),
+    ("treatments", "treatment_metadata"),
+    )
+
+_LOADER = None
+
+def patient_loader():
+    '''
+    the :doc:`PatientLoader` for the current database connection
+    '''
+    global _LOADER
+    if _LOADER is None or _LOADER.connection is not SETTINGS.psql_conn:
+        _LOADER = PatientLoader(PATIENT_QUERIES)
+    return _LOADER
 
 
 class PatientModel(object):
@@ -36,32 +86,111 @@ This very important class represents the full patient record.
 
 The behaviour of this object is very much like a dictionary.
     '''
-    _dict = {}
-
     _notes_summary_html = None
 
-    def __init__(self, patient_id):
-        self["patient"] = PatientDB(patient_id)
-        self["addresses"] = AddressObjects(patient_id)
-        self["telephone"] = TelephoneDB(patient_id)
-        self["teeth_present"] = TeethPresentDB(patient_id)
-        self["static_fills"] = StaticFillsDB(patient_id)
-        self["static_crowns"] = StaticCrownsDB(patient_id)
-        self["static_roots"] = StaticRootsDB(patient_id)
-        self["static_comments"] = StaticCommentsDB(patient_id)
-        self["memo_clinical"] = MemoClinicalDB(patient_id)
-        self["memo_clerical"] = MemoClericalDB(patient_id)
-
-        self["treatment_model"] = SETTINGS.treatment_model
-        SETTINGS.treatment_model.load_patient(patient_id)
-
-        self["notes_model"] = NotesModel(patient_id)
+    def __init__(self, patient_id, records=None):
+        '''
+        load all the records of patient patient_id from the database,
+        or build the model from the record sets given (see :func:`add_records`)
+        '''
+        self._dict = {}
+        self.patient_id = patient_id
+        #: the server's digests of the record sets this model was built from
+        self.digests = {}
+        self._treatment_records = None
+        self._treatment_metadata = None
+        if records is None:
+            records = patient_loader().load(patient_id)
+        self.add_records(records)
+
+    def add_records(self, records):
+        '''
+        hydrate the ORM objects from a dictionary of record sets, which may
+        be only one of the :attr:`LOAD_STAGES`, so that a patient can be
+        displayed as its records arrive.
+        '''
+        patient_id = self.patient_id
+        for key in records:
+            self.digests[key] = records[key].digest
+
+        for key, orm_class in (
+        ("patient", PatientDB),
+        ("addresses", AddressObjects),
+        ("telephone", TelephoneDB),
+        ("teeth_present", TeethPresentDB),
+        ("static_fills", StaticFillsDB),
+        ("static_crowns", StaticCrownsDB),
+        ("static_roots", StaticRootsDB),
+        ("static_comments", StaticCommentsDB),
+        ("memo_clinical", MemoClinicalDB),
+        ("memo_clerical", MemoClericalDB),
+        ("perio_bpe", PerioBpeDB),
+        ("perio_pocketing", PerioPocketingDB),
+        ("contracted_practitioners", ContractedPractitionerDB)):
+            if key in records:
+                self[key] = orm_class(patient_id, records[key])
+
+        # the treatment model is shared by all patients, so the records
+        # are kept in case this patient is restored (see restore)
+        if "treatments" in records:
+            self._treatment_records = records["treatments"]
+        if "treatment_metadata" in records:
+            self._treatment_metadata = records["treatment_metadata"]
+        if "treatments" in records or "treatment_metadata" in records:
+            self["treatment_model"] = SETTINGS.treatment_model
+            SETTINGS.treatment_model.load_patient(patient_id,
+                self._treatment_records, self._treatment_metadata)
+
+        # when restored, only one of the notes record sets may have changed
+        notes_model = self._dict.get("notes_model")
+        if notes_model is None:
+            if "notes_clinical" in records or "notes_clerical" in records:
+                self["notes_model"] = NotesModel(patient_id,
+                    records.get("notes_clinical"),
+                    records.get("notes_clerical"))
+        else:
+            if "notes_clinical" in records:
+                notes_model.clinical = NotesClinicalDB(patient_id,
+                    records["notes_clinical"])
+            if "notes_clerical" in records:
+                notes_model.clerical = NotesClericalDB(patient_id,
+                    records["notes_clerical"])
+
+    def restore(self, records={}):
+        '''
+        make this (previously loaded) patient the current one again,
+        replacing any record sets which have changed with those given.
+        '''
+        records = dict(records)
+        records.setdefault("treatments", self._treatment_records)
+        records.setdefault("treatment_metadata", self._treatment_metadata)
+        self.add_records(records)
+
+    def has_records(self, keys):
+        '''
+        True if the record sets named in keys have been loaded
+        '''
+        for key in keys:
+            if key in ("treatments", "treatment_metadata"):
+                key = "treatment_model"
+            elif key in ("notes_clinical", "notes_clerical"):
+                key = "notes_model"
+            if key not in self._dict:
+                return False
+        return True
 
-        self["perio_bpe"] = PerioBpeDB(patient_id)
-        self["perio_pocketing"] = PerioPocketingDB(patient_id)
-        self["contracted_practitioners"] = ContractedPractitionerDB(patient_id)
+    @property
+    def is_loaded(self):
+        '''
+        A Boolean.
+        True once every record set has been loaded
+        '''
+        return self.has_records([key for key, query in PATIENT_QUERIES])
 
-        self.patient_id = patient_id
+    def _loaded(self, atts):
+        for att in atts:
+            if att in self._dict:
+                yield self[att]
 
     @property
     def is_dirty(self):
@@ -70,10 +199,10 @@ The behaviour of this object is very much like a dictionary.
         If True, then the record differs from the database state
         '''
         dirty = False
-        for att in ("patient", "addresses", "teeth_present",
+        for obj in self._loaded(("patient", "addresses", "teeth_present",
         "static_fills", 'static_crowns', 'static_roots', 'static_comments',
-        'memo_clinical', 'memo_clerical', 'treatment_model', 'notes_model'):
-            if self[att].is_dirty:
+        'memo_clinical', 'memo_clerical', 'treatment_model', 'notes_model')):
+            if obj.is_dirty:
                 dirty = True
                 break
         return dirty
@@ -84,11 +213,13 @@ The behaviour of this object is very much like a dictionary.
 
         TODO could be much improved
         '''
-        changes = self['notes_model'].what_has_changed()
+        changes = []
+        for notes_model in self._loaded(("notes_model",)):
+            changes = notes_model.what_has_changed()
         for att in ("patient", "addresses", "teeth_present",
         "static_fills", 'static_crowns', 'static_roots', 'static_comments',
         'memo_clinical', 'memo_clerical', 'treatment_model'):
-            if self[att].is_dirty:
+            if att in self._dict and self[att].is_dirty:
                 changes.append(att)
         return changes
 
@@ -96,10 +227,10 @@ The behaviour of this object is very much like a dictionary.
         '''
         commits any user edits to the database
         '''
-        for att in ("patient", "addresses", "teeth_present",
+        for obj in self._loaded(("patient", "addresses", "teeth_present",
         "static_fills", 'static_crowns', 'static_roots', 'static_comments',
-        'memo_clinical', 'memo_clerical', 'treatment_model'):
-            self[att].commit_changes()
+        'memo_clinical', 'memo_clerical', 'treatment_model')):
+            obj.commit_changes()
 
     @property
     def current_contracted_dentist(self):
@@ -34,6 +34,23 @@ from lib_openmolar.common.db_orm import TreatmentItem
 from lib_openmolar.client.qt4.widgets import ChartDataModel
 from lib_openmolar.client.qt4.widgets import ToothData
 from lib_openmolar.client.qt4.widgets import TreatmentTreeModel
+from lib_openmolar.client.db_orm.patient_loader import query_records
+
+QUERY = '''select
+treatments.ix, patient_id, om_code, description,
+completed, comment, px_clinician, tx_clinician, tx_date, added_by
+from treatments
+left join procedure_codes on procedure_codes.code = treatments.om_code
+where patient_id = ?'''
+
+#: the metadata of all the treatments of a patient
+METADATA_QUERY = '''select
+treatment_id, tooth, tx_type, surfaces, material, type, technition
+from treatment_teeth
+join treatments on treatments.ix = treatment_teeth.treatment_id
+left join treatment_fills  on treatment_fills.tooth_tx_id = treatment_teeth.ix
+left join treatment_crowns on treatment_crowns.tooth_tx_id = treatment_teeth.ix
+where treatments.patient_id = ? order by treatment_teeth.ix'''
 
 
 class TreatmentModel(object):
@@ -55,15 +72,17 @@ class TreatmentModel(object):
         self._treatment_items = []
         self._deleted_items = []
 
-    def load_patient(self, patient_id):
+    def load_patient(self, patient_id, records=None, metadata=None):
         '''
         :param patient_id: integer
+        :kword records: the treatment records, if already loaded
+        :kword metadata: the treatment metadata records, if already loaded
         '''
         #:
         self.patient_id = patient_id
 
         self.clear()
-        self.get_records()
+        self.get_records(records, metadata)
 
     def clear(self):
         '''
@@ -76,31 +95,29 @@ class TreatmentModel(object):
         self.cmp_tx_chartmodel.clear()
         self.tree_model.update_treatments()
 
-    def get_records(self):
+    def get_records(self, records=None, metadata=None):
         '''
         pulls all treatment items in the database
         (for the patient with the id specified during load_patient function)
+        unless the records have already been loaded.
+        the metadata of all the items is loaded at once (see METADATA_QUERY)
         '''
-        ## long query - only time will tell if this is a performance hit
-
         if not self.patient_id:
             return
 
-        query =  '''select
-treatments.ix, patient_id, om_code, description,
-completed, comment, px_clinician, tx_clinician, tx_date, added_by
-from treatments
-left join procedure_codes on procedure_codes.code = treatments.om_code
-where patient_id = ?'''
+        if records is None:
+            records = query_records(QUERY, self.patient_id)
+        if metadata is None:
+            metadata = query_records(METADATA_QUERY, self.patient_id)
 
-        q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
-        q_query.addBindValue(self.patient_id)
-        q_query.exec_()
-        while q_query.next():
-            record = q_query.record()
+        item_metadata = {}
+        for record in metadata:
+            treatment_id = record.value("treatment_id").toInt()[0]
+            item_metadata.setdefault(treatment_id, []).append(record)
 
-            treatment_item = TreatmentItem(record)
+        for record in records:
+            treatment_item = TreatmentItem(record,
+                item_metadata.get(record.value("ix").toInt()[0], []))
             self.add_treatment_item(treatment_item)
 
     @property
@@ -34,6 +34,21 @@ from lib_openmolar.client.qt4 import dialogs
 
 from lib_openmolar.client import db_orm
 
+from patient_load_thread import PatientLoadThread
+
+#: the record sets each page needs before it can show a patient
+PAGE_RECORDS = (
+    ("charts_page", ("teeth_present", "static_fills", "static_crowns",
+        "static_roots", "static_comments", "perio_pocketing")),
+    ("summary_page", ("teeth_present", "memo_clinical", "perio_bpe",
+        "notes_clinical", "notes_clerical")),
+    ("reception_page", ("notes_clinical", "notes_clerical")),
+    ("treatment_page", ("treatments", "treatment_metadata")),
+    )
+
+#: how long (in milliseconds) after a patient is loaded prefetching starts
+PREFETCH_DELAY = 2000
+
 class PatientInterface(QtGui.QWidget):
     '''
     PatientInterface
@@ -107,6 +122,16 @@ class PatientInterface(QtGui.QWidget):
 
         self.load_history, self.history_pos = [], -1
         self.pt = None
+
+        #: loads patients without blocking the gui
+        self.load_thread = PatientLoadThread(self)
+
+        #: recently viewed patients, see :doc:`PatientCache`
+        self.patient_cache = db_orm.PatientCache()
+
+        # (serial, patient_id, called_via_history) of the load in progress
+        self._load_request = None
+        self._loaded_pages = set([])
         #self.clear()
         self.connect_signals()
 
@@ -204,6 +229,13 @@ class PatientInterface(QtGui.QWidget):
 
         self.tab_widget.currentChanged.connect(self.tab_index_changed)
 
+        self.load_thread.records_loaded.connect(self._records_loaded)
+        self.load_thread.load_finished.connect(self._load_finished)
+        self.load_thread.load_failed.connect(self._load_failed)
+        self.load_thread.patient_prefetched.connect(
+            self.patient_cache.add_records)
+        app.aboutToQuit.connect(self.load_thread.stop)
+
         self.connect(self.options_widget,
             QtCore.SIGNAL("chart style"), self.set_chart_style)
 
@@ -247,6 +279,9 @@ class PatientInterface(QtGui.QWidget):
 
     def tab_index_changed(self, i):
         self.options_widget.tab_index_changed(i)
+        if self.pt is not None and not self.pt.is_loaded:
+            # the page will be loaded when the patient is
+            return
         page = self.tab_widget.widget(i)
         if page == self.notes_page:
             self.notes_page.load_patient()
@@ -402,6 +437,8 @@ class PatientInterface(QtGui.QWidget):
         if not self.ok_to_leave_record():
             return
 
+        self._cancel_load()
+        self._cache_patient()
         self.clear()
 
     def reload_patient(self):
@@ -415,7 +452,7 @@ class PatientInterface(QtGui.QWidget):
         '''
         refresh after internal (possibly non-comitted) changes
         '''
-        if self.pt:
+        if self.pt and self.pt.is_loaded:
             self._load_patient()
 
     def _load_patient(self):
@@ -443,44 +480,151 @@ class PatientInterface(QtGui.QWidget):
         '''
         load patient with id patient_id
         if optional 2nd arg is passed, this means don't alter the history list
+
+        a recently viewed patient is taken from the :doc:`PatientCache`,
+        otherwise the records are fetched by the :doc:`PatientLoadThread`,
+        and each page is shown as soon as the records it needs have arrived.
         '''
         if not self.ok_to_leave_record():
             return
+        self._cancel_load()
+        self._cache_patient()
         self.clear()
+        SETTINGS.treatment_model.clear()
+
+        try:
+            pt = self.patient_cache.get(patient_id)
+        except Exception:
+            LOGGER.exception("unable to restore patient %s"% patient_id)
+            pt = None
+        if pt is not None:
+            self.pt = pt
+            self._load_patient()
+            self._patient_loaded(patient_id, called_via_history)
+            return
 
         self.Advise(u"%s<br />%d"% (_("Loading Record Number"), patient_id))
-        QtGui.QApplication.instance().setOverrideCursor(QtCore.Qt.WaitCursor)
+        QtGui.QApplication.instance().setOverrideCursor(QtCore.Qt.BusyCursor)
 
-        if __name__ == "__main__":
-            exception_ = db_orm.PatientNotFoundError
-        else:
-            exception_ = Exception
+        self._loaded_pages = set([])
+        serial = self.load_thread.load(patient_id)
+        self._load_request = (serial, patient_id, called_via_history)
+
+    def _cache_patient(self):
+        '''
+        keep the patient being left in the cache
+        '''
+        if self.pt is not None:
+            self.patient_cache.add(self.pt)
+
+    def _cancel_load(self):
+        '''
+        abandon the load in progress (if any)
+        '''
+        if self._load_request is not None:
+            self.load_thread.cancel()
+            self._end_load()
 
+    def _end_load(self):
+        self._load_request = None
+        QtGui.QApplication.instance().restoreOverrideCursor()
+
+    def _is_current_load(self, serial):
+        return (self._load_request is not None and
+            self._load_request[0] == serial)
+
+    def _records_loaded(self, serial, patient_id, records):
+        '''
+        some of the record sets of a patient have arrived from the
+        load thread
+        '''
+        if not self._is_current_load(serial):
+            return
         try:
-            self.pt = db_orm.PatientModel(patient_id)
-            self._load_patient()
-            self.emit(QtCore.SIGNAL("Patient Loaded"), self.pt)
-            if not called_via_history:
-                self.load_history.append(patient_id)
-                self.history_pos = len(self.load_history) - 1
+            if self.pt is None:
+                self.pt = db_orm.PatientModel(patient_id, records)
+                SETTINGS.set_current_patient(self.pt)
+                self.details_browser.setHtml(self.pt.details_html())
+                self.options_widget.clear()
+                self.history_page.clear()
+                self.estimates_page.clear()
+            else:
+                self.pt.add_records(records)
+
+            for name, keys in PAGE_RECORDS:
+                if name not in self._loaded_pages and self.pt.has_records(
+                keys):
+                    self._loaded_pages.add(name)
+                    getattr(self, name).load_patient()
+                    if name == "charts_page":
+                        self.summary_page.summary_chart.chart_data_model.\
+                            endResetModel()
         except db_orm.PatientNotFoundError:
+            self.load_thread.cancel()
+            self._end_load()
             self.Advise(
             u"%s %d %s"% (_("Record"), patient_id, _("not found!")), 1)
-        except exception_ as e:
-            QtGui.QApplication.instance().restoreOverrideCursor()
-            exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
+        except Exception:
+            self.load_thread.cancel()
+            self._end_load()
+            self.pt = None
+            self._advise_exception()
+
+    def _load_finished(self, serial, patient_id):
+        '''
+        all the records of the patient have been loaded
+        '''
+        if not self._is_current_load(serial):
+            return
+        called_via_history = self._load_request[2]
+        self._end_load()
 
-            readable_ex =   traceback.format_exception(
-                exceptionType, exceptionValue, exceptionTraceback)
+        self.pt.treatment_model.update_views()
+        self.tab_index_changed(self.tab_widget.currentIndex())
+        self._patient_loaded(patient_id, called_via_history)
 
-            message = u"%s\n\n"% _("Unhandled exception - please file a bug")
+    def _patient_loaded(self, patient_id, called_via_history):
+        self.emit(QtCore.SIGNAL("Patient Loaded"), self.pt)
+        if not called_via_history:
+            self.load_history.append(patient_id)
+            self.history_pos = len(self.load_history) - 1
+        QtCore.QTimer.singleShot(PREFETCH_DELAY, self.prefetch_patients)
 
-            for line in readable_ex:
-                message += "%s\n" % line
-            self.Advise(message, 2)
+    def prefetch_patients(self):
+        '''
+        warm the :doc:`PatientCache` with the patients most likely to be
+        opened next - the next patient in the history list, and the next
+        patients on today's book for the logged in user.
+        '''
+        if self.pt is None or self._load_request is not None:
+            return
+        patient_ids = []
+        if 0 <= self.history_pos < len(self.load_history) - 1:
+            patient_ids.append(self.load_history[self.history_pos + 1])
+        exclude = set(self.patient_cache.patient_ids)
+        exclude.add(self.pt.patient_id)
+        user_id = SETTINGS.user1.id if SETTINGS.user1 else None
+        self.load_thread.prefetch(user_id, patient_ids, exclude)
+
+    def _load_failed(self, serial, patient_id, message):
+        if not self._is_current_load(serial):
+            return
+        self._end_load()
+        self.pt = None
+        self.Advise(u"%s %d<hr />%s"% (
+            _("Unable to load record"), patient_id, message), 2)
 
+    def _advise_exception(self):
+        exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
 
-        QtGui.QApplication.instance().restoreOverrideCursor()
+        readable_ex =   traceback.format_exception(
+            exceptionType, exceptionValue, exceptionTraceback)
+
+        message = u"%s\n\n"% _("Unhandled exception - please file a bug")
+
+        for line in readable_ex:
+            message += "%s\n" % line
+        self.Advise(message, 2)
 
     #@property
     def ok_to_leave_record(self):
@@ -0,0 +1,259 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+This module provides the PatientLoadThread Class, which fetches patient
+records from the database without blocking the gui, and (when it has nothing
+else to do) prefetches the patients which are likely to be opened next.
+'''
+
+from PyQt4 import QtCore, QtSql
+
+from lib_openmolar.client.db_orm.patient_loader import PatientLoader
+from lib_openmolar.client.db_orm.patient_model import (PATIENT_QUERIES,
+    LOAD_STAGES)
+
+#: the name of the thread's own database connection
+CONNECTION_NAME = "openmolar_patient_loader"
+
+#: the number of patients from today's book which are prefetched
+PREFETCH_COUNT = 3
+
+#: the patients still to be seen today in the diary of a user
+DAY_LIST_QUERY = '''SELECT appointments.patient_id FROM appointments
+JOIN diary_entries ON diary_entries.ix = appointments.diary_entry_id
+JOIN diaries ON diaries.ix = diary_entries.diary_id
+WHERE diaries.user_id = ? AND diary_entries.finish >= now()
+AND diary_entries.start < current_date + 1
+ORDER BY diary_entries.start'''
+
+class PatientLoadThread(QtCore.QThread):
+    '''
+    loads patients on a worker thread, with a database connection of its own
+    (a clone of SETTINGS.psql_conn).
+    the record sets of each of the :attr:`LOAD_STAGES` are emitted as they
+    arrive, and a load is abandoned (between stages) if another patient is
+    requested.
+
+    prefetching is done only when no patient has been requested, and is
+    abandoned as soon as one is.
+    '''
+    #: serial, patient_id, a dictionary of record sets
+    records_loaded = QtCore.pyqtSignal(int, int, object)
+
+    #: serial, patient_id
+    load_finished = QtCore.pyqtSignal(int, int)
+
+    #: serial, patient_id, error message
+    load_failed = QtCore.pyqtSignal(int, int, object)
+
+    #: patient_id, a dictionary of (all) the record sets
+    patient_prefetched = QtCore.pyqtSignal(int, object)
+
+    def __init__(self, parent=None):
+        QtCore.QThread.__init__(self, parent)
+        self._mutex = QtCore.QMutex()
+        self._condition = QtCore.QWaitCondition()
+        self._request = None
+        self._prefetch_request = None
+        self._serial = 0
+        self._quit = False
+
+        self._source = None
+        self._connection = None
+        self._loader = None
+
+    def load(self, patient_id):
+        '''
+        request the records of patient_id, any load in progress is cancelled.
+        returns a serial number, which is emitted with the records.
+        '''
+        self._mutex.lock()
+        self._serial += 1
+        serial = self._serial
+        self._request = (serial, patient_id)
+        self._condition.wakeOne()
+        self._mutex.unlock()
+        if not self.isRunning():
+            self.start()
+        return serial
+
+    def prefetch(self, user_id, patient_ids=(), exclude=(),
+    count=PREFETCH_COUNT):
+        '''
+        when idle, load the patients in patient_ids, and the next count
+        patients on today's book for user_id (if not None),
+        skipping those in exclude.
+        replaces any previous prefetch request.
+        '''
+        self._mutex.lock()
+        self._prefetch_request = (user_id, list(patient_ids), set(exclude),
+            count)
+        self._condition.wakeOne()
+        self._mutex.unlock()
+        if not self.isRunning():
+            self.start()
+
+    def cancel(self):
+        '''
+        abandon any load in progress (its remaining stages are not emitted)
+        '''
+        self._mutex.lock()
+        self._serial += 1
+        self._request = None
+        self._mutex.unlock()
+
+    def is_stale(self, serial):
+        '''
+        True if the load with this serial number has been superseded
+        '''
+        return serial != self._serial
+
+    def stop(self):
+        '''
+        stop the thread (waiting for any query in progress to finish)
+        '''
+        self._mutex.lock()
+        self._quit = True
+        self._serial += 1
+        self._condition.wakeOne()
+        self._mutex.unlock()
+        self.wait()
+
+    def run(self):
+        while True:
+            self._mutex.lock()
+            while (self._request is None and self._prefetch_request is None
+            and not self._quit):
+                self._condition.wait(self._mutex)
+            if self._quit:
+                self._mutex.unlock()
+                break
+            request, prefetch_request = self._request, None
+            if request is None:
+                prefetch_request = self._prefetch_request
+                self._prefetch_request = None
+            self._request = None
+            self._mutex.unlock()
+
+            if request is not None:
+                self._load(*request)
+            else:
+                self._prefetch(*prefetch_request)
+        self._close()
+
+    def _get_loader(self):
+        '''
+        the :doc:`PatientLoader` for this thread's connection, which is
+        (re)opened if the application has connected to another database.
+        '''
+        if self._source is not SETTINGS.psql_conn:
+            self._close()
+            self._source = SETTINGS.psql_conn
+            self._connection = QtSql.QSqlDatabase.cloneDatabase(
+                self._source, CONNECTION_NAME)
+            if not self._connection.open():
+                error = self._connection.lastError().text()
+                self._close()
+                raise IOError(error)
+            self._loader = PatientLoader(PATIENT_QUERIES, self._connection)
+        return self._loader
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._loader, self._connection = None, None
+            QtSql.QSqlDatabase.removeDatabase(CONNECTION_NAME)
+        self._source = None
+
+    def _load(self, serial, patient_id):
+        try:
+            loader = self._get_loader()
+            for stage in LOAD_STAGES:
+                if self.is_stale(serial):
+                    LOGGER.debug("load of patient %s cancelled"% patient_id)
+                    return
+                records = loader.load(patient_id, stage)
+                self.records_loaded.emit(serial, patient_id, records)
+                if records.get("patient") == []:
+                    # no such patient, the gui will say so.
+                    return
+            self.load_finished.emit(serial, patient_id)
+        except Exception as exc:
+            LOGGER.exception("unable to load patient %s"% patient_id)
+            self.load_failed.emit(serial, patient_id, u"%s"% exc)
+
+    def _interrupted(self):
+        return self._request is not None or self._quit
+
+    def _day_list(self, user_id):
+        q_query = QtSql.QSqlQuery(self._connection)
+        q_query.prepare(DAY_LIST_QUERY)
+        q_query.addBindValue(user_id)
+        if not q_query.exec_():
+            raise IOError(q_query.lastError().text())
+        patient_ids = []
+        while q_query.next():
+            patient_ids.append(q_query.value(0).toInt()[0])
+        return patient_ids
+
+    def _prefetch(self, user_id, patient_ids, exclude, count):
+        try:
+            loader = self._get_loader()
+            day_list = []
+            if user_id is not None:
+                for patient_id in self._day_list(user_id):
+                    if not (patient_id in exclude or patient_id in day_list
+                    or patient_id in patient_ids):
+                        day_list.append(patient_id)
+            for patient_id in patient_ids + day_list[:count]:
+                if patient_id in exclude:
+                    continue
+                if self._interrupted():
+                    LOGGER.debug("prefetching interrupted")
+                    return
+                records = loader.load(patient_id)
+                if records["patient"] != []:
+                    LOGGER.debug("prefetched patient %s"% patient_id)
+                    self.patient_prefetched.emit(patient_id, records)
+        except Exception:
+            LOGGER.exception("prefetching failed")
+
+if __name__ == "__main__":
+
+    from PyQt4 import QtGui
+    from lib_openmolar.client.connect import DemoClientConnection
+
+    app = QtGui.QApplication([])
+    cc = DemoClientConnection()
+    cc.connect()
+
+    def _loaded(serial, patient_id, records):
+        print serial, patient_id, sorted(records.keys())
+
+    thread = PatientLoadThread()
+    thread.records_loaded.connect(_loaded)
+    thread.load_finished.connect(lambda *args: app.quit())
+    thread.load(1)
+    thread.load(2)
+    app.exec_()
+    thread.stop()
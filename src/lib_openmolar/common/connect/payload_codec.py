@@ -0,0 +1,208 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+decodes the compact binary payloads sent by the openmolar-server
+(see lib_openmolar.server.misc.payload_codec, which describes the format
+and must be kept in step with this module).
+'''
+
+from datetime import date, datetime, timedelta, tzinfo
+from decimal import Decimal
+import struct
+import zlib
+
+MAGIC = "OMP"
+VERSION = 1
+FLAG_ZLIB = 1
+
+#: the http header telling the server which payload formats are accepted
+HEADER = "X-Openmolar-Payload"
+
+#: the formats this client accepts
+ACCEPT = "binary, zlib"
+
+_HEAD = struct.Struct(">3sBBI")
+_INT = struct.Struct(">q")
+_LEN = struct.Struct(">I")
+_FLOAT = struct.Struct(">d")
+
+class PayloadCodecError(ValueError):
+    '''
+    raised if data cannot be decoded.
+    '''
+    pass
+
+class FixedOffset(tzinfo):
+    '''
+    the timezone of a decoded datetime which had a utc offset.
+    '''
+    def __init__(self, minutes):
+        self._offset = timedelta(minutes=minutes)
+
+    def __repr__(self):
+        return "FixedOffset(%d)"% (self._offset.days * 1440 +
+            self._offset.seconds // 60)
+
+    def utcoffset(self, dt):
+        return self._offset
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+def _parse_datetime(text):
+    '''
+    the inverse of datetime.isoformat()
+    '''
+    tz = None
+    if len(text) > 19 and text[-6] in "+-":
+        minutes = int(text[-5:-3]) * 60 + int(text[-2:])
+        tz = FixedOffset(-minutes if text[-6] == "-" else minutes)
+        text = text[:-6]
+    format_ = "%Y-%m-%dT%H:%M:%S"
+    if "." in text:
+        format_ += ".%f"
+    return datetime.strptime(text, format_).replace(tzinfo=tz)
+
+class RemoteException(Exception):
+    '''
+    an exception raised on the server, passed back in a binary payload.
+    '''
+    def __init__(self, type_name, message):
+        Exception.__init__(self, message)
+        self.type_name = type_name
+
+    def __repr__(self):
+        return "RemoteException (%s) %s"% (self.type_name, self)
+
+class Payload(object):
+    '''
+    the client side equivalent of lib_openmolar.server.misc.payload.PayLoad
+    '''
+    def __init__(self, method, permission, payload, exception):
+        self.method = method
+        self.permission = permission
+        self._payload = payload
+        self.exception = exception
+
+    def __repr__(self):
+        return "PAYLOAD - permission='%s', method='%s', payload_type=%s"% (
+            self.permission, self.method, type(self.payload))
+
+    @property
+    def payload(self):
+        if not self.permission:
+            return None
+        return self._payload
+
+    @property
+    def exception_message(self):
+        if self.exception:
+            return str(self.exception)
+        return None
+
+    @property
+    def error_message(self):
+        if self.exception_message is not None:
+            return self.exception_message
+        if not self.permission:
+            return "You do not have sufficient privileges to call %s"% (
+                self.method)
+        return ""
+
+def _decode(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == "N":
+        return None, pos
+    if tag == "T":
+        return True, pos
+    if tag == "F":
+        return False, pos
+    if tag == "i":
+        return _INT.unpack_from(data, pos)[0], pos + _INT.size
+    if tag == "d":
+        return _FLOAT.unpack_from(data, pos)[0], pos + _FLOAT.size
+    if tag in "lt":
+        count = _LEN.unpack_from(data, pos)[0]
+        pos += _LEN.size
+        items = []
+        for i in xrange(count):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return (items if tag == "l" else tuple(items)), pos
+    if tag == "D":
+        count = _LEN.unpack_from(data, pos)[0]
+        pos += _LEN.size
+        result = {}
+        for i in xrange(count):
+            key, pos = _decode(data, pos)
+            result[key], pos = _decode(data, pos)
+        return result, pos
+
+    # the remaining types are all length prefixed strings
+    length = _LEN.unpack_from(data, pos)[0]
+    pos += _LEN.size
+    chunk = data[pos:pos + length]
+    if len(chunk) != length:
+        raise PayloadCodecError("truncated payload")
+    pos += length
+    if tag == "s":
+        return chunk, pos
+    if tag == "u":
+        return chunk.decode("utf-8"), pos
+    if tag == "L":
+        return long(chunk), pos
+    if tag == "c":
+        return Decimal(chunk), pos
+    if tag == "z":
+        return _parse_datetime(chunk), pos
+    if tag == "y":
+        return datetime.strptime(chunk, "%Y-%m-%d").date(), pos
+    raise PayloadCodecError("unknown tag %r"% tag)
+
+def loads(data):
+    '''
+    decode a binary payload sent by the server.
+    returns a :doc:`Payload`
+    '''
+    try:
+        magic, version, flags, length = _HEAD.unpack_from(data, 0)
+    except struct.error:
+        raise PayloadCodecError("payload too short")
+    if magic != MAGIC or version != VERSION:
+        raise PayloadCodecError("unrecognised payload header")
+    body = data[_HEAD.size:]
+    if len(body) != length:
+        raise PayloadCodecError("truncated payload")
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    try:
+        (method, permission, payload, exc), pos = _decode(body, 0)
+    except (IndexError, ValueError, struct.error):
+        raise PayloadCodecError("malformed payload")
+    if exc is not None:
+        exc = RemoteException(*exc)
+    return Payload(method, permission, payload, exc)
@@ -21,13 +21,17 @@
 ###############################################################################
 
 
+import httplib
 import os
 import pickle
+import re
 import socket
+import time
 import xmlrpclib
 
 from lib_openmolar.common.datatypes import Connection230Data
 from lib_openmolar.common.connect import ProxyUser
+from lib_openmolar.common.connect import payload_codec
 
 class _ConnectionError(Exception):
     '''
@@ -51,6 +55,80 @@ class DuckPayload(object):
     payload = None
     error_message = "No connection"
 
+#: the http header used for session tokens
+#: (see lib_openmolar.server.misc.session_store)
+SESSION_HEADER = "X-Openmolar-Session"
+
+#: times a request refused because the server is busy (503) is retried
+BUSY_RETRIES = 3
+
+#: seconds before the first retry of a refused request (doubled each time)
+BUSY_BACKOFF = 0.25
+
+class PayloadTransport(xmlrpclib.SafeTransport):
+    '''
+    A SafeTransport which tells the server that the compact binary payload
+    format is accepted, and which asks for a session token so that
+    credentials are checked once, rather than with every request.
+    (servers which don't understand the headers ignore them, and continue
+    to send pickled payloads and to check the password)
+
+    the underlying (keep-alive) connection is reused between requests,
+    so the ssl handshake is also done once.
+    '''
+    #: the token issued by the server (or None)
+    session_token = None
+
+    #: seconds after which the server closes an idle connection
+    #: (taken from the server's Keep-Alive header)
+    keepalive_timeout = None
+
+    _last_response = 0
+
+    def __init__(self, binary_payloads=True, use_sessions=True,
+    context=None):
+        if context is None:
+            xmlrpclib.SafeTransport.__init__(self)
+        else:
+            xmlrpclib.SafeTransport.__init__(self, context=context)
+        self.binary_payloads = binary_payloads
+        self.use_sessions = use_sessions
+
+    def make_connection(self, host):
+        # don't reuse a connection which the server may be about to close
+        if (self.keepalive_timeout is not None and
+        time.time() - self._last_response > self.keepalive_timeout - 1):
+            self.close()
+        return xmlrpclib.SafeTransport.make_connection(self, host)
+
+    def send_host(self, connection, host):
+        # the authorization header is computed when the connection is made,
+        # so is swapped for the token here, on each request.
+        extra_headers = self._extra_headers
+        if self.use_sessions:
+            if self.session_token:
+                self._extra_headers = [(SESSION_HEADER, self.session_token)]
+            else:
+                self._extra_headers = list(extra_headers or []) + [
+                    (SESSION_HEADER, "new")]
+        try:
+            xmlrpclib.SafeTransport.send_host(self, connection, host)
+        finally:
+            self._extra_headers = extra_headers
+        if self.binary_payloads:
+            connection.putheader(payload_codec.HEADER, payload_codec.ACCEPT)
+
+    def parse_response(self, response):
+        token = response.getheader(SESSION_HEADER)
+        if token:
+            self.session_token = token
+        match = re.search(r"timeout=(\d+)",
+            response.getheader("Keep-Alive", ""))
+        self.keepalive_timeout = int(match.group(1)) if match else None
+        result = xmlrpclib.SafeTransport.parse_response(self, response)
+        self._last_response = time.time()
+        return result
+
 class ProxyClient(object):
     '''
     This class provides functionality for communicating with the 230 server.
@@ -58,6 +136,20 @@ class ProxyClient(object):
     '''
     _server = None
     _is_connecting = False
+    _job_methods = None
+
+    _transport = None
+
+    #: request compact binary payloads (falls back to pickle for old servers)
+    binary_payloads = True
+
+    #: authenticate once, then use a session token
+    use_sessions = True
+
+    #: an ssl.SSLContext used to check the server's certificate
+    #: (None for python's default)
+    ssl_context = None
+
     #:
     PermissionError = _PermissionError
 
@@ -90,6 +182,7 @@ class ProxyClient(object):
         #LOGGER.debug("setting proxyclient user to %s"% user)
         self.user = user
         self._server = None
+        self._transport = None
         self._is_connecting = False
 
     def use_default_user(self):
@@ -126,9 +219,13 @@ class ProxyClient(object):
 
         self._is_connecting = True
         try:
-            _server = xmlrpclib.ServerProxy(location)
+            transport = PayloadTransport(self.binary_payloads,
+                self.use_sessions, self.ssl_context)
+            _server = xmlrpclib.ServerProxy(location, transport=transport)
             socket.setdefaulttimeout(1)
+            # this call authenticates, and (if supported) gets a token
             _server.ping()
+            self._transport = transport
             LOGGER.debug("connected to OMServer as user '%s'"% self.user.name)
             self._server = _server
         except xmlrpclib.ProtocolError:
@@ -170,9 +267,19 @@ class ProxyClient(object):
         '''
         A boolean value stating whether the client is connected
         (to a proxy server)
+        this does not contact the server, the connection is considered lost
+        when a call fails.
         '''
+        return self._server is not None
+
+    def ping(self):
+        '''
+        actively check the connection to the server
+        '''
+        if self._server is None:
+            return False
         try:
-            return (self._server is not None and self.server.ping())
+            return self._call("ping")
         except Exception:
             self._server = None
             return False
@@ -210,6 +317,33 @@ class ProxyClient(object):
         payload = self.call("get_user_permissions", user, dbname)
         return payload.payload
 
+    def get_databases(self):
+        '''
+        get a list of the openmolar databases on the pg server
+        '''
+        payload = self.call("available_databases")
+        return payload.payload
+
+    def get_pg_users_perms(self, users, dbname):
+        '''
+        get the permissions of several users in one request.
+        returns a dictionary {user: permissions}
+        '''
+        matrix = self.get_pg_perms_matrix(users, [dbname])
+        return dict([(user, matrix.get(user, {}).get(dbname, {}))
+            for user in users])
+
+    def get_pg_perms_matrix(self, users, dbnames):
+        '''
+        get the permissions of several users to several databases in one
+        request.
+        returns a dictionary {user: {dbname: {"admin": bool, "client": bool}}}
+        '''
+        if not (users and dbnames):
+            return {}
+        payload = self.call("get_users_permissions", users, dbnames)
+        return payload.payload or {}
+
     def grant_pg_user_perms(
     self, user, dbname, admin=False, client=False):
         '''
@@ -220,6 +354,15 @@ class ProxyClient(object):
 
         return payload.payload
 
+    def grant_pg_perms_matrix(self, permissions):
+        '''
+        grant/revoke the permissions of several users to several databases
+        in one request (and one transaction on the server).
+        permissions is a dictionary as returned by get_pg_perms_matrix.
+        '''
+        payload = self.call("grant_users_permissions", permissions)
+        return payload.payload
+
     def get_management_functions(self):
         '''
         get a list of management functions from the omserver
@@ -234,10 +377,56 @@ class ProxyClient(object):
         payload = self.call("pre_execution_warning", func_name)
         return payload.payload
 
+    @property
+    def job_methods(self):
+        '''
+        the server functions which can be run in the background
+        (an empty tuple if the server does not support jobs)
+        '''
+        if self._job_methods is None:
+            try:
+                self._job_methods = tuple(
+                    self.call("job_methods").payload or ())
+            except Exception:
+                LOGGER.exception("server does not support jobs?")
+                self._job_methods = ()
+        return self._job_methods
+
+    def submit_job(self, func, *args):
+        '''
+        start func(*args) in the background on the server.
+        returns a job id (or None)
+        '''
+        payload = self.call("submit_job", func, *args)
+        return payload.payload
+
+    def job_status(self, job_id, log_offset=0):
+        '''
+        returns a dictionary describing the progress of the job,
+        including log lines written since log_offset.
+        '''
+        payload = self.call("job_status", job_id, log_offset)
+        return payload.payload
+
+    def cancel_job(self, job_id):
+        payload = self.call("cancel_job", job_id)
+        return payload.payload
+
+    def tail_log(self, offset=-1, level=None, inode=None):
+        '''
+        the lines written to the server log since offset.
+        returns a dictionary (see lib_openmolar.server.misc.log_tail),
+        pass its offset and inode back in to continue reading.
+        '''
+        # offsets and inodes can exceed the 32 bit range of xmlrpc integers
+        payload = self.call("tail_log", str(offset), 256 * 1024,
+            level or "", inode or "")
+        return payload.payload
+
     def call(self, func, *args):
         '''
         a wrapper to call server functions.
-        this is useful as it automatically unpickles the payloads
+        this is useful as it automatically unpacks the payloads
         this is the equivalent of self.server.func(args)
 
         returns an object of type
@@ -253,18 +442,112 @@ class ProxyClient(object):
             return duck_payload
 
         try:
-            pickled_payload = getattr(self.server, func).__call__(*args)
-            return self._unpickle(pickled_payload)
+            packed_payload = self._call(func, *args)
         except xmlrpclib.Fault:
             LOGGER.exception("xmlrpc error")
             return DuckPayload()
+        except (socket.error, xmlrpclib.ProtocolError,
+        httplib.HTTPException) as exc:
+            if getattr(exc, "errcode", None) == 503:
+                # the server is up, so the connection is kept
+                LOGGER.warning("%s is busy - %s"% (self.name, exc))
+                duck_payload = DuckPayload()
+                duck_payload.error_message = _(
+                    "The server is busy - please try again")
+                return duck_payload
+            LOGGER.error("lost connection to %s - %s"% (self.name, exc))
+            self._server = None
+            duck_payload = DuckPayload()
+            duck_payload.error_message = u"%s - %s"% (
+                _("Lost connection to the server"), exc)
+            return duck_payload
+        return self._unpack(packed_payload)
 
-    def _unpickle(self, pickled_payload):
+    def call_many(self, calls):
+        '''
+        call several server functions in a single request.
+        calls is a sequence of tuples (func, args)
+
+        returns a list of :doc:`PayLoad` objects (or DuckTypes thereof)
+        in the order of the calls.
+        NOTE - unlike call, PermissionErrors and server exceptions are not
+        raised, check the permission and exception attributes of each
+        payload.
+        '''
+        calls = [(func, list(args)) for func, args in calls]
+        if not calls:
+            return []
+        try:
+            payload = self.call("call_many", calls)
+        except Exception:
+            LOGGER.warning("server does not support call_many?")
+            return [self._call_payload(func, *args) for func, args in calls]
+        if payload.payload is None:
+            # no connection
+            return [payload for call in calls]
+        results = []
+        for method, permission, result, exc in payload.payload:
+            if exc is not None:
+                exc = payload_codec.RemoteException(*exc)
+            results.append(
+                payload_codec.Payload(method, permission, result, exc))
+        return results
+
+    def _call_payload(self, func, *args):
         '''
-        XMLRPC can not pass python objects, so they are pickled by the server
-        and unpickled here.
+        call a function, returning (rather than raising) permission errors
+        and exceptions in the payload.
         '''
-        payload = pickle.loads(pickled_payload)
+        try:
+            return self.call(func, *args)
+        except self.PermissionError:
+            return payload_codec.Payload(func, False, None, None)
+        except Exception as exc:
+            return payload_codec.Payload(func, True, None, exc)
+
+    def _call(self, func, *args):
+        '''
+        call a function on the server.
+        if the server is busy, wait and retry, and if the session token has
+        expired, authenticate again and retry
+        (a refused request has not been executed, so this is safe).
+        '''
+        delay = BUSY_BACKOFF
+        for attempt in range(BUSY_RETRIES):
+            try:
+                return self._call_authenticated(func, *args)
+            except xmlrpclib.ProtocolError as exc:
+                if exc.errcode != 503:
+                    raise
+            LOGGER.info("server busy - retrying in %s seconds"% delay)
+            if self._transport:
+                # the server closed the connection
+                self._transport.close()
+            time.sleep(delay)
+            delay *= 2
+        return self._call_authenticated(func, *args)
+
+    def _call_authenticated(self, func, *args):
+        try:
+            return getattr(self._server, func)(*args)
+        except xmlrpclib.ProtocolError as exc:
+            if exc.errcode != 401 or not (
+            self._transport and self._transport.session_token):
+                raise
+            LOGGER.info("session token refused - authenticating again")
+            self._transport.session_token = None
+            return getattr(self._server, func)(*args)
+
+    def _unpack(self, packed_payload):
+        '''
+        XMLRPC can not pass python objects, so the server sends them either
+        in a compact binary format (as xmlrpclib.Binary)
+        or pickled (older servers).
+        '''
+        if isinstance(packed_payload, xmlrpclib.Binary):
+            payload = payload_codec.loads(packed_payload.data)
+        else:
+            payload = pickle.loads(packed_payload)
 
         if not payload.permission:
             raise self.PermissionError
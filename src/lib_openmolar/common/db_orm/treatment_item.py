@@ -35,6 +35,14 @@ from insertable_record import InsertableRecord
 
 PROCEDURE_CODES = proc_codes.ProcedureCodesInstance()
 
+#: the metadata of a treatment item
+METADATA_QUERY = '''select
+tooth, tx_type, surfaces, material, type, technition from treatment_teeth
+left join treatment_fills  on treatment_fills.tooth_tx_id = treatment_teeth.ix
+left join treatment_crowns on treatment_crowns.tooth_tx_id = treatment_teeth.ix
+where treatment_teeth.treatment_id = ?
+'''
+
 class TreatmentItemException(Exception):
     '''
     a custom exception raised by treatment item errors
@@ -293,7 +301,7 @@ class TreatmentItem(object):
     #:
     OTHER = proc_codes.ProcCode.OTHER
 
-    def __init__(self, param):
+    def __init__(self, param, metadata=None):
         '''
         *overloaded function*
 
@@ -301,6 +309,10 @@ class TreatmentItem(object):
 
         will load values from the Record
 
+        :kword metadata: a list of QSqlRecords (see :attr:`METADATA_QUERY`)
+            if the metadata for this item has already been loaded,
+            otherwise it is polled from the database when needed.
+
         :param: string
 
         string should be of the form "A01"
@@ -336,6 +348,9 @@ class TreatmentItem(object):
 
         if self.in_database:
             self._from_record()
+            if metadata is not None:
+                self._metadata = [TreatmentItemMetadata(self, record)
+                    for record in metadata]
         else:
             if SETTINGS.current_practitioner:
                 self.set_px_clinician(SETTINGS.current_practitioner.id)
@@ -361,14 +376,8 @@ class TreatmentItem(object):
         poll the database to get metadata associated with this item
         '''
         self._metadata = []
-        query = '''select
-tooth, tx_type, surfaces, material, type, technition from treatment_teeth
-left join treatment_fills  on treatment_fills.tooth_tx_id = treatment_teeth.ix
-left join treatment_crowns on treatment_crowns.tooth_tx_id = treatment_teeth.ix
-where treatment_teeth.treatment_id = ?
-'''
         q_query = QtSql.QSqlQuery(SETTINGS.psql_conn)
-        q_query.prepare(query)
+        q_query.prepare(METADATA_QUERY)
         q_query.addBindValue(self.id)
         q_query.exec_()
         while q_query.next():
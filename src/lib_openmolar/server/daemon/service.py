@@ -25,14 +25,30 @@
 and the book python for sysadmins (which I own)
 '''
 
+import errno
 import os
+import signal
 import sys
+import time
 
-from signal import SIGTERM
+from signal import SIGTERM, SIGHUP, SIGKILL
 
 PIDFILE = "/var/run/openmolar/server.pid"
 
+#: seconds between the master process's checks on its workers
+SUPERVISE_INTERVAL = 1
+
+#: seconds a worker process is given to finish its requests when stopped
+STOP_TIMEOUT = 30
+
 class Service(object):
+    '''
+    start, stop and query a daemon process, identified by PIDFILE.
+
+    the daemon may optionally fork worker processes (see prefork)
+    '''
+    #: the number of worker processes wanted by prefork
+    processes = 0
 
     def write_pidfile(self):
         dirname = os.path.dirname(PIDFILE)
@@ -112,7 +128,171 @@ class Service(object):
         os.dup2(so.fileno(), sys.stdout.fileno())
         os.dup2(se.fileno(), sys.stderr.fileno())
 
-    def stop_(self):
+    def prefork(self, worker):
+        '''
+        run as a master process, forking self.processes copies of this
+        process, each of which calls worker() and exits when it returns.
+        (the workers share any sockets opened before prefork is called)
+
+        workers which die are replaced.
+        on SIGHUP (see reload_) all workers are gracefully replaced, new
+        workers being started before the old are asked to stop.
+        on SIGTERM (see stop_) the workers are stopped, and prefork returns.
+
+        workers are stopped with SIGTERM, and should finish the requests
+        they are handling before exiting.
+        '''
+        self._worker = worker
+        self._children = {}     # pid: generation
+        self._generation = 0
+        self._stopping = False
+        self._hup = False
+        signal.signal(SIGTERM, self._master_signal)
+        signal.signal(SIGHUP, self._master_signal)
+
+        LOGGER.info("master process %d supervising %d workers"% (
+            os.getpid(), self.processes))
+        while not self._stopping:
+            self._reap()
+            hup, self._hup = self._hup, False
+            if self.supervise_(hup) or hup:
+                self.replace_workers_()
+            if not self._stopping:
+                self._spawn()
+                time.sleep(SUPERVISE_INTERVAL)
+        self.release_()
+        self.stop_workers_()
+        LOGGER.info("master process %d exiting"% os.getpid())
+
+    def _master_signal(self, signum, frame):
+        if signum == SIGHUP:
+            self._hup = True
+        else:
+            self._stopping = True
+
+    def supervise_(self, hup):
+        '''
+        called by the master process every SUPERVISE_INTERVAL seconds
+        (with hup=True if a SIGHUP has been received).
+        reimplement to reload settings, and return True if the workers
+        should be replaced.
+        '''
+        return False
+
+    def release_(self):
+        '''
+        called by the master process when stopping, before waiting for the
+        workers to finish.
+        reimplement to close shared resources (eg. a listening socket, so
+        that a new server can bind to it at once).
+        '''
+        pass
+
+    def _spawn(self):
+        '''
+        fork workers until the current generation is at full strength.
+        '''
+        current = [pid for pid, generation in self._children.iteritems()
+            if generation == self._generation]
+        for i in range(self.processes - len(current)):
+            try:
+                pid = os.fork()
+            except OSError:
+                LOGGER.exception("unable to fork a worker process")
+                return
+            if pid == 0:
+                self._children = {}
+                signal.signal(SIGTERM, signal.SIG_DFL)
+                signal.signal(SIGHUP, signal.SIG_DFL)
+                status = 1
+                try:
+                    self._worker()
+                    status = 0
+                except:
+                    LOGGER.exception("worker process %d failed"% os.getpid())
+                finally:
+                    os._exit(status)
+            LOGGER.info("started worker process %d"% pid)
+            self._children[pid] = self._generation
+
+    def _reap(self):
+        '''
+        collect the exit status of any workers which have died.
+        '''
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                if exc.errno == errno.ECHILD:
+                    self._children = {}
+                break
+            if pid == 0:
+                break
+            generation = self._children.pop(pid, None)
+            if generation == self._generation and not self._stopping:
+                LOGGER.error(
+                    "worker process %d died (status %d) - replacing it"% (
+                    pid, status))
+            else:
+                LOGGER.info("worker process %d has stopped"% pid)
+
+    def _signal_workers(self, signum, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def replace_workers_(self):
+        '''
+        start a new generation of workers, and ask the old to stop.
+        '''
+        LOGGER.info("replacing worker processes")
+        old = self._children.keys()
+        self._generation += 1
+        self._spawn()
+        self._signal_workers(SIGTERM, old)
+
+    def stop_workers_(self, timeout=STOP_TIMEOUT):
+        '''
+        ask all workers to stop, and wait for them to do so.
+        any still running after timeout seconds are killed.
+        '''
+        self._signal_workers(SIGTERM, self._children.keys())
+        deadline = time.time() + timeout
+        while self._children and time.time() < deadline:
+            time.sleep(0.1)
+            self._reap()
+        if self._children:
+            LOGGER.warning("killing worker processes %s"% self._children.keys())
+            self._signal_workers(SIGKILL, self._children.keys())
+            time.sleep(0.1)
+            self._reap()
+
+    def reload_(self):
+        '''
+        send SIGHUP to the running process, which should reload its settings
+        (and replace its workers).
+        '''
+        try:
+            pidfile = open(PIDFILE, "r")
+            pid = pidfile.readline()
+            LOGGER.info("Reloading the openmolar_server. " +
+                "With pid number %s" % pid)
+            os.kill(int(pid), SIGHUP)
+        except OSError:
+            LOGGER.error("Could not signal process")
+        except IOError:
+            LOGGER.warning("PID file not found when reloading server.")
+            LOGGER.warning("openmolar-server may not be running?")
+
+    def stop_(self, wait=0):
+        '''
+        send SIGTERM to the running process, and remove the PIDfile.
+        if wait is given, wait up to that many seconds for the process to exit.
+        '''
         try:
             pidfile = open(PIDFILE, "r")
             pid = pidfile.readline()
@@ -120,6 +300,8 @@ class Service(object):
                 "With pid number %s" % pid)
             os.kill(int(pid), SIGTERM)
             os.remove(PIDFILE)
+            if wait:
+                self._wait_for_exit(int(pid), wait)
 
         except OSError, e:
             LOGGER.error("Could not kill process")
@@ -132,6 +314,17 @@ class Service(object):
             LOGGER.warning("PID file not found when stopping server.")
             LOGGER.warning("openmolar-server may not be running?")
 
+    def _wait_for_exit(self, pid, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                return True
+            time.sleep(0.2)
+        LOGGER.warning("process %d has not exited"% pid)
+        return False
+
     def status_(self):
         '''
         Check the status of the process (running | not running)
@@ -163,11 +356,13 @@ def _test():
         sd.start_()
     elif "stop" in sys.argv:
         sd.stop_()
+    elif "reload" in sys.argv:
+        sd.reload_()
     elif "status" in sys.argv:
         sd.status_()
     else:
         LOGGER.warning("nothing to do")
-        LOGGER.info("please pass 'start | stop | status' as arguments")
+        LOGGER.info("please pass 'start | stop | reload | status' as arguments")
 
 if __name__ == "__main__":
     import logging
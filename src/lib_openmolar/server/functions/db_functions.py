@@ -20,16 +20,90 @@
 ##                                                                           ##
 ###############################################################################
 
+from contextlib import contextmanager
 from datetime import datetime
+import errno
+import fcntl
+import hashlib
 import os
 import re
 import subprocess
 import sys
+import time
 import psycopg2
 
 from lib_openmolar.server.misc.password_generator import new_password
-from lib_openmolar.server.misc.om_server_config import OMServerConfig
+from lib_openmolar.server.misc.om_server_config import shared_config, RUN_DIR
 from lib_openmolar.server.misc.backup_config import BackupConfig
+from lib_openmolar.server.misc.pg_dump import PgDump, read_record
+from lib_openmolar.server.misc.restore_verifier import (RestoreVerifier,
+    row_counts, read_verification)
+from lib_openmolar.server.misc.job_manager import (
+    report_progress, check_cancelled, current_job)
+
+SCHEMA_FILE = "/usr/share/openmolar/latest_schema.sql"
+PERMISSIONS_FILE = "/usr/share/openmolar/latest_permissions.sql"
+
+#: new databases are cloned from a template database laid out with the
+#: current schema, named TEMPLATE_PREFIX + schema version
+TEMPLATE_PREFIX = "openmolar_template_"
+
+#: a lock file held whilst the template database is checked or built,
+#: so that the worker processes of the server do not build it at once
+TEMPLATE_LOCK_FILE = os.path.join(RUN_DIR, "template.lock")
+
+#: lock files in the backup directory, one per backup allowed to run at once
+#: (so the limit holds for all the worker processes of the server)
+BACKUP_SLOT_FILE = ".backup_slot_%d.lock"
+
+#: seconds between attempts to take a backup slot
+BACKUP_SLOT_POLL = 2
+
+#: the tables and sequences of the public schema, with the table which
+#: owns each sequence (if any)
+RESET_PLAN_QUERY = '''
+SELECT c.relkind, quote_ident(c.relname), c.relname, owner.relname
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_catalog.pg_depend d ON d.objid = c.oid
+    AND d.classid = 'pg_catalog.pg_class'::regclass
+    AND d.refclassid = 'pg_catalog.pg_class'::regclass
+    AND d.deptype IN ('a', 'i')
+LEFT JOIN pg_catalog.pg_class owner ON owner.oid = d.refobjid
+WHERE n.nspname = 'public' AND c.relkind IN ('r', 'S')
+ORDER BY c.relkind, c.relname
+'''
+
+#: the permission groups of each database
+PERMISSION_GROUPS = ("admin", "client")
+
+#: the memberships of the users (first parameter) in the roles (second)
+MEMBERSHIP_QUERY = '''
+SELECT member.rolname, grp.rolname FROM pg_catalog.pg_auth_members m
+JOIN pg_catalog.pg_roles member ON member.oid = m.member
+JOIN pg_catalog.pg_roles grp ON grp.oid = m.roleid
+WHERE member.rolname = ANY(%s) AND grp.rolname = ANY(%s)
+'''
+
+def role_name(name):
+    '''
+    the name postgres gives a role created with the unquoted identifier name
+    (users and groups are created unquoted, so are case folded)
+    '''
+    return name.lower()
+
+def group_role(group, dbname):
+    '''
+    the name of the role granting group ("admin" or "client") permissions
+    on database dbname
+    '''
+    return role_name("om_%s_group_%s"% (group, dbname))
+
+def quote_ident(name):
+    '''
+    quote a role name for use in a statement
+    '''
+    return '"%s"'% name.replace('"', '""')
 
 def log_exception(func):
     def db_func(*args, **kwargs):
@@ -45,24 +119,8 @@ class DBFunctions(object):
     A class whose functions will be inherited by the server
     '''
     def __init__(self):
-        self.config = OMServerConfig()
-
-    @property
-    def default_conn_atts(self):
-        return self.__conn_atts()
-
-    def __conn_atts(self, dbname="openmolar_master"):
-        '''
-        has to be a private function because of the password!
-        a well set up server will restrict user "openmolar"
-        to a unix socket connection (ie local machine only)
-        or at the very least a TCP/IP connection to only localhost.
-        (function doesn't get picked up by register_instance)
-        '''
-        return "host='%s' user='%s' port='%s' password='%s' dbname='%s'"% (
-            self.config.postgres_host, self.config.postgres_user,
-            self.config.postgres_port,
-            self.config.postgres_pass, dbname)
+        self.config = shared_config()
+        self._restore_verifier = RestoreVerifier(self)
 
     @log_exception
     def _execute(self, statement, dbname="openmolar_master"):
@@ -70,43 +128,34 @@ class DBFunctions(object):
         execute an sql statement with default connection rights.
         '''
         try:
-            conn = psycopg2.connect(self.__conn_atts(dbname))
-            try:
-                # functions such as create and drop do not support transactions
-                conn.autocommit = True
-            except AttributeError:
-                LOGGER.warning(
-                    "no autocommit attribute in pyscopg2 - old version?")
-                conn.set_isolation_level(0)
-
-            cursor = conn.cursor()
-            LOGGER.debug(statement)
-            cursor.execute(statement)
-            conn.close()
+            # functions such as create and drop do not support transactions
+            with self._connection(dbname, autocommit=True) as conn:
+                cursor = conn.cursor()
+                LOGGER.debug(statement)
+                cursor.execute(statement)
             return True
         except psycopg2.Warning as warn:
             LOGGER.warning(warn)
-            conn.close()
             return True
         except psycopg2.Error as exc:
             LOGGER.exception("error executing statement")
             LOGGER.error(statement)
             raise exc
 
-    @log_exception
-    def newDB_sql(self, dbname):
+    def _read_sql(self, path):
+        LOGGER.info("reading sql from %s"% path)
+        f = open(path, "r")
+        sql = f.read()
+        f.close()
+        return sql
+
+    def _permissions_sql(self, dbname):
         '''
-        returns the sql to layout the users and tables in a database.
-        returns the sql to layout the users and tables in a database.
+        returns the sql to create the user groups for a database,
+        and grant them their permissions.
         '''
-        sql_file = "/usr/share/openmolar/latest_schema.sql"
-        perms_file = "/usr/share/openmolar/latest_permissions.sql"
-
-        LOGGER.info("reading sql from %s"% sql_file)
-        LOGGER.info("reading sql from %s"% perms_file)
-
         groups = {}
-        perms, sql = "",""
+        sql = ""
 
         for group in ('admin', 'client'):
             groupname = "om_%s_group_%s"% (group, dbname)
@@ -117,20 +166,127 @@ class DBFunctions(object):
             groups[group] = groupname
 
         try:
-            f = open(sql_file, "r")
-            sql += f.read()
-            f.close()
-
-            f = open(perms_file, "r")
-            perms = f.read()
-            f.close()
+            perms = self._read_sql(PERMISSIONS_FILE)
         except IOError:
             LOGGER.exception("error reading sql files.")
+            perms = ""
 
-        permissions = perms.replace("ADMIN_GROUP", groups["admin"]).replace(
+        return sql + perms.replace("ADMIN_GROUP", groups["admin"]).replace(
                             "CLIENT_GROUP", groups["client"])
 
-        return sql + permissions
+    @log_exception
+    def newDB_sql(self, dbname):
+        '''
+        returns the sql to layout the users and tables in a database.
+        '''
+        try:
+            schema = self._read_sql(SCHEMA_FILE)
+        except IOError:
+            LOGGER.exception("error reading sql files.")
+            schema = ""
+
+        return schema + self._permissions_sql(dbname)
+
+    def _template_fingerprint(self, template):
+        '''
+        the checksum of the schema a template was built from
+        (stored as the comment on the database), or None if the template
+        does not exist.
+        '''
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''select shobj_description(oid, 'pg_database')
+                from pg_database where datname = %s''', (template,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0] or ""
+
+    @contextmanager
+    def _file_lock(self, path):
+        '''
+        hold an exclusive lock on the file at path (waiting for any other
+        thread or process holding it).
+        yields True, or False (having logged why) if the file could not be
+        locked.
+        '''
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            lock = open(path, "a")
+        except (IOError, OSError):
+            LOGGER.exception("unable to open lock file %s"% path)
+            yield False
+            return
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            except IOError:
+                LOGGER.exception("unable to lock %s"% path)
+                yield False
+            else:
+                yield True
+        finally:
+            lock.close()
+
+    def _drop_old_templates(self, current):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''select datname from pg_database
+                where datname like %s and datname != %s''',
+                (TEMPLATE_PREFIX + "%", current))
+            old_templates = [row[0] for row in cursor.fetchall()]
+        for template in old_templates:
+            LOGGER.info("removing outdated template database %s"% template)
+            self._pools.discard(template)
+            self._execute("drop database if exists %s"% template)
+
+    def _schema_template(self):
+        '''
+        returns the name of a template database laid out with the
+        current schema, (re)building it if the schema file has changed.
+        returns None if no template is available.
+        '''
+        try:
+            schema = self._read_sql(SCHEMA_FILE)
+        except IOError:
+            LOGGER.exception("error reading sql files.")
+            return None
+
+        match = re.search(r"'schema_version',\s*'([^']+)'", schema)
+        version = match.group(1) if match else "unknown"
+        template = TEMPLATE_PREFIX + re.sub(r"\W", "_", version)
+        fingerprint = hashlib.sha1(schema).hexdigest()
+
+        with self._file_lock(TEMPLATE_LOCK_FILE) as locked:
+            if not locked:
+                # create_db lays out the schema itself
+                return None
+            try:
+                if self._template_fingerprint(template) == fingerprint:
+                    return template
+            except psycopg2.Error:
+                LOGGER.exception("unable to check template %s"% template)
+                return None
+
+            LOGGER.info("building template database %s"% template)
+            report_progress(10, "building template database %s"% template)
+            self._pools.discard(template)
+            self._execute("drop database if exists %s"% template)
+            if not self._execute(
+            "create database %s with owner openmolar"% template):
+                return None
+            built = (self._execute(schema, template) and
+                self._execute("comment on database %s is '%s'"% (
+                template, fingerprint)))
+            # a database cannot be used as a template whilst connected
+            self._pools.discard(template)
+            if not built:
+                LOGGER.error("unable to build template %s"% template)
+                self._execute("drop database if exists %s"% template)
+                return None
+            self._drop_old_templates(template)
+        return template
 
     @log_exception
     def create_demodb(self):
@@ -145,10 +301,26 @@ class DBFunctions(object):
         creates a database with the name given
         '''
         try:
-            LOGGER.info("creating new database %s [with owner openmolar]"% dbname)
-            self._execute("create database %s with owner openmolar"% dbname)
-
-            return self._layout_schema(dbname)
+            report_progress(5, "creating database %s"% dbname)
+            template = self._schema_template()
+            check_cancelled()
+            if template and self._execute(
+            "create database %s with owner openmolar template %s"% (
+            dbname, template)):
+                LOGGER.info("created new database %s from template %s"% (
+                    dbname, template))
+                report_progress(60, "applying permissions for %s"% dbname)
+                result = self._execute(self._permissions_sql(dbname), dbname)
+                report_progress(100, "database %s created"% dbname)
+            else:
+                LOGGER.info(
+                    "creating new database %s [with owner openmolar]"% dbname)
+                self._execute("create database %s with owner openmolar"%
+                    dbname)
+                check_cancelled()
+                result = self._layout_schema(dbname)
+            self._invalidate_dashboard()
+            return result
         except:
             LOGGER.exception("exeption in %(module)s")
         return False
@@ -162,8 +334,10 @@ class DBFunctions(object):
             sql = self.newDB_sql(dbname)
 
             LOGGER.info("laying out schema for database '%s'"% dbname)
+            report_progress(20, "laying out schema for database %s"% dbname)
 
             self._execute(sql, dbname)
+            report_progress(100, "schema laid out")
             return True
         except:
             LOGGER.exception("exeption in %(module)s")
@@ -201,8 +375,11 @@ class DBFunctions(object):
         LOGGER.warning("user '%s' is deleting database %s" %(
             self._user, dbname))
         LOGGER.warning("removing database (if exists) %s"% dbname)
+        # pooled connections to the database would prevent the drop
+        self._pools.discard(dbname)
         if self._execute('drop database if exists %s;'% dbname):
             LOGGER.info("database '%s' removed"% dbname)
+            self._invalidate_dashboard()
         else:
             return False
 
@@ -241,11 +418,88 @@ class DBFunctions(object):
             self._execute(
                 "alter user %s with login encrypted password '%s' "% (
                     username, password))
+            self._invalidate_dashboard()
             return True
         except Exception:
             LOGGER.exception("Serious Error")
         return False
 
+    def _memberships(self, cursor, users, dbnames):
+        '''
+        the permissions of each user on each database, read in one query.
+        returns a dictionary {user: {dbname: {"admin": bool, "client": bool}}}
+        '''
+        groups = {}
+        for dbname in dbnames:
+            for group in PERMISSION_GROUPS:
+                groups[group_role(group, dbname)] = (dbname, group)
+        users_of_role = {}
+        for user in users:
+            users_of_role.setdefault(role_name(user), []).append(user)
+        cursor.execute(MEMBERSHIP_QUERY, (users_of_role.keys(), groups.keys()))
+        perms = {}
+        for user in users:
+            perms[user] = {}
+            for dbname in dbnames:
+                perms[user][dbname] = dict(
+                    [(group, False) for group in PERMISSION_GROUPS])
+        for member, role in cursor.fetchall():
+            dbname, group = groups[role]
+            for user in users_of_role[member]:
+                perms[user][dbname][group] = True
+        return perms
+
+    @log_exception
+    def get_users_permissions(self, users, dbnames):
+        '''
+        get the permissions of several users to several databases
+        returns a dict of dicts.
+        {user: {dbname: {"admin":True, "client":False}}}
+        '''
+        LOGGER.debug("getting priv groups for users %s on databases %s"% (
+            users, dbnames))
+        with self._connection() as conn:
+            return self._memberships(conn.cursor(), users, dbnames)
+
+    @log_exception
+    def grant_users_permissions(self, permissions):
+        '''
+        grant/revoke permissions for several users to several databases,
+        in one transaction.
+        permissions is a dict of dicts (as returned by get_users_permissions)
+        groups which are not given are left unchanged.
+        returns the number of grants and revokes made.
+        '''
+        users = sorted(permissions)
+        dbnames = sorted(set(
+            [dbname for dbs in permissions.values() for dbname in dbs]))
+        statements = []
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            current = self._memberships(cursor, users, dbnames)
+            for user in users:
+                for dbname, groups in sorted(permissions[user].items()):
+                    for group, granted in sorted(groups.items()):
+                        if group not in PERMISSION_GROUPS:
+                            raise ValueError(
+                                "unknown permission group '%s'"% group)
+                        if bool(granted) == current[user][dbname][group]:
+                            continue
+                        role = quote_ident(group_role(group, dbname))
+                        member = quote_ident(role_name(user))
+                        if granted:
+                            statements.append("GRANT %s TO %s"% (
+                                role, member))
+                        else:
+                            statements.append("REVOKE %s FROM %s"% (
+                                role, member))
+            if statements:
+                LOGGER.info("changing priv groups - %s"% "; ".join(
+                    statements))
+                cursor.execute(";\n".join(statements))
+            conn.commit()
+        return len(statements)
+
     @log_exception
     def grant_user_permissions(self, user, dbname, admin=True,
     client=True):
@@ -253,23 +507,9 @@ class DBFunctions(object):
         grant/revoke permissions for a user to database dbname
         '''
         LOGGER.info("adding %s to priv groups on database %s"% (user, dbname))
-
-        SQL = ""
-        if admin:
-            SQL += "GRANT om_admin_group_%s to %s;\n"% (dbname, user)
-        else:
-            SQL += "REVOKE om_admin_group_%s from %s;\n"% (dbname, user)
-        if client:
-            SQL += "GRANT om_client_group_%s to %s;\n"% (dbname, user)
-        else:
-            SQL += "REVOKE om_client_group_%s from %s;\n"% (dbname, user)
-
-        try:
-            self._execute(SQL, dbname)
-            return True
-        except Exception:
-            LOGGER.exception("Serious Error")
-        return False
+        result = self.grant_users_permissions(
+            {user: {dbname: {"admin": admin, "client": client}}})
+        return result != ""
 
     @log_exception
     def get_user_permissions(self, user, dbname):
@@ -278,23 +518,9 @@ class DBFunctions(object):
         returns a dict.
         {"admin":True,"client":True}
         '''
-        LOGGER.debug(
-            "getting priv groups for user '%s' on dbase '%s'"% (user, dbname))
-        conn = psycopg2.connect(self.__conn_atts(dbname))
-        cursor = conn.cursor()
-        cursor.execute('''
-        select rolname from pg_user
-        join pg_auth_members on (pg_user.usesysid=pg_auth_members.member)
-        join pg_roles on (pg_roles.oid=pg_auth_members.roleid)
-        where pg_user.usename=%s'''
-        , (user,))
-        perms = {}
-
-        for rolname in cursor.fetchall():
-            for group in ["admin","client"]:
-                if re.match("om_%s_group_%s"% (group, dbname), rolname[0]):
-                    perms[group] = True
-        return perms
+        perms = self.get_users_permissions([user], [dbname])
+        return dict([(group, True) for group, granted in
+            perms[user][dbname].items() if granted])
 
     @log_exception
     def drop_demo_user(self):
@@ -311,6 +537,7 @@ class DBFunctions(object):
         LOGGER.warning("removing user %s"% username)
         if self._execute('drop user %s;'% username):
             LOGGER.info("user '%s' removed"% username)
+            self._invalidate_dashboard()
             return True
         return False
 
@@ -331,31 +558,26 @@ class DBFunctions(object):
         return False
 
 
-    def _tables(self, dbname):
+    def _reset_plan(self, cursor, exceptions):
         '''
-        returns all the table names in schema dbname
-        '''
-        conn = psycopg2.connect(self.__conn_atts(dbname))
-        cursor = conn.cursor()
-        cursor.execute(
-        "SELECT tablename FROM pg_tables WHERE schemaname='public'")
-        for tablename in cursor.fetchall():
-            yield tablename[0]
+        introspect the public schema in a single query.
+        returns (tables, sequences) - lists of quoted identifiers of the
+        tables to be truncated, and the sequences to be reset.
 
-    def _sequences(self, dbname, exceptions):
-        '''
-        returns all the sequences in schema dbname
-        exceptions is a list of tables whose sequences are to be ignored.
+        sequences owned by a truncated table are reset by
+        TRUNCATE .. RESTART IDENTITY, those owned by tables in exceptions
+        are left alone, so only free standing sequences are returned
+        (and these are ignored if their name starts with an exception).
         '''
-        conn = psycopg2.connect(self.__conn_atts(dbname))
-        cursor = conn.cursor()
-        cursor.execute(
-        "select sequence_name from information_schema.sequences")
-        for sequence_name in cursor.fetchall():
-            for exception in exceptions:
-                if sequence_name[0].startswith(exception):
-                    continue
-            yield sequence_name[0]
+        cursor.execute(RESET_PLAN_QUERY)
+        tables, sequences = [], []
+        for kind, quoted_name, name, owner in cursor.fetchall():
+            if kind == "r":
+                if name not in exceptions:
+                    tables.append(quoted_name)
+            elif owner is None and not name.startswith(tuple(exceptions)):
+                sequences.append(quoted_name)
+        return tables, sequences
 
     def truncate_demo(self):
         '''
@@ -373,61 +595,165 @@ class DBFunctions(object):
 
         exceptions = ("settings", "procedure_codes", "text_fields")
 
-        for tablename in self._tables(dbname):
-            if tablename not in exceptions:
-                LOGGER.info("... truncating '%s'"% tablename)
-                self._execute("TRUNCATE %s CASCADE"% tablename, dbname)
-        for sequence in self._sequences(dbname, exceptions):
-            LOGGER.info("... reseting sequence '%s'"% sequence)
-            self._execute("select setval('%s', 1, false)"% sequence,
-                dbname)
+        with self._connection(dbname) as conn:
+            cursor = conn.cursor()
+            tables, sequences = self._reset_plan(cursor, exceptions)
+            report_progress(10, "truncating %d tables, resetting %d sequences"
+                % (len(tables), len(sequences)))
+            check_cancelled()
+
+            # one statement, one transaction - all or nothing
+            statement = ""
+            if tables:
+                # (% is escaped, as the statement is passed parameters)
+                statement += "TRUNCATE %s RESTART IDENTITY CASCADE;"% (
+                    ", ".join(tables).replace("%", "%%"))
+            if sequences:
+                statement += (" SELECT setval(seq::regclass, 1, false) "
+                    "FROM unnest(%(sequences)s) AS seq;")
+            if statement:
+                LOGGER.debug(statement)
+                cursor.execute(statement, {"sequences": sequences})
+            conn.commit()
+
+        LOGGER.info("truncated %s (%s) and reset sequences (%s)"% (
+            dbname, ", ".join(tables), ", ".join(sequences)))
         return True
 
-    @log_exception
+    def _take_backup_slot(self, dbname, backup_config):
+        '''
+        wait until fewer than backup_config.max_concurrent backups are running
+        (in any process), then lock a slot.
+        returns the lock file, closing it frees the slot.
+        only a job waits, a backup called directly (which holds one of the
+        threads handling requests) raises IOError if no slot is free.
+        '''
+        backup_root = PgDump(self.config, backup_config).backup_root
+        if not os.path.isdir(backup_root):
+            os.makedirs(backup_root)
+        waiting = False
+        while True:
+            for i in range(backup_config.max_concurrent):
+                path = os.path.join(backup_root, BACKUP_SLOT_FILE% i)
+                slot = open(path, "a")
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot
+                except IOError as exc:
+                    slot.close()
+                    if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+            if current_job() is None:
+                raise IOError("unable to back up %s - another backup is "
+                    "running, please try again later"% dbname)
+            if not waiting:
+                LOGGER.info("backup of %s waiting for others to finish"%
+                    dbname)
+                report_progress(0, "waiting for other backups to finish")
+                waiting = True
+            time.sleep(BACKUP_SLOT_POLL)
+            check_cancelled()
+
     def backup_db(self, dbname, schema_only=False):
         '''
-        calls a pg_dump (using db user openmolar)
+        calls a pg_dump (using db user openmolar), streaming the output to a
+        file in the backup directory (see :doc:`BackupConfig`).
         if schema_only is True, then the -s option is passed into pg_dump.
+        returns the path of the backup file.
+        raises IOError if too many backups are running (unless run as a job,
+        which waits its turn).
         '''
         LOGGER.info("backing up %s"% dbname)
-
-        opts = ["-s", dbname] if schema_only else [dbname]
-
-        proc = subprocess.Popen(
-            ["pg_dump", "-h", "127.0.0.1",
-            "-U", "openmolar", "-W"] + opts,
-            stdin = subprocess.PIPE,
-            stdout=subprocess.PIPE)
-
-        proc.stdin.write(self.MASTER_PWORD)
-        proc.stdin.flush()
-
-        stdout, stderr = proc.communicate()
-
-        if stderr:
-            LOGGER.warning("Errors were thrown %s"% stderr)
-
+        backup_config = BackupConfig()
+        slot = self._take_backup_slot(dbname, backup_config)
         try:
-            BACKUP_DIR = BackupConfig().backup_dir
-        except IOError:
-            BACKUP_DIR = "/usr/share/openmolar/backups/"
+            return self._backup_db(dbname, schema_only, backup_config)
+        finally:
+            slot.close()
 
-        backup_dir = os.path.join(BACKUP_DIR, dbname)
-
-        if not os.path.isdir(backup_dir):
-            os.makedirs(backup_dir)
-
-        filename = "schema"% now if schema_only else "backup"
-
-        filename += datetime.now().strftime("%Y%m%d_%H%M%S") + ".sql"
-
-        filepath = os.path.join(backup_dir, filename)
-
-        f = open(filepath, "w")
-        f.write(stdout)
-        f.close()
-
-        LOGGER.info("file saved as %s"% filepath)
+    @log_exception
+    def _backup_db(self, dbname, schema_only, backup_config):
+        verify = backup_config.verify and not schema_only
+        with self._connection(dbname) as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "select pg_database_size(current_database())")
+                size_hint = cursor.fetchone()[0]
+            except psycopg2.Error:
+                LOGGER.warning(
+                    "unable to get the size of database %s"% dbname)
+                size_hint = None
+            conn.rollback()
+
+            snapshot, counts = None, None
+            if verify:
+                # count the rows in the snapshot pg_dump will use,
+                # (this transaction stays open until the dump is done)
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL "
+                    "REPEATABLE READ, READ ONLY")
+                cursor.execute("select pg_export_snapshot()")
+                snapshot = cursor.fetchone()[0]
+                counts = row_counts(cursor)
+
+            pg_dump = PgDump(self.config, backup_config)
+            result = pg_dump.dump(dbname, schema_only, size_hint,
+                snapshot, counts)
+
+        if verify:
+            self._restore_verifier.submit(dbname, result)
+        return result["path"]
+
+    def backup_records(self):
+        '''
+        a dictionary of the last successful backup of each database
+        (see :doc:`PgDump`) - when it finished, how long it took, its size
+        and location (the row counts are omitted).
+        '''
+        backup_root = PgDump(self.config, BackupConfig()).backup_root
+        records = {}
+        try:
+            dbnames = os.listdir(backup_root)
+        except OSError:
+            return records
+        for dbname in dbnames:
+            record = read_record(backup_root, dbname)
+            if record is not None:
+                record.pop("row_counts", None)
+                records[dbname] = record
+        return records
+
+    def verification_records(self):
+        '''
+        a dictionary of the last restore verification of each database
+        (see :doc:`RestoreVerifier`) - its status, any tables with the
+        wrong number of rows, and how long the restore took.
+        '''
+        backup_root = PgDump(self.config, BackupConfig()).backup_root
+        records = {}
+        try:
+            dbnames = os.listdir(backup_root)
+        except OSError:
+            return records
+        for dbname in dbnames:
+            record = read_verification(backup_root, dbname)
+            if record is not None:
+                records[dbname] = record
+        return records
+
+    def last_backup(self, dbname=""):
+        '''
+        returns a iso formatted datetime string showing when the
+        last backup (of dbname, or of any database) finished.
+        "" if there is no record of a backup.
+        '''
+        records = self.backup_records()
+        if dbname:
+            record = records.get(dbname)
+            return record["finished"] if record else ""
+        if not records:
+            return ""
+        return max([record["finished"] for record in records.values()])
 
     @log_exception
     def get_update_script(self, original, current):
@@ -452,8 +778,10 @@ class DBFunctions(object):
 def _test():
     '''
     test the DBFunctions class
+    (connections are provided by the FunctionStore)
     '''
-    sf = DBFunctions()
+    from lib_openmolar.server.functions.function_store import FunctionStore
+    sf = FunctionStore()
     sf._user = "test_user"
 
     dbname = "openmolar_demo"
@@ -465,6 +793,7 @@ def _test():
     #sf.truncate_all_tables(dbname)
 
     print sf.get_user_permissions("om_demo", dbname)
+    print sf.get_users_permissions(["om_demo"], [dbname, "openmolar_master"])
 
 if __name__ == "__main__":
     import __builtin__
@@ -28,9 +28,14 @@ import string
 from db_functions import DBFunctions
 from message_functions import MessageFunctions
 from shell_functions import ShellFunctions
-from lib_openmolar.server.misc.om_server_config import OMServerConfig
+from job_functions import JobFunctions
+from maintenance_functions import MaintenanceFunctions
+from lib_openmolar.server.misc.om_server_config import shared_config
+from lib_openmolar.server.misc.connection_pool import ConnectionPools
+from lib_openmolar.server.misc.backup_scheduler import BackupScheduler
 
-class FunctionStore(DBFunctions, ShellFunctions, MessageFunctions):
+class FunctionStore(DBFunctions, ShellFunctions, MessageFunctions,
+JobFunctions, MaintenanceFunctions):
     '''
     A class whose functions will be inherited by the server.
     Inherits from many other classes as only one call of
@@ -39,21 +44,44 @@ class FunctionStore(DBFunctions, ShellFunctions, MessageFunctions):
     _user = None
 
     def __init__(self):
-        self.config = OMServerConfig()
+        self.config = shared_config()
+        self._pools = ConnectionPools(self.config)
+        self._postgres_settings = self.config.items("postgresql")
+        self.config.add_reload_callback(self._config_reloaded)
         DBFunctions.__init__(self)
+        MessageFunctions.__init__(self)
+        JobFunctions.__init__(self, self.config.job_workers)
+        self._backup_scheduler = BackupScheduler(self)
 
     @property
     def MASTER_PWORD(self):
         return self.config.postgres_pass
 
+    def _config_reloaded(self, config):
+        '''
+        if the postgres settings have changed, close the pooled connections
+        (new ones will use the new settings).
+        '''
+        settings = config.items("postgresql")
+        if settings != self._postgres_settings:
+            LOGGER.info("postgres settings changed - resetting connections")
+            self._postgres_settings = settings
+            self._pools.closeall()
+            self._invalidate_dashboard()
+
+    def _start_backup_scheduler(self):
+        '''
+        start running the scheduled backups (see :doc:`BackupConfig`)
+        '''
+        self._backup_scheduler.start()
 
-    def last_backup(self):
+    def _connection(self, dbname="openmolar_master", autocommit=False):
         '''
-        returns a iso formatted datetime string showing when the
-        last backup was made
+        a context manager lending a pooled connection to database dbname.
+        use autocommit=True for statements (eg. create database) which
+        cannot run inside a transaction.
         '''
-        import datetime
-        return datetime.datetime.now().isoformat()
+        return self._pools.connection(dbname, autocommit)
 
 
 def _test():
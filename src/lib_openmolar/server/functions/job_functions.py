@@ -0,0 +1,131 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+
+from lib_openmolar.server.misc.job_manager import JobManager
+
+## functions which may be run in the background via submit_job.
+JOB_METHODS = ( 'backup_db',
+                'create_db',
+                'create_demodb',
+                'install_fuzzymatch',
+                'reindex_bloated',
+                'truncate_all_tables',
+                'truncate_demo',
+                'vacuum_analyze',
+                )
+
+class JobFunctions(object):
+    '''
+    A class whose functions will be inherited by the server.
+    Allows long running functions to be run in the background,
+    the client polls for their progress.
+    '''
+    def __init__(self, workers=2):
+        self._jobs = JobManager(workers)
+
+    def _prefork_mode(self):
+        '''
+        True if the server runs several worker processes.
+        jobs are known only to the process running them, so a client polling
+        for progress would often ask the wrong one.
+        '''
+        return self.config.processes > 0
+
+    def job_methods(self):
+        '''
+        the methods which may be passed to submit_job
+        (none in pre-fork mode, so clients call them directly).
+        '''
+        if self._prefork_mode():
+            return ()
+        return JOB_METHODS
+
+    def submit_job(self, method, *args):
+        '''
+        start method(*args) in the background.
+        returns a job id, which can be passed to job_status and cancel_job.
+        '''
+        if method not in JOB_METHODS:
+            raise ValueError("method '%s' cannot be run as a job"% method)
+        if self._prefork_mode():
+            raise ValueError(
+                "background jobs are unavailable when processes > 0")
+        func = getattr(self, method)
+        user = self._user
+
+        def run():
+            # the job runs in another thread, which needs to know the user
+            try:
+                self._remember_user(user)
+            except AttributeError:
+                pass
+            return func(*args)
+
+        return self._jobs.submit(method, args, run, user)
+
+    def _job_permitted(self, job):
+        '''
+        a job may be seen (and cancelled) by the user who submitted it,
+        or by any user with permission to run its method.
+        '''
+        if job.user == self._user:
+            return True
+        try:
+            return self._get_permission(job.method)
+        except AttributeError:
+            # no permissions are checked without a PermissionDispatcher
+            return True
+
+    def _get_job(self, job_id):
+        '''
+        the job with this id, raises KeyError if not known to this user.
+        '''
+        job = self._jobs.get(job_id)
+        if not self._job_permitted(job):
+            LOGGER.warning("user '%s' is not permitted to see job %s"% (
+                self._user, job_id))
+            raise KeyError(job_id)
+        return job
+
+    def job_status(self, job_id, log_offset=0):
+        '''
+        returns a dictionary describing the job, including any log lines
+        written since log_offset.
+        the returned "log_offset" should be passed in next time.
+        '''
+        return self._get_job(job_id).status_dict(log_offset)
+
+    def list_jobs(self):
+        '''
+        returns a list of dictionaries describing the jobs known to the user
+        '''
+        return [job.status_dict() for job in self._jobs.jobs()
+            if self._job_permitted(job)]
+
+    def cancel_job(self, job_id):
+        '''
+        cancel a job. returns True if the cancellation was requested.
+        '''
+        job = self._get_job(job_id)
+        LOGGER.warning("user '%s' is cancelling job %s"% (self._user, job_id))
+        return job.cancel()
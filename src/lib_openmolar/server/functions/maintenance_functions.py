@@ -0,0 +1,373 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+database maintenance - estimates of table and index bloat, and the
+VACUUM (ANALYZE) and REINDEX commands which remove it.
+
+bloat is estimated from the planner statistics (the number of live rows
+and their average width), so is only as good as the last ANALYZE.
+'''
+
+import cgi
+
+from lib_openmolar.server.misc.job_manager import (
+    report_progress, check_cancelled)
+
+#: tables which are edited all day, so always vacuumed by vacuum_analyze
+HOT_TABLES = ("diary_entries", "notes_clinical", "treatments")
+
+#: tables with at least this proportion of dead rows are vacuumed
+DEAD_RATIO_THRESHOLD = 0.1
+
+#: ... provided they have at least this many dead rows
+MIN_DEAD_ROWS = 1000
+
+#: indexes with at least this proportion of wasted space are rebuilt
+INDEX_BLOAT_THRESHOLD = 0.3
+
+#: ... provided they are at least this big (bytes)
+MIN_INDEX_SIZE = 1024 * 1024
+
+#: REINDEX CONCURRENTLY needs postgres 12
+REINDEX_CONCURRENTLY_VERSION = 120000
+
+TABLE_STATS_QUERY = '''
+SELECT quote_ident(c.relname), c.relname,
+    pg_relation_size(c.oid), pg_total_relation_size(c.oid),
+    coalesce(s.n_live_tup, 0), coalesce(s.n_dead_tup, 0),
+    greatest(s.last_vacuum, s.last_autovacuum)::text,
+    greatest(s.last_analyze, s.last_autoanalyze)::text,
+    coalesce(substring(array_to_string(c.reloptions, ' ')
+        from 'fillfactor=([0-9]+)')::int, 100)
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_catalog.pg_stat_user_tables s ON s.relid = c.oid
+WHERE n.nspname = 'public' AND c.relkind = 'r'
+ORDER BY c.relname
+'''
+
+INDEX_STATS_QUERY = '''
+SELECT quote_ident(i.relname), i.relname, t.relname, am.amname,
+    pg_relation_size(i.oid), i.reltuples,
+    array(SELECT a.attname::text FROM pg_catalog.pg_attribute a
+        WHERE a.attrelid = t.oid AND a.attnum = any(x.indkey)),
+    0 = any(x.indkey::int2[]),
+    coalesce(substring(array_to_string(i.reloptions, ' ')
+        from 'fillfactor=([0-9]+)')::int, 90)
+FROM pg_catalog.pg_index x
+JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+JOIN pg_catalog.pg_class t ON t.oid = x.indrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = t.relnamespace
+JOIN pg_catalog.pg_am am ON am.oid = i.relam
+WHERE n.nspname = 'public'
+ORDER BY t.relname, i.relname
+'''
+
+WIDTHS_QUERY = '''
+SELECT tablename::text, attname::text, avg_width
+FROM pg_catalog.pg_stats WHERE schemaname = 'public'
+'''
+
+def _align(n_bytes):
+    '''
+    round up to a multiple of 8 (maximum alignment)
+    '''
+    return (n_bytes + 7) & ~7
+
+def _pages(rows, row_bytes, usable):
+    return -(-int(rows * row_bytes) // int(usable))
+
+def estimate_table_bloat(size, live_rows, width, fillfactor, block_size):
+    '''
+    the bytes of a table's heap not needed by its live rows
+    (None if the table has not been analyzed).
+    each row has a 24 byte header and a 4 byte pointer.
+    '''
+    if not width:
+        return None
+    usable = (block_size - 24) * fillfactor / 100.0
+    expected = _pages(live_rows, 24 + _align(width) + 4, usable) * block_size
+    return max(0, size - expected)
+
+def estimate_index_bloat(size, rows, width, fillfactor, block_size):
+    '''
+    the bytes of a btree index not needed by its entries
+    (None if the index cannot be estimated).
+    each entry has an 8 byte header and a 4 byte pointer.
+    '''
+    if not width:
+        return None
+    usable = (block_size - 24 - 16) * fillfactor / 100.0
+    expected = (_pages(rows, 8 + _align(width) + 4, usable) + 1) * block_size
+    return max(0, size - expected)
+
+def _ratio(part, whole):
+    if part is None or not whole:
+        return None
+    return round(float(part) / whole, 3)
+
+def _mb(n_bytes):
+    if n_bytes is None:
+        return ""
+    return "%.1f MB"% (n_bytes / 1048576.0)
+
+def _percent(ratio):
+    if ratio is None:
+        return "?"
+    return "%d%%"% round(100 * ratio)
+
+class MaintenanceFunctions(object):
+    '''
+    A class whose functions will be inherited by the server
+    '''
+    def _table_stats(self, cursor, block_size, widths):
+        tables = []
+        cursor.execute(TABLE_STATS_QUERY)
+        for (ident, name, size, total_size, live, dead, last_vacuum,
+        last_analyze, fillfactor) in cursor.fetchall():
+            width = sum([w for (table, column), w in widths.iteritems()
+                if table == name])
+            bloat = estimate_table_bloat(size, live, width, fillfactor,
+                block_size)
+            tables.append({
+                "table" : name,
+                "ident" : ident,
+                "size" : size,
+                "total_size" : total_size,
+                "live_rows" : live,
+                "dead_rows" : dead,
+                "dead_ratio" : _ratio(dead, live + dead),
+                "bloat" : bloat,
+                "bloat_ratio" : _ratio(bloat, size),
+                "last_vacuum" : last_vacuum or "",
+                "last_analyze" : last_analyze or "",
+                })
+        return tables
+
+    def _index_stats(self, cursor, block_size, widths):
+        indexes = []
+        cursor.execute(INDEX_STATS_QUERY)
+        for (ident, name, table, method, size, rows, columns, expression,
+        fillfactor) in cursor.fetchall():
+            bloat = None
+            if method == "btree" and not expression:
+                width = sum([widths.get((table, column), 0)
+                    for column in columns])
+                if len(columns) and all([(table, column) in widths
+                for column in columns]):
+                    bloat = estimate_index_bloat(size, rows, width,
+                        fillfactor, block_size)
+            indexes.append({
+                "index" : name,
+                "ident" : ident,
+                "table" : table,
+                "method" : method,
+                "size" : size,
+                "bloat" : bloat,
+                "bloat_ratio" : _ratio(bloat, size),
+                })
+        return indexes
+
+    def _bloat_stats(self, cursor):
+        cursor.execute("select current_setting('block_size')::int")
+        block_size = cursor.fetchone()[0]
+        cursor.execute(WIDTHS_QUERY)
+        widths = dict([((table, column), width)
+            for table, column, width in cursor.fetchall()])
+        return {
+            "tables" : self._table_stats(cursor, block_size, widths),
+            "indexes" : self._index_stats(cursor, block_size, widths),
+            }
+
+    def bloat_stats(self, dbname):
+        '''
+        returns a dictionary with keys "tables" and "indexes",
+        lists of dictionaries giving the size, dead rows (tables only) and
+        estimated bloat of each table and index in the public schema.
+        '''
+        with self._connection(dbname) as conn:
+            return self._bloat_stats(conn.cursor())
+
+    def bloat_report(self, dbname):
+        '''
+        html summarising bloat_stats
+        '''
+        stats = self.bloat_stats(dbname)
+        html = u'''<h4>%s %s</h4>
+        <table>
+        <tr><th>%s</th><th>%s</th><th>%s</th><th>%s</th><th>%s</th></tr>
+        '''% (_("Tables of"), dbname, _("Table"), _("Size"), _("Dead Rows"),
+            _("Estimated Bloat"), _("Last Vacuum"))
+        for table in sorted(stats["tables"], key=lambda t: -t["size"]):
+            html += u'''<tr><td>%s</td><td>%s</td><td>%s (%s)</td>
+            <td>%s</td><td>%s</td></tr>'''% (
+                cgi.escape(table["table"]), _mb(table["total_size"]),
+                table["dead_rows"], _percent(table["dead_ratio"]),
+                _percent(table["bloat_ratio"]), table["last_vacuum"][:16])
+        html += u'''</table>
+        <h4>%s</h4>
+        <table>
+        <tr><th>%s</th><th>%s</th><th>%s</th><th>%s</th></tr>
+        '''% (_("Indexes"), _("Index"), _("Table"), _("Size"),
+            _("Estimated Bloat"))
+        for index in sorted(stats["indexes"], key=lambda i: -i["size"]):
+            html += u'''<tr><td>%s</td><td>%s</td><td>%s</td>
+            <td>%s</td></tr>'''% (
+                cgi.escape(index["index"]), cgi.escape(index["table"]),
+                _mb(index["size"]), _percent(index["bloat_ratio"]))
+        return html + "</table>"
+
+    def _vacuum_targets(self, tables):
+        '''
+        the HOT_TABLES, and those with many dead rows
+        (the dead_ratio of a table with no rows is None)
+        '''
+        targets = []
+        for table in tables:
+            if (table["table"] in HOT_TABLES or (
+            table["dead_rows"] >= MIN_DEAD_ROWS and
+            table["dead_ratio"] is not None and
+            table["dead_ratio"] >= DEAD_RATIO_THRESHOLD)):
+                targets.append(table)
+        return targets
+
+    def vacuum_analyze(self, dbname, tables=""):
+        '''
+        VACUUM (ANALYZE) the given tables (a list of names), or by default
+        those with many dead rows and the heavily edited HOT_TABLES.
+        returns a list of dictionaries giving the size and dead rows of
+        each table before and after.
+        '''
+        with self._connection(dbname, autocommit=True) as conn:
+            cursor = conn.cursor()
+            before = self._bloat_stats(cursor)["tables"]
+            if tables:
+                targets = [table for table in before
+                    if table["table"] in tables]
+            else:
+                targets = self._vacuum_targets(before)
+            report_progress(0, "vacuuming %d tables of %s"% (
+                len(targets), dbname))
+
+            for i, table in enumerate(targets):
+                check_cancelled()
+                report_progress(100 * i / len(targets),
+                    "VACUUM (ANALYZE) %s"% table["table"])
+                cursor.execute("VACUUM (ANALYZE) %s"% table["ident"])
+
+            after = dict([(table["table"], table)
+                for table in self._bloat_stats(cursor)["tables"]])
+
+        results = []
+        for table in targets:
+            new = after.get(table["table"], {})
+            result = {
+                "table" : table["table"],
+                "size_before" : table["total_size"],
+                "size_after" : new.get("total_size"),
+                "dead_rows_before" : table["dead_rows"],
+                "dead_rows_after" : new.get("dead_rows"),
+                }
+            message = "%s - %s dead rows before, %s after, size %s -> %s"% (
+                result["table"], result["dead_rows_before"],
+                result["dead_rows_after"], _mb(result["size_before"]),
+                _mb(result["size_after"]))
+            LOGGER.info("vacuumed %s %s"% (dbname, message))
+            report_progress(message=message)
+            results.append(result)
+        return results
+
+    def reindex_bloated(self, dbname, indexes=""):
+        '''
+        REINDEX CONCURRENTLY the given indexes (a list of names), or by
+        default those estimated to be bloated.
+        (postgres 12 or later, earlier versions would lock the tables)
+        returns a list of dictionaries giving the size of each index before
+        and after.
+        '''
+        with self._connection(dbname, autocommit=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("select current_setting('server_version_num')::int")
+            if cursor.fetchone()[0] < REINDEX_CONCURRENTLY_VERSION:
+                message = "REINDEX CONCURRENTLY needs postgres 12 or later"
+                LOGGER.warning(message)
+                report_progress(message=message)
+                return []
+
+            before = self._bloat_stats(cursor)["indexes"]
+            if indexes:
+                targets = [index for index in before
+                    if index["index"] in indexes]
+            else:
+                targets = [index for index in before
+                    if index["size"] >= MIN_INDEX_SIZE and
+                    index["bloat_ratio"] >= INDEX_BLOAT_THRESHOLD]
+            report_progress(0, "rebuilding %d indexes of %s"% (
+                len(targets), dbname))
+
+            failed = set()
+            for i, index in enumerate(targets):
+                check_cancelled()
+                report_progress(100 * i / len(targets),
+                    "REINDEX INDEX CONCURRENTLY %s"% index["index"])
+                try:
+                    cursor.execute("REINDEX INDEX CONCURRENTLY %s"%
+                        index["ident"])
+                except Exception as exc:
+                    # an invalid index named *_ccnew may be left behind
+                    LOGGER.exception("unable to rebuild %s"% index["index"])
+                    report_progress(message="unable to rebuild %s %s"% (
+                        index["index"], exc))
+                    failed.add(index["index"])
+
+            after = dict([(index["index"], index)
+                for index in self._bloat_stats(cursor)["indexes"]])
+
+        results = []
+        for index in targets:
+            result = {
+                "index" : index["index"],
+                "table" : index["table"],
+                "size_before" : index["size"],
+                "size_after" : after.get(index["index"], {}).get("size"),
+                "rebuilt" : index["index"] not in failed,
+                }
+            message = "%s - size %s -> %s"% (result["index"],
+                _mb(result["size_before"]), _mb(result["size_after"]))
+            LOGGER.info("reindexed %s %s"% (dbname, message))
+            report_progress(message=message)
+            results.append(result)
+        return results
+
+def _test():
+    LOGGER.debug("table bloat %s"% estimate_table_bloat(
+        80 * 8192, 1000, 100, 100, 8192))
+    LOGGER.debug("index bloat %s"% estimate_index_bloat(
+        50 * 8192, 1000, 8, 90, 8192))
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
@@ -20,11 +20,46 @@
 ##                                                                           ##
 ###############################################################################
 
-import psycopg2
+import cgi
+import os
 import re
 import socket
-
-from lib_openmolar.server.misc.om_server_config import OMServerConfig
+import threading
+import time
+
+from lib_openmolar.server.misc import logger
+from lib_openmolar.server.misc.log_tail import read_log, MAX_CHUNK
+from lib_openmolar.server.misc.om_server_config import (shared_config,
+    RUN_DIR)
+from lib_openmolar.server.misc.query_advisor import QueryAdvisor, TOP_N
+
+#: seconds for which the data shown on the admin welcome page is cached
+DASHBOARD_TTL = 10
+
+#: touched when the dashboard is invalidated, so that the worker processes
+#: (in pre-fork mode) all forget their cached data
+DASHBOARD_STAMP = os.path.join(RUN_DIR, "dashboard.stamp")
+
+#: seconds for which the query statistics shown on the welcome page are
+#: cached (gathering them polls every database)
+QUERY_REPORT_TTL = 600
+
+#: a single query gathering the catalog information for the welcome page
+DASHBOARD_QUERY = '''
+select current_setting('server_version'),
+current_setting('listen_addresses'),
+current_setting('port'),
+array(select usename::text from pg_catalog.pg_user order by usename),
+array(select datname::text from pg_database join pg_user
+    on pg_database.datdba = pg_user.usesysid
+    where usename='openmolar' and datname != 'openmolar_master'
+    and datname not like 'openmolar_template_%'
+    and datname not like 'openmolar_verify_%'
+    order by datname),
+array(select array[datname::text, usename::text,
+    coalesce(host(client_addr), ''), coalesce(application_name, '')]
+    from pg_catalog.pg_stat_activity where datname is not null)
+'''
 
 
 HEADER = '''<!DOCTYPE html>
@@ -96,20 +131,121 @@ class MessageFunctions(object):
     A class whose functions will be inherited by the server
     '''
     def __init__(self):
-        self.config = OMServerConfig()
+        self.config = shared_config()
+        self._dashboard_lock = threading.Lock()
+        self._dashboard_data = None
+        self._dashboard_time = 0
+        self._query_report_lock = threading.Lock()
+        self._query_report = None
+        self._query_report_key = None
+        self._query_report_time = 0
+        self._query_report_refreshing = False
+        self._query_advisor = QueryAdvisor(self._connection)
+
+    def _fetch_dashboard(self):
+        '''
+        gather the information for the admin welcome page.
+        one query on openmolar_master gets the server settings, login roles,
+        databases and sessions, then one query per database gets the
+        schema version.
+        '''
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(DASHBOARD_QUERY)
+            (version, addresses, port, roles, databases,
+                activity) = cursor.fetchone()
+
+        sessions = dict([(dbname, []) for dbname in databases])
+        for dbname, user, address, application in activity or []:
+            if dbname in sessions:
+                sessions[dbname].append((user, address, application))
+
+        schema_versions = {}
+        for dbname in databases:
+            schema_versions[dbname] = self.get_schema_version(dbname)
+
+        return {
+            "server_info" : (version, addresses, port),
+            "roles" : roles,
+            "databases" : databases,
+            "sessions" : sessions,
+            "schema_versions" : schema_versions,
+            }
+
+    def _dashboard_query_report(self, databases):
+        '''
+        the query statistics for the welcome page, gathered again only when
+        QUERY_REPORT_TTL has passed or the databases have changed.
+        the statistics are gathered without holding a lock, one thread
+        at a time. meanwhile other threads are given the previous report.
+        returns None if the statistics cannot be gathered.
+        '''
+        key = tuple(databases)
+        now = time.time()
+        with self._query_report_lock:
+            if self._query_report_refreshing or (
+            key == self._query_report_key and
+            now - self._query_report_time <= QUERY_REPORT_TTL):
+                return self._query_report
+            self._query_report_refreshing = True
 
-    def __conn_atts(self, dbname="openmolar_master"):
+        try:
+            report = self._query_advisor.report(databases)
+        except Exception:
+            LOGGER.exception("unable to gather query statistics")
+            report = None
+
+        with self._query_report_lock:
+            # a failure is not retried until the ttl has passed
+            self._query_report = report
+            self._query_report_key = key
+            self._query_report_time = now
+            self._query_report_refreshing = False
+        return report
+
+    def _dashboard(self):
+        '''
+        the (cached) information for the admin welcome page.
+        returns None if postgres cannot be polled.
+        '''
+        with self._dashboard_lock:
+            if (self._dashboard_data is None or
+            time.time() - self._dashboard_time > DASHBOARD_TTL or
+            self._dashboard_invalidated_elsewhere()):
+                try:
+                    self._dashboard_data = self._fetch_dashboard()
+                    self._dashboard_time = time.time()
+                except Exception:
+                    LOGGER.exception("unable to poll postgres for dashboard")
+                    self._dashboard_data = None
+            return self._dashboard_data
+
+    def _invalidate_dashboard(self):
         '''
-        has to be a private function because of the password!
-        a well set up server will restrict user "openmolar"
-        to a unix socket connection (ie local machine only)
-        or at the very least a TCP/IP connection to only localhost.
-        (function doesn't get picked up by register_instance)
+        forget the cached welcome page information.
+        called by functions which add or remove databases or users.
         '''
-        return "host='%s' user='%s' port='%s' password='%s' dbname='%s'"% (
-            self.config.postgres_host, self.config.postgres_user,
-            self.config.postgres_port,
-            self.config.postgres_pass, dbname)
+        with self._dashboard_lock:
+            self._dashboard_data = None
+        if self._prefork_mode():
+            try:
+                open(DASHBOARD_STAMP, "a").close()
+                os.utime(DASHBOARD_STAMP, None)
+            except (IOError, OSError):
+                LOGGER.exception("unable to invalidate the dashboard of "
+                    "the other worker processes")
+
+    def _dashboard_invalidated_elsewhere(self):
+        '''
+        True if another worker process has invalidated the dashboard since
+        this process cached it.
+        '''
+        if not self._prefork_mode():
+            return False
+        try:
+            return os.path.getmtime(DASHBOARD_STAMP) >= self._dashboard_time
+        except OSError:
+            return False
 
     @property
     def location_header(self):
@@ -135,12 +271,11 @@ class MessageFunctions(object):
         issues a query to get the value of schema_version stored in settings.
         '''
         try:
-            conn = psycopg2.connect(self.__conn_atts(dbname))
-            cursor = conn.cursor()
-            cursor.execute(
+            with self._connection(dbname) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
                 "select max(data) from settings where key='schema_version'")
-            version = cursor.fetchone()
-            conn.close()
+                version = cursor.fetchone()
             return version[0]
         except Exception as exc:
             LOGGER.exception("Serious Error")
@@ -164,15 +299,16 @@ class MessageFunctions(object):
         LOGGER.debug("polling for available databases")
         databases = []
         try:
-            conn = psycopg2.connect(self.__conn_atts())
-            cursor = conn.cursor()
-            cursor.execute('''SELECT datname FROM pg_database JOIN pg_user
-            ON pg_database.datdba = pg_user.usesysid
-            where usename='openmolar' and datname != 'openmolar_master'
-            order by datname''')
-            for result in cursor.fetchall():
-                databases.append(result[0])
-            conn.close()
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''SELECT datname FROM pg_database JOIN pg_user
+                ON pg_database.datdba = pg_user.usesysid
+                where usename='openmolar' and datname != 'openmolar_master'
+                and datname not like 'openmolar_template_%'
+                and datname not like 'openmolar_verify_%'
+                order by datname''')
+                for result in cursor.fetchall():
+                    databases.append(result[0])
         except Exception as exc:
             LOGGER.exception("Serious Error")
             return "EXCEPTION CAUGHT"
@@ -192,12 +328,20 @@ class MessageFunctions(object):
 
             <h4>%s</h4>
             {DATABASE TABLE}
+
+            <h4>%s</h4>
+            {QUERY TABLE}
+
+            <h4>%s</h4>
+            {BACKUP TABLE}
         %s
         '''% (
             HEADER,
             self.location_header,
             _("Postgresql Server Information"),
             _("Openmolar Databases"),
+            _("Query Performance"),
+            _("Backups"),
             get_footer())
 
         return html
@@ -206,28 +350,30 @@ class MessageFunctions(object):
         '''
         the html shown on startup to the admin application
         '''
-        dbs = self.available_databases()
+        data = self._dashboard()
 
-        if dbs == "EXCEPTION CAUGHT":
+        if data is None:
             message = self.postgres_error_message()
-        elif dbs == []:
-            message = self.admin_welcome_template()
-
-            message = message.replace("{SERVER_INFO}", self.pg_server_table)
-
-            message = message.replace("{USERS}", self.user_html)
-
-            message = message.replace("{DATABASE TABLE}",
-                self.no_databases_message)
-
         else:
             message = self.admin_welcome_template()
 
-            message = message.replace("{SERVER_INFO}", self.pg_server_table)
+            message = message.replace("{SERVER_INFO}",
+                self._pg_server_table(data["server_info"]))
 
-            message = message.replace("{USERS}", self.user_html)
+            message = message.replace("{USERS}",
+                self._user_html(data["roles"]))
 
-            message = message.replace("{DATABASE TABLE}", self.db_table(dbs))
+            if data["databases"] == []:
+                db_table = self.no_databases_message
+            else:
+                db_table = self.db_table(data["databases"],
+                    data["sessions"], data["schema_versions"])
+
+            message = message.replace("{DATABASE TABLE}", db_table)
+            message = message.replace("{QUERY TABLE}", self.query_table(
+                self._dashboard_query_report(data["databases"])))
+            message = message.replace("{BACKUP TABLE}",
+                self.backup_table(data["databases"]))
         return message
 
     @property
@@ -267,13 +413,25 @@ class MessageFunctions(object):
         '''
 
         if url == "show server log":
-            f = open("/var/log/openmolar/server.log", "r")
-            data = f.read()
-            f.close()
-            return "<html><body><pre>%s</pre></body></html>"% data
+            # only the most recent lines, clients wanting more use tail_log
+            lines = read_log(logger.LOCATION)["lines"]
+            return "<html><body><pre>%s</pre></body></html>"% (
+                cgi.escape("\n".join(lines)))
 
         return None
 
+    def tail_log(self, offset=-1, max_bytes=MAX_CHUNK, level=None,
+    inode=None):
+        '''
+        the lines written to the server log since offset
+        (at most max_bytes, and optionally only those at level or above).
+        pass the offset and inode from the previous result to continue
+        reading, or an offset of -1 for the last few lines.
+        '''
+        # xmlrpc has no None, so empty strings are accepted in its place
+        return read_log(logger.LOCATION, offset, max_bytes, level or None,
+            inode or None)
+
     @log_exception
     def login_roles(self):
         '''
@@ -283,12 +441,11 @@ class MessageFunctions(object):
         '''
         roles = []
         try:
-            conn = psycopg2.connect(self.__conn_atts())
-            cursor = conn.cursor()
-            cursor.execute(
-                'select usename from pg_catalog.pg_user')
-            users = cursor.fetchall()
-            conn.close()
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'select usename from pg_catalog.pg_user')
+                users = cursor.fetchall()
             for user in users:
                 roles.append(user[0])
 
@@ -303,14 +460,13 @@ class MessageFunctions(object):
         list active connections
         '''
         try:
-            conn = psycopg2.connect(self.__conn_atts())
-            cursor = conn.cursor()
-            cursor.execute(
-                '''select usename, client_addr, application_name
-                from pg_catalog.pg_stat_activity where datname = '%s'
-                '''% db_name)
-            sessions = cursor.fetchall()
-            conn.close()
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    '''select usename, client_addr, application_name
+                    from pg_catalog.pg_stat_activity where datname = %s
+                    ''', (db_name,))
+                sessions = cursor.fetchall()
             for user, address, application in sessions:
                 yield (user, address, application)
         except Exception as exc:
@@ -325,11 +481,10 @@ class MessageFunctions(object):
         current_setting('listen_addresses') as addresses,
         current_setting('port') as port'''
         try:
-            conn = psycopg2.connect(self.__conn_atts())
-            cursor = conn.cursor()
-            cursor.execute(query)
-            values = cursor.fetchone()
-            conn.close()
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query)
+                values = cursor.fetchone()
             return values
         except Exception as exc:
             LOGGER.exception("Serious Error")
@@ -339,8 +494,13 @@ class MessageFunctions(object):
         '''
         returns formatted server information
         '''
+        return self._pg_server_table(self.pg_server_info())
+
+    def _pg_server_table(self, values):
+        '''
+        format the values returned by pg_server_info as html
+        '''
         try:
-            values = self.pg_server_info()
             html = '''
             <table id="postgres_table">
                 <tr>
@@ -387,10 +547,12 @@ class MessageFunctions(object):
             LOGGER.exception("error in MessageFunctions.pg_server_table")
             return "Unable to get server info, check the log"
 
-    def db_table(self, dbs):
+    def db_table(self, dbs, sessions=None, schema_versions=None):
         '''
         gets html showing available databases
         includes links for management and configuration.
+        sessions and schema_versions are dictionaries keyed by database name,
+        if not given they are polled for each database.
         '''
         try:
             html = '''
@@ -411,7 +573,10 @@ class MessageFunctions(object):
                     )
 
             for i, db in enumerate(dbs):
-                s_v = self.get_schema_version(db)
+                if schema_versions is None:
+                    s_v = self.get_schema_version(db)
+                else:
+                    s_v = schema_versions.get(db)
                 if i % 2 == 0:
                     html += '<tr class="even">'
                 else:
@@ -446,7 +611,11 @@ class MessageFunctions(object):
                     )
 
                 ses_html = '                <table class="sessions">'
-                for session in self.list_sessions(db):
+                if sessions is None:
+                    db_sessions = self.list_sessions(db)
+                else:
+                    db_sessions = sessions.get(db, [])
+                for session in db_sessions:
                     ses_html += '''
                         <tr>
                             <td>%s</td>
@@ -466,14 +635,172 @@ class MessageFunctions(object):
             LOGGER.exception("unable to format db_table")
             return "unable to create db_table information, check the log"
 
+    def query_report(self, limit=TOP_N):
+        '''
+        the slowest statements (by total and by mean time) of each openmolar
+        database, with the client code which probably issued them, large
+        tables read by sequential scans, and suggested indexes.
+        statements is an empty list if pg_stat_statements is not installed.
+        raises IOError if the databases cannot be listed.
+        '''
+        databases = self.available_databases()
+        if not isinstance(databases, list):
+            raise IOError("unable to list the databases")
+        report = self._query_advisor.report(databases, limit)
+        report["available"] = report["statements"] is not None
+        if report["statements"] is None:
+            report["statements"] = []
+        return report
+
+    def query_table(self, report):
+        '''
+        html showing the slowest statements of each database, tables read by
+        sequential scans and suggested indexes (see query_report).
+        '''
+        if report is None:
+            return "<p>%s</p>"% _(
+                "unable to get query statistics, check the log")
+        try:
+            html = ""
+            if report["statements"] is None:
+                html += "<p>%s</p>"% _("Install the pg_stat_statements "
+                    "extension to see the slowest queries.")
+            else:
+                html += '''
+                <table id="query_table">
+                <tr>
+                    <th>%s</th>
+                    <th>%s</th>
+                    <th>%s</th>
+                    <th>%s</th>
+                    <th>%s</th>
+                    <th>%s</th>
+                </tr>
+                '''% (
+                    _("Database Name"),
+                    _("Statement"),
+                    _("Calls"),
+                    _("Total Time"),
+                    _("Mean Time"),
+                    _("Code Path"),
+                    )
+                for i, statement in enumerate(report["statements"]):
+                    html += '''
+                    <tr class="%s">
+                        <td><b>%s</b></td>
+                        <td><code>%s</code></td>
+                        <td>%s</td>
+                        <td>%.1f ms</td>
+                        <td>%.2f ms</td>
+                        <td>%s</td>
+                    </tr>'''% ("even" if i % 2 == 0 else "odd",
+                        statement["database"],
+                        cgi.escape(statement["query"][:300]),
+                        statement["calls"],
+                        statement["total_ms"],
+                        statement["mean_ms"],
+                        "<br />".join([cgi.escape(path)
+                            for path in statement["code_paths"]]))
+                html += "</table>"
+
+            items = []
+            for dbname in sorted(report["tables"]):
+                advice = report["tables"][dbname]
+                for scan in advice["seq_scans"]:
+                    items.append("<li><b>%s</b> %s %s</li>"% (dbname,
+                        scan["table"], _("is read by sequential scans "
+                        "(%(seq_scans)d scans of %(rows_per_scan)d rows, "
+                        "%(index_scans)d index scans)")% scan))
+                for suggestion in advice["suggestions"]:
+                    items.append("<li><b>%s</b> <code>%s</code> (%s)</li>"% (
+                        dbname, suggestion["sql"], suggestion["reason"]))
+            if items:
+                html += "<ul>%s</ul>"% "".join(items)
+            return html
+
+        except Exception:
+            LOGGER.exception("unable to format query_table")
+            return "unable to create query information, check the log"
+
+    def backup_table(self, dbs):
+        '''
+        html showing the last backup of each database, and whether it has
+        been shown to restore (and how long that took).
+        '''
+        try:
+            backups = self.backup_records()
+            verifications = self.verification_records()
+            html = '''
+                <table id="backup_table">
+                <tr>
+                    <th>%s</th>
+                    <th>%s</th>
+                    <th>%s</th>
+                    <th>%s</th>
+                    <th>%s</th>
+                    <th>%s</th>
+                </tr>
+                '''% (
+                    _("Database Name"),
+                    _("Last Backup"),
+                    _("Backup Time"),
+                    _("Size"),
+                    _("Restore Check"),
+                    _("Restore Time"),
+                    )
+            for i, db in enumerate(dbs):
+                backup = backups.get(db)
+                verification = verifications.get(db)
+                if backup is None:
+                    backup_cells = "<td>%s</td><td></td><td></td>"% _("None")
+                else:
+                    backup_cells = '''<td>%s</td><td>%ss</td>
+                        <td>%.1f MB</td>'''% (
+                        backup["finished"][:16].replace("T", " "),
+                        backup["seconds"], backup["bytes"] / 1048576.0)
+                if backup is None:
+                    verify_cells = "<td></td><td></td>"
+                elif (verification is None or
+                verification["backup"] != backup["path"]):
+                    verify_cells = "<td>%s</td><td></td>"% _("Pending")
+                else:
+                    status = verification["status"]
+                    if verification["mismatches"]:
+                        status += " (%s)"% cgi.escape(", ".join(
+                            sorted(verification["mismatches"])))
+                    elif verification["error"]:
+                        status += " (%s)"% cgi.escape(
+                            verification["error"][:100])
+                    restore_time = verification["restore_seconds"]
+                    verify_cells = "<td>%s</td><td>%s</td>"% (status,
+                        "" if restore_time is None else "%ss"% restore_time)
+                html += '''
+                    <tr class="%s">
+                        <td><b>%s</b></td>
+                        %s
+                        %s
+                    </tr>'''% ("even" if i % 2 == 0 else "odd", db,
+                    backup_cells, verify_cells)
+            return html + "</table>"
+
+        except Exception:
+            LOGGER.exception("unable to format backup_table")
+            return "unable to create backup information, check the log"
+
     @property
     def user_html(self):
         '''
         returns html showing login roles
         '''
+        return self._user_html(self.login_roles())
+
+    def _user_html(self, roles):
+        '''
+        format a list of login roles as html
+        '''
         try:
             html = "<ul>"
-            for user in self.login_roles():
+            for user in roles:
                 html += "<li>%s</li>"% user
             html += "</ul>"
 
@@ -484,9 +811,11 @@ class MessageFunctions(object):
 
 def _test():
     '''
-    test the ShellFunctions class
+    test the MessageFunctions class
+    (connections are provided by the FunctionStore)
     '''
-    sf = MessageFunctions()
+    from lib_openmolar.server.functions.function_store import FunctionStore
+    sf = FunctionStore()
     LOGGER.debug(sf.admin_welcome())
     LOGGER.debug(sf.no_databases_message())
     LOGGER.debug(sf.postgres_error_message())
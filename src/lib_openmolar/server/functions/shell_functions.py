@@ -24,6 +24,9 @@ import logging
 import subprocess
 import sys
 
+from lib_openmolar.server.misc.job_manager import (
+    report_progress, register_process)
+
 def log_exception(func):
     def shell_func(*args, **kwargs):
         try:
@@ -47,11 +50,13 @@ class ShellFunctions(object):
         try:
             p = subprocess.Popen(["openmolar-fuzzymatch", dbname],
                 stdout = subprocess.PIPE)
+            register_process(p)
             while True:
                 line = p.stdout.readline()
                 if not line:
                     break
                 LOGGER.info(line)
+                report_progress(message=line.rstrip())
         except Exception as exc:
             LOGGER.exception("unable to install fuzzymatch into '%s'"% dbname)
             return False
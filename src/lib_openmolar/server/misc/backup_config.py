@@ -26,7 +26,21 @@ import ConfigParser
 
 from lib_openmolar.server.misc.om_server_config import SERVER_DIR
 
-BACKUP_FILE = os.path.join(SERVER_DIR, "backup.conf")
+#: (may be moved with the environment variable OPENMOLAR_BACKUP_CONF)
+BACKUP_FILE = os.environ.get("OPENMOLAR_BACKUP_CONF",
+    os.path.join(SERVER_DIR, "backup.conf"))
+
+DEFAULT_BACKUP_DIR = "/usr/share/openmolar/backups/"
+
+#: pg_dump formats, and the file extension used for each.
+FORMATS = {"plain" : ".sql", "custom" : ".dump", "directory" : ".dir"}
+
+#: compression applied to plain format dumps as they are streamed to disk.
+COMPRESSIONS = {"none" : "", "gzip" : ".gz", "zstd" : ".zst"}
+
+#: ionice arguments for each io scheduling class
+IONICE_CLASSES = {"idle" : ["-c", "3"], "best-effort" : ["-c", "2", "-n", "7"],
+    "none" : []}
 
 class BackupConfig(ConfigParser.SafeConfigParser):
     def __init__(self):
@@ -65,10 +79,166 @@ class BackupConfig(ConfigParser.SafeConfigParser):
             LOGGER.info("no backup location found in backup.conf")
             raise IOError("misconfigured or missing backup file")
 
+    def _option(self, option, default):
+        if self.has_option("backup", option):
+            return self.get("backup", option)
+        return default
+
+    @property
+    def format(self):
+        '''
+        the pg_dump format (plain, custom or directory). default is plain
+        '''
+        format_ = self._option("format", "plain")
+        if format_ not in FORMATS:
+            LOGGER.warning("unknown backup format '%s' - using plain"% format_)
+            return "plain"
+        return format_
+
+    @property
+    def compression(self):
+        '''
+        compression of plain format dumps (none, gzip or zstd).
+        default is gzip.
+        (custom and directory formats are compressed by pg_dump itself)
+        '''
+        compression = self._option("compression", "gzip")
+        if compression not in COMPRESSIONS:
+            LOGGER.warning(
+                "unknown backup compression '%s' - using gzip"% compression)
+            return "gzip"
+        return compression
+
+    @property
+    def jobs(self):
+        '''
+        the number of tables dumped in parallel (directory format only)
+        '''
+        return max(1, int(self._option("jobs", 1)))
+
+    @property
+    def chunk_size(self):
+        '''
+        the size (in bytes) of the chunks streamed from pg_dump to disk
+        '''
+        return max(4096, int(self._option("chunk_size", 1024 * 1024)))
+
+    @property
+    def schedule(self):
+        '''
+        the times of day (a sorted list of (hour, minute) tuples) at which
+        scheduled backups start. an empty list means no scheduled backups.
+        '''
+        times = []
+        for value in self._option("schedule", "").split(","):
+            value = value.strip()
+            if not value:
+                continue
+            try:
+                hour, minute = [int(part) for part in value.split(":")]
+                if not (0 <= hour < 24 and 0 <= minute < 60):
+                    raise ValueError
+            except ValueError:
+                LOGGER.warning("ignoring invalid backup time '%s'"% value)
+                continue
+            times.append((hour, minute))
+        return sorted(times)
+
+    @property
+    def window(self):
+        '''
+        minutes after a scheduled time in which its backups may start.
+        backups not started by then are skipped until the next scheduled time.
+        '''
+        return max(1, int(self._option("window", 180)))
+
+    @property
+    def databases(self):
+        '''
+        the databases backed up at the scheduled times
+        (None means all openmolar databases)
+        '''
+        value = self._option("databases", "all").strip()
+        if value in ("", "all"):
+            return None
+        return [dbname.strip() for dbname in value.split(",")
+            if dbname.strip()]
+
+    @property
+    def max_concurrent(self):
+        '''
+        the most backups which run at the same time
+        (by all the worker processes of the server)
+        '''
+        return max(1, int(self._option("max_concurrent", 1)))
+
+    @property
+    def nice(self):
+        '''
+        the niceness of the pg_dump process (0 to leave unchanged)
+        '''
+        return max(0, min(19, int(self._option("nice", 10))))
+
+    @property
+    def ionice(self):
+        '''
+        the io scheduling class of the pg_dump process
+        (idle, best-effort or none)
+        '''
+        ionice = self._option("ionice", "idle")
+        if ionice not in IONICE_CLASSES:
+            LOGGER.warning("unknown ionice class '%s' - using idle"% ionice)
+            return "idle"
+        return ionice
+
+    @property
+    def rate_limit(self):
+        '''
+        the most bytes per second read from pg_dump (0 for no limit).
+        (configured in kB/s, not applied to directory format dumps)
+        '''
+        return max(0, int(self._option("rate_limit", 0))) * 1024
+
+    @property
+    def verify(self):
+        '''
+        whether each backup is restored into a scratch database, and the
+        rows in each table compared with the database backed up.
+        '''
+        if not self.has_option("backup", "verify"):
+            return False
+        return self.getboolean("backup", "verify")
+
+    @property
+    def verify_workers(self):
+        '''
+        the most restores being verified at the same time.
+        '''
+        return max(1, int(self._option("verify_workers", 1)))
+
+    @property
+    def keep(self):
+        '''
+        the number of backups kept for each database (0 keeps all)
+        '''
+        return max(0, int(self._option("keep", 14)))
+
+    @property
+    def max_age_days(self):
+        '''
+        backups older than this are removed (0 to keep them regardless of age)
+        the most recent backup is never removed.
+        '''
+        return max(0, int(self._option("max_age_days", 0)))
+
 if __name__ == "__main__":
     import logging
     logging.basicConfig(level = logging.DEBUG)
 
     LOGGER = logging.getLogger("test")
     bc = BackupConfig()
-    LOGGER.info(bc.backup_dir)
\ No newline at end of file
+    LOGGER.info(bc.backup_dir)
+    LOGGER.info("format %s, compression %s, jobs %s, chunk size %s"% (
+        bc.format, bc.compression, bc.jobs, bc.chunk_size))
+    LOGGER.info("schedule %s, databases %s, keep %s"% (
+        bc.schedule, bc.databases, bc.keep))
\ No newline at end of file
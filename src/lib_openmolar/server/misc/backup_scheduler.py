@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+provides BackupScheduler, which backs up the databases at the times given
+in :doc:`BackupConfig`.
+
+the backups are run as jobs (see :doc:`JobManager`), so can be monitored
+and cancelled by the admin application.
+if the server runs several processes, only one runs the backups for each
+scheduled time (a lock file in the backup directory decides which).
+'''
+
+from datetime import datetime, time as dtime, timedelta
+import errno
+import fcntl
+import json
+import os
+import threading
+import time
+
+from lib_openmolar.server.misc.backup_config import BackupConfig
+from lib_openmolar.server.misc.pg_dump import PgDump
+
+#: seconds between checks of the schedule
+SCHEDULER_INTERVAL = 30
+
+#: seconds between checks on the progress of scheduled backups
+POLL_INTERVAL = 5
+
+#: the file (in the backup directory) recording the last scheduled time run
+STATE_FILE = "schedule.json"
+
+LOCK_FILE = ".schedule.lock"
+
+def due_slot(now, times, window):
+    '''
+    the most recent scheduled time (a datetime) before now, if now is
+    within window minutes of it. otherwise None.
+    times is a sorted list of (hour, minute) tuples.
+    '''
+    for day in (now.date(), now.date() - timedelta(days=1)):
+        for hour, minute in reversed(times):
+            slot = datetime.combine(day, dtime(hour, minute))
+            if slot <= now:
+                if now - slot < timedelta(minutes=window):
+                    return slot
+                return None
+    return None
+
+class BackupScheduler(object):
+    '''
+    a background thread which submits backup jobs to a :doc:`FunctionStore`
+    at the scheduled times.
+    '''
+    def __init__(self, function_store):
+        self.function_store = function_store
+        self._thread = None
+        self._last_slot = None
+
+    def start(self):
+        '''
+        start the scheduler thread (once the server process has forked).
+        '''
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run,
+            name="backup_scheduler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                LOGGER.exception("error in backup scheduler")
+            time.sleep(SCHEDULER_INTERVAL)
+
+    def check(self, now=None):
+        '''
+        run the backups for the current scheduled time, if this has not
+        already been done.
+        '''
+        if now is None:
+            now = datetime.now()
+        backup_config = BackupConfig()
+        slot = due_slot(now, backup_config.schedule, backup_config.window)
+        if slot is None or slot == self._last_slot:
+            return
+        self._last_slot = slot
+        backup_root = PgDump(self.function_store.config,
+            backup_config).backup_root
+        if self._claim(backup_root, slot):
+            self.run_backups(slot, backup_config)
+
+    def _claim(self, backup_root, slot):
+        '''
+        record that the backups for slot are being run.
+        returns False if they have been (or are being) run by another process.
+        '''
+        if not os.path.isdir(backup_root):
+            os.makedirs(backup_root)
+        lock = open(os.path.join(backup_root, LOCK_FILE), "a")
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as exc:
+                if exc.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+            state_path = os.path.join(backup_root, STATE_FILE)
+            try:
+                state = json.load(open(state_path))
+            except (IOError, ValueError):
+                state = {}
+            if state.get("last_slot", "") >= slot.isoformat():
+                return False
+            state["last_slot"] = slot.isoformat()
+            f = open(state_path + ".tmp", "w")
+            json.dump(state, f)
+            f.close()
+            os.rename(state_path + ".tmp", state_path)
+            return True
+        finally:
+            lock.close()
+
+    def _databases(self, backup_config):
+        databases = backup_config.databases
+        if databases is None:
+            databases = self.function_store.available_databases()
+        if not isinstance(databases, list):
+            LOGGER.error("unable to list the databases to back up")
+            return []
+        return databases
+
+    def run_backups(self, slot, backup_config):
+        '''
+        back up the databases, at most backup_config.max_concurrent at a
+        time. backups which have not started when the window closes are
+        skipped.
+        '''
+        deadline = slot + timedelta(minutes=backup_config.window)
+        pending = self._databases(backup_config)
+        LOGGER.info("scheduled backup (%s) of %s"% (slot, pending))
+        jobs = self.function_store._jobs
+        running = {}
+        while pending or running:
+            for job_id, dbname in running.items():
+                job = jobs.get(job_id)
+                if not job.is_complete:
+                    continue
+                running.pop(job_id)
+                if job.result:
+                    LOGGER.info("scheduled backup of %s saved as %s"% (
+                        dbname, job.result))
+                elif job.error is not None:
+                    LOGGER.error("scheduled backup of %s failed - %s"% (
+                        dbname, job.error))
+                else:
+                    LOGGER.error("scheduled backup of %s %s"% (
+                        dbname, job.status))
+
+            while pending and len(running) < backup_config.max_concurrent:
+                if datetime.now() > deadline:
+                    LOGGER.warning(
+                        "backup window closed - not backing up %s"% pending)
+                    pending = []
+                    break
+                dbname = pending.pop(0)
+                job_id = jobs.submit("backup_db", (dbname,),
+                    lambda dbname=dbname:
+                    self.function_store.backup_db(dbname),
+                    "scheduler")
+                running[job_id] = dbname
+
+            if running:
+                time.sleep(POLL_INTERVAL)
+
+def _test():
+    now = datetime.now()
+    times = [(1, 30), (now.hour, now.minute)]
+    LOGGER.debug("due %s"% due_slot(now, sorted(times), 180))
+    LOGGER.debug("due %s"% due_slot(now + timedelta(hours=4), [(1, 30)], 180))
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
@@ -0,0 +1,297 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+provides pools of psycopg2 connections for use by the server functions.
+one pool is kept per (database, autocommit) pair.
+'''
+
+from contextlib import contextmanager
+import threading
+import time
+
+import psycopg2
+
+class PoolError(psycopg2.Error):
+    '''
+    raised when no connection becomes available within the timeout.
+    '''
+    pass
+
+class ConnectionPool(object):
+    '''
+    A thread safe pool of connections to a single database.
+
+    connections are opened on demand (up to maxconn),
+    those unused for more than idle_timeout seconds are closed
+    (but minconn are kept),
+    and those which have been idle for more than check_interval seconds
+    are tested with a trivial query before being handed out again.
+    '''
+    #: seconds a caller will wait for a connection when the pool is full
+    wait_timeout = 30
+
+    #: seconds of idleness after which a connection is checked before use
+    check_interval = 30
+
+    def __init__(self, conn_atts, minconn=1, maxconn=8, idle_timeout=300,
+    autocommit=False):
+        self._conn_atts = conn_atts
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.autocommit = autocommit
+
+        self._idle = []     # a stack of (conn, time_returned)
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return "ConnectionPool (idle=%d, in use=%d, max=%d, autocommit=%s)"% (
+            len(self._idle), self._in_use, self.maxconn, self.autocommit)
+
+    @property
+    def size(self):
+        '''
+        the number of connections currently open
+        '''
+        return len(self._idle) + self._in_use
+
+    def _connect(self):
+        conn = psycopg2.connect(self._conn_atts)
+        if self.autocommit:
+            try:
+                # functions such as create and drop do not support transactions
+                conn.autocommit = True
+            except AttributeError:
+                LOGGER.warning(
+                    "no autocommit attribute in pyscopg2 - old version?")
+                conn.set_isolation_level(0)
+        return conn
+
+    def _is_healthy(self, conn, idle_since):
+        '''
+        check a connection taken from the idle stack is usable
+        '''
+        if conn.closed:
+            return False
+        if time.time() - idle_since < self.check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("select 1")
+            cursor.close()
+            if not self.autocommit:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            LOGGER.warning("discarding broken pooled connection")
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def evict_idle(self):
+        '''
+        close connections which have been idle too long (keeping minconn)
+        '''
+        now = time.time()
+        with self._condition:
+            keep, stale = [], []
+            # the stack has the oldest connections at the bottom
+            for conn, idle_since in self._idle:
+                if (now - idle_since > self.idle_timeout and
+                len(self._idle) - len(stale) > self.minconn):
+                    stale.append(conn)
+                else:
+                    keep.append((conn, idle_since))
+            self._idle = keep
+        for conn in stale:
+            self._close(conn)
+        if stale:
+            LOGGER.debug("closed %d idle connections"% len(stale))
+
+    def getconn(self):
+        '''
+        return a connection, opening a new one if none are idle.
+        blocks for up to wait_timeout seconds if the pool is exhausted.
+        '''
+        self.evict_idle()
+        deadline = time.time() + self.wait_timeout
+        with self._condition:
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolError(
+                        "connection pool exhausted (%d connections)"%
+                        self.maxconn)
+                self._condition.wait(remaining)
+            # reserve the slot, the connection is checked (or opened)
+            # outside the lock
+            self._in_use += 1
+            idle = self._idle.pop() if self._idle else None
+        try:
+            while idle is not None:
+                conn, idle_since = idle
+                if self._is_healthy(conn, idle_since):
+                    return conn
+                self._close(conn)
+                with self._condition:
+                    idle = self._idle.pop() if self._idle else None
+            return self._connect()
+        except:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def putconn(self, conn, discard=False):
+        '''
+        return a connection to the pool.
+        if discard is True (or the connection is unusable, or the pool has
+        been closed) it is closed.
+        '''
+        if not (discard or conn.closed or self.autocommit):
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._condition:
+            self._in_use -= 1
+            keep = not (discard or conn.closed or self._closed)
+            if keep:
+                self._idle.append((conn, time.time()))
+            self._condition.notify()
+        if not keep:
+            self._close(conn)
+
+    def closeall(self):
+        '''
+        close all idle connections.
+        connections in use are closed when they are returned.
+        '''
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, idle_since in idle:
+            self._close(conn)
+
+class ConnectionPools(object):
+    '''
+    A collection of :doc:`ConnectionPool` objects, keyed by database name
+    and whether autocommit is required (eg. for DDL statements).
+    '''
+    def __init__(self, config):
+        self.config = config
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def __conn_atts(self, dbname):
+        '''
+        has to be a private function because of the password!
+        '''
+        return "host='%s' user='%s' port='%s' password='%s' dbname='%s'"% (
+            self.config.postgres_host, self.config.postgres_user,
+            self.config.postgres_port,
+            self.config.postgres_pass, dbname)
+
+    def pool(self, dbname, autocommit=False):
+        '''
+        return the pool for this database, creating it if neccessary.
+        '''
+        key = (dbname, autocommit)
+        with self._lock:
+            try:
+                return self._pools[key]
+            except KeyError:
+                LOGGER.debug("creating connection pool for %s%s"% (
+                    dbname, " (autocommit)" if autocommit else ""))
+                pool = ConnectionPool(self.__conn_atts(dbname),
+                    self.config.pool_min, self.config.pool_max,
+                    self.config.pool_idle_timeout, autocommit)
+                self._pools[key] = pool
+                return pool
+
+    @contextmanager
+    def connection(self, dbname, autocommit=False):
+        '''
+        a context manager which lends a pooled connection.
+        the connection is discarded if a database error escapes the block.
+
+        usage -
+            with pools.connection(dbname) as conn:
+                cursor = conn.cursor()
+        '''
+        pool = self.pool(dbname, autocommit)
+        conn = pool.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            pool.putconn(conn, discard=True)
+            raise
+        except:
+            pool.putconn(conn)
+            raise
+        else:
+            pool.putconn(conn)
+
+    def discard(self, dbname):
+        '''
+        close the idle connections to a database, and forget the pools.
+        this must be called before a database can be dropped.
+        '''
+        with self._lock:
+            pools = [self._pools.pop(key) for key in self._pools.keys()
+                if key[0] == dbname]
+        for pool in pools:
+            pool.closeall()
+
+    def closeall(self):
+        '''
+        close all idle connections in all pools
+        '''
+        with self._lock:
+            pools, self._pools = self._pools.values(), {}
+        for pool in pools:
+            pool.closeall()
+
+def _test():
+    from lib_openmolar.server.misc.om_server_config import OMServerConfig
+    pools = ConnectionPools(OMServerConfig())
+    for i in range(3):
+        with pools.connection("openmolar_master") as conn:
+            cursor = conn.cursor()
+            cursor.execute("select current_setting('server_version')")
+            LOGGER.debug(cursor.fetchone())
+    LOGGER.debug(pools.pool("openmolar_master"))
+    pools.closeall()
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
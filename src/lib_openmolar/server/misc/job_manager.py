@@ -0,0 +1,339 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+provides a JobManager, which runs long running server functions
+(backups, database creation etc.) in background threads, so that the
+remote procedure call which starts them can return immediately.
+
+functions running as a job can use the module level functions
+report_progress, check_cancelled and register_process, these do nothing
+if the function is not running as a job.
+'''
+
+from collections import deque
+import Queue
+import itertools
+import threading
+import time
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+#: the maximum number of log lines kept for each job
+MAX_LOG_LINES = 1000
+
+#: seconds for which a completed job is remembered
+KEEP_COMPLETED = 3600
+
+_local = threading.local()
+
+def failed_result(result):
+    '''
+    True if result is how a server function reports failure.
+    (most catch and log their exceptions, returning "" or False,
+    or None if an sql statement failed)
+    '''
+    return result is None or result is False or result == ""
+
+class JobCancelled(Exception):
+    '''
+    raised by check_cancelled when the job has been cancelled.
+    '''
+    pass
+
+def current_job():
+    '''
+    the :doc:`Job` being run by this thread (or None)
+    '''
+    return getattr(_local, "job", None)
+
+def report_progress(progress=None, message=None):
+    '''
+    update the progress (a percentage) and/or add a line to the log
+    of the current job.
+    '''
+    job = current_job()
+    if job is not None:
+        job.report(progress, message)
+
+def check_cancelled():
+    '''
+    raise JobCancelled if the current job has been cancelled.
+    long running functions should call this whenever it is safe to stop.
+    '''
+    job = current_job()
+    if job is not None and job.cancel_requested:
+        raise JobCancelled("job %s was cancelled"% job.id)
+
+def register_process(process):
+    '''
+    let the current job know of a subprocess, which will be terminated
+    if the job is cancelled.
+    '''
+    job = current_job()
+    if job is not None:
+        job.process = process
+        if job.cancel_requested:
+            job.terminate_process()
+
+class Job(object):
+    '''
+    A function call which runs in the background.
+    '''
+    def __init__(self, job_id, method, args, func, user=None):
+        self.id = job_id
+        self.method = method
+        self.args = args
+        self.user = user
+        self.func = func
+
+        self.status = QUEUED
+        self.progress = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+        self.cancel_requested = False
+        self.process = None
+
+        self._log = deque(maxlen=MAX_LOG_LINES)
+        self._lines_logged = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "Job %s %s%s (%s)"% (self.id, self.method, self.args,
+            self.status)
+
+    @property
+    def is_complete(self):
+        return self.status in (FINISHED, FAILED, CANCELLED)
+
+    def report(self, progress=None, message=None):
+        with self._lock:
+            if progress is not None:
+                self.progress = max(0, min(100, int(progress)))
+            if message is not None:
+                self._log.append(u"%s"% message)
+                self._lines_logged += 1
+
+    def log_lines(self, offset=0):
+        '''
+        returns (lines, next_offset)
+        the log lines written since offset
+        (old lines are discarded once MAX_LOG_LINES is reached)
+        '''
+        with self._lock:
+            first = self._lines_logged - len(self._log)
+            lines = list(self._log)[max(0, offset - first):]
+            return lines, self._lines_logged
+
+    def terminate_process(self):
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                LOGGER.warning("terminating process of %s"% self)
+                self.process.terminate()
+        except OSError:
+            LOGGER.exception("unable to terminate process")
+
+    def cancel(self):
+        '''
+        request cancellation.
+        a queued job is cancelled at once, a running job stops when it next
+        calls check_cancelled (or its subprocess is terminated).
+        '''
+        if self.is_complete:
+            return False
+        self.cancel_requested = True
+        if self.status == QUEUED:
+            self.status = CANCELLED
+            self.finished = time.time()
+        else:
+            self.terminate_process()
+        self.report(message="cancellation requested")
+        return True
+
+    def run(self):
+        if self.cancel_requested:
+            return
+        _local.job = self
+        self.status = RUNNING
+        self.started = time.time()
+        LOGGER.info("starting %s"% self)
+        try:
+            self.result = self.func()
+            if self.cancel_requested:
+                self.status = CANCELLED
+            elif failed_result(self.result):
+                self.error = u"%s failed - check the server log"% self.method
+                self.status = FAILED
+            else:
+                self.status = FINISHED
+                self.report(100)
+        except JobCancelled:
+            self.status = CANCELLED
+        except Exception as exc:
+            LOGGER.exception("exception in %s"% self)
+            self.error = u"%s"% exc
+            self.status = FAILED
+        finally:
+            _local.job = None
+            self.process = None
+            self.func = None
+            self.finished = time.time()
+            LOGGER.info("%s completed in %.1f seconds"% (
+                self, self.finished - self.started))
+
+    def status_dict(self, log_offset=None):
+        '''
+        a summary of the job which can be passed to the client.
+        if log_offset is not None, log lines written since then are included.
+        '''
+        info = {
+            "id" : self.id,
+            "method" : self.method,
+            "args" : list(self.args),
+            "user" : self.user,
+            "status" : self.status,
+            "progress" : self.progress,
+            "result" : self.result,
+            "error" : self.error,
+            "created" : self.created,
+            "started" : self.started,
+            "finished" : self.finished,
+            }
+        if log_offset is not None:
+            info["log"], info["log_offset"] = self.log_lines(log_offset)
+        return info
+
+class JobManager(object):
+    '''
+    runs :doc:`Job` objects on a fixed number of worker threads.
+    '''
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._jobs = {}
+        self._queue = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _start_workers(self):
+        # workers are started on demand, as the server forks after the
+        # FunctionStore may have been created.
+        self._queue = Queue.Queue()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                args=(self._queue,), name="job_worker_%d"% i)
+            thread.daemon = True
+            thread.start()
+
+    def _work(self, queue):
+        while True:
+            job = queue.get()
+            if job is None:
+                break
+            job.run()
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in self._jobs.items():
+            if job.is_complete and now - job.finished > KEEP_COMPLETED:
+                self._jobs.pop(job_id)
+
+    def submit(self, method, args, func, user=None):
+        '''
+        queue func (a callable taking no arguments) to be run.
+        returns the job id.
+        '''
+        with self._lock:
+            self._prune()
+            if self._queue is None:
+                self._start_workers()
+            job = Job(self._ids.next(), method, args, func, user)
+            self._jobs[job.id] = job
+        LOGGER.info("queued %s"% job)
+        self._queue.put(job)
+        return job.id
+
+    def get(self, job_id):
+        '''
+        returns the job with this id, raises KeyError if not known.
+        '''
+        with self._lock:
+            return self._jobs[job_id]
+
+    def jobs(self):
+        '''
+        all known jobs, oldest first.
+        '''
+        with self._lock:
+            self._prune()
+            return sorted(self._jobs.values(), key=lambda job: job.id)
+
+    def cancel(self, job_id):
+        return self.get(job_id).cancel()
+
+    def stop(self):
+        '''
+        cancel all jobs, and stop the worker threads.
+        '''
+        for job in self.jobs():
+            job.cancel()
+        with self._lock:
+            if self._queue is not None:
+                for i in range(self.workers):
+                    self._queue.put(None)
+                self._queue = None
+
+def _test():
+    def slow_function(n):
+        for i in range(n):
+            check_cancelled()
+            report_progress(100 * i / n, "step %d"% i)
+            time.sleep(0.1)
+        return n
+
+    manager = JobManager(1)
+    first = manager.submit("slow_function", (5,), lambda: slow_function(5))
+    second = manager.submit("slow_function", (50,), lambda: slow_function(50))
+    time.sleep(0.3)
+    LOGGER.debug(manager.get(first).status_dict(0))
+    time.sleep(0.5)
+    manager.cancel(second)
+    time.sleep(0.3)
+    for job in manager.jobs():
+        LOGGER.debug(job.status_dict(0))
+    manager.stop()
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
@@ -0,0 +1,578 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+a load test for the openmolar server.
+
+a throwaway postgres cluster is created (with initdb, in a temporary
+directory), an openmolar server is started against it (in a separate
+process, with its own config files and a self-signed certificate) and a
+number of threads, each with its own :doc:`ProxyClient`, call a mix of
+server functions for a given time.
+the throughput, latency percentiles and error rate of each function are
+reported.
+
+usage (as a normal user - initdb refuses to run as root)
+
+    python -m lib_openmolar.server.misc.load_test --clients=20 --duration=30
+
+or, to test a server which is already running
+
+    python -m lib_openmolar.server.misc.load_test --host=localhost \\
+        --port=1430 --user=admin --password=XXXX --database=openmolar_demo
+'''
+
+import __builtin__
+import glob
+import json
+import logging
+import math
+from optparse import OptionParser, SUPPRESS_HELP
+import os
+import random
+import shutil
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import lib_openmolar
+from lib_openmolar.server.misc.password_generator import pass_hash
+
+#: the functions called, and their relative frequency
+DEFAULT_MIX = "ping=50,admin_welcome=20,get_user_permissions=25,backup_db=5"
+
+DEFAULT_CLIENTS = 10
+DEFAULT_DURATION = 30
+
+#: the percentiles of latency reported
+PERCENTILES = (50, 90, 99)
+
+#: seconds to wait for the server to accept connections
+SERVER_START_TIMEOUT = 30
+
+#: the database (and login role) created in the throwaway cluster
+LOAD_TEST_DB = "openmolar_loadtest"
+LOAD_TEST_USER = "om_loadtest"
+
+SETUP_SQL = '''
+CREATE ROLE openmolar LOGIN SUPERUSER PASSWORD '%(password)s';
+CREATE DATABASE openmolar_master OWNER openmolar;
+CREATE DATABASE %(dbname)s OWNER openmolar;
+CREATE ROLE om_admin_group_%(dbname)s;
+CREATE ROLE om_client_group_%(dbname)s;
+CREATE ROLE %(user)s LOGIN IN ROLE om_client_group_%(dbname)s;
+'''
+
+DATABASE_SQL = '''
+CREATE TABLE settings (ix serial PRIMARY KEY, key text, data text);
+INSERT INTO settings (key, data) VALUES ('schema_version', 'load_test');
+'''
+
+SERVER_CONF = '''
+[config]
+version = 1.0
+
+[postgresql]
+host = localhost
+port = %(pg_port)d
+user = openmolar
+password = %(pg_password)s
+
+[managers-md5]
+admin = %(hash)s
+
+[230server]
+listen = localhost
+port = %(port)d
+processes = %(processes)d
+workers = %(workers)d
+queue_depth = 64
+job_workers = 2
+session_ttl = 900
+keepalive_timeout = 5
+stats = True
+
+[ssl]
+cert = %(cert)s
+key = %(key)s
+'''
+
+BACKUP_CONF = '''
+[config]
+version = 1.0
+
+[backup]
+location = %(location)s
+schedule =
+max_concurrent = 1
+nice = 0
+ionice = none
+verify = False
+keep = 2
+'''
+
+def free_port():
+    '''
+    a tcp port which is not in use on localhost
+    '''
+    sock = socket.socket()
+    sock.bind(("localhost", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def postgres_bindir():
+    '''
+    the directory holding initdb and pg_ctl (which are often not on the
+    PATH), or None if they are on the PATH.
+    '''
+    try:
+        bindir = subprocess.Popen(["pg_config", "--bindir"],
+            stdout=subprocess.PIPE).communicate()[0].strip()
+        if os.path.isfile(os.path.join(bindir, "initdb")):
+            return bindir
+    except OSError:
+        pass
+    # debian/ubuntu keep the server binaries out of the PATH
+    candidates = glob.glob("/usr/lib/postgresql/*/bin/initdb")
+    if candidates:
+        candidates.sort(key=lambda path: [int(part) for part in
+            path.split("/")[4].split(".") if part.isdigit()])
+        return os.path.dirname(candidates[-1])
+    return None
+
+class ThrowawayPostgres(object):
+    '''
+    a postgres cluster in a temporary directory, listening on localhost,
+    with the openmolar role, openmolar_master and a small database.
+    '''
+    def __init__(self, directory, bindir=None):
+        self.directory = directory
+        self.bindir = bindir or postgres_bindir()
+        self.data_dir = os.path.join(directory, "pgdata")
+        self.port = free_port()
+        self.password = pass_hash()[0]
+        self.log = open(os.path.join(directory, "postgres.log"), "a")
+
+    def _command(self, name):
+        if self.bindir:
+            return os.path.join(self.bindir, name)
+        return name
+
+    def _run(self, args, stdin=None):
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+            stdout=self.log, stderr=self.log)
+        proc.communicate(stdin)
+        if proc.returncode != 0:
+            raise IOError("%s failed (exit code %s), see %s"% (
+                args[0], proc.returncode, self.log.name))
+
+    def _psql(self, dbname, sql):
+        self._run([self._command("psql"), "-X", "-q", "-v", "ON_ERROR_STOP=1",
+            "-h", "localhost", "-p", str(self.port), "-U", "postgres",
+            "-d", dbname], sql)
+
+    def start(self):
+        LOGGER.info("creating a postgres cluster in %s"% self.data_dir)
+        self._run([self._command("initdb"), "-D", self.data_dir,
+            "-U", "postgres", "-A", "trust", "-E", "UTF8"])
+        self._run([self._command("pg_ctl"), "-D", self.data_dir, "-w",
+            "-l", os.path.join(self.directory, "postgres_server.log"),
+            "-o", "-p %d -k %s -c listen_addresses=localhost -c fsync=off"% (
+            self.port, self.directory), "start"])
+        LOGGER.info("postgres listening on port %d"% self.port)
+        self._psql("postgres", SETUP_SQL% {"password": self.password,
+            "dbname": LOAD_TEST_DB, "user": LOAD_TEST_USER})
+        self._psql(LOAD_TEST_DB, DATABASE_SQL)
+
+    def stop(self):
+        try:
+            self._run([self._command("pg_ctl"), "-D", self.data_dir,
+                "-m", "immediate", "stop"])
+        except IOError:
+            LOGGER.exception("unable to stop postgres")
+        self.log.close()
+
+class ThrowawayServer(object):
+    '''
+    an openmolar server (in a child process) using config files (and a run
+    directory) in a temporary directory.
+    '''
+    def __init__(self, directory, postgres, processes=0, workers=4):
+        self.directory = directory
+        self.postgres = postgres
+        self.processes = processes
+        self.workers = workers
+        self.port = free_port()
+        self.password, self.hash = pass_hash()
+        self.proc = None
+
+    def _write_config(self):
+        cert = os.path.join(self.directory, "cert.pem")
+        key = os.path.join(self.directory, "privatekey.pem")
+        subprocess.check_call(["openssl", "req", "-new", "-x509",
+            "-days", "1", "-nodes", "-subj", "/CN=localhost",
+            "-out", cert, "-keyout", key],
+            stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+
+        self.cert = cert
+        self.conf_file = os.path.join(self.directory, "server.conf")
+        f = open(self.conf_file, "w")
+        f.write(SERVER_CONF% {
+            "pg_port" : self.postgres.port,
+            "pg_password" : self.postgres.password,
+            "hash" : self.hash,
+            "port" : self.port,
+            "processes" : self.processes,
+            "workers" : self.workers,
+            "cert" : cert,
+            "key" : key,
+            })
+        f.close()
+
+        self.backup_file = os.path.join(self.directory, "backup.conf")
+        f = open(self.backup_file, "w")
+        f.write(BACKUP_CONF% {
+            "location" : os.path.join(self.directory, "backups")})
+        f.close()
+
+    def start(self):
+        self._write_config()
+        env = dict(os.environ)
+        env["OPENMOLAR_SERVER_CONF"] = self.conf_file
+        env["OPENMOLAR_BACKUP_CONF"] = self.backup_file
+        # session tokens, metrics and locks (of worker processes)
+        env["OPENMOLAR_RUN_DIR"] = os.path.join(self.directory, "run")
+        env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(
+            os.path.dirname(lib_openmolar.__file__))] + filter(None,
+            [env.get("PYTHONPATH")]))
+        if self.postgres.bindir:
+            # use the pg_dump which matches the cluster
+            env["PATH"] = self.postgres.bindir + os.pathsep + env["PATH"]
+        self.proc = subprocess.Popen([sys.executable, "-m",
+            "lib_openmolar.server.misc.load_test", "--serve", self.directory],
+            env=env)
+
+        deadline = time.time() + SERVER_START_TIMEOUT
+        while True:
+            if self.proc.poll() is not None:
+                raise IOError("the server exited, see %s"%
+                    os.path.join(self.directory, "server.log"))
+            try:
+                socket.create_connection(("localhost", self.port), 1).close()
+                break
+            except socket.error:
+                if time.time() > deadline:
+                    raise IOError("the server did not start")
+                time.sleep(0.2)
+        LOGGER.info("openmolar server (pid %d) listening on port %d"% (
+            self.proc.pid, self.port))
+
+    def stop(self):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        self.proc.send_signal(signal.SIGTERM)
+        deadline = time.time() + SERVER_START_TIMEOUT
+        while self.proc.poll() is None and time.time() < deadline:
+            time.sleep(0.2)
+        if self.proc.poll() is None:
+            LOGGER.warning("server did not stop - killing it")
+            self.proc.kill()
+            self.proc.wait()
+
+def serve(directory):
+    '''
+    run a server in the foreground (the body of ThrowawayServer's process)
+    '''
+    __builtin__.LOGGER = logging.getLogger("openmolar_server")
+    handler = logging.FileHandler(os.path.join(directory, "server.log"))
+    handler.setFormatter(
+        logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    LOGGER.addHandler(handler)
+
+    from lib_openmolar.server.server import OMServer
+    OMServer(verbose=False).start(daemonise=False)
+
+def parse_mix(mix):
+    '''
+    parse "func=weight,func=weight" into a list of (func, weight)
+    '''
+    result = []
+    for item in mix.split(","):
+        func, weight = item.split("=")
+        result.append((func.strip(), int(weight)))
+    return result
+
+def percentile(sorted_values, percent):
+    '''
+    the nearest rank percentile of a sorted list
+    '''
+    if not sorted_values:
+        return 0
+    index = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, index)]
+
+class LoadTest(object):
+    '''
+    drives a number of concurrent clients through a mix of server calls.
+    '''
+    def __init__(self, host, port, user, password, dbname, db_user,
+    clients=DEFAULT_CLIENTS, duration=DEFAULT_DURATION, mix=DEFAULT_MIX,
+    cafile=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.dbname = dbname
+        self.db_user = db_user
+        self.clients = clients
+        self.duration = duration
+        self.mix = parse_mix(mix)
+        # the certificate(s) trusted, eg. the throwaway server's own
+        self.cafile = cafile
+        self._lock = threading.Lock()
+        # func: list of (seconds, ok)
+        self.results = {}
+
+    def args(self, func):
+        '''
+        the arguments passed to each function
+        '''
+        if func == "get_user_permissions":
+            return (self.db_user, self.dbname)
+        if func in ("backup_db", "get_schema_version", "list_sessions"):
+            return (self.dbname,)
+        return ()
+
+    def _choose(self, rand):
+        total = sum([weight for func, weight in self.mix])
+        value = rand.uniform(0, total)
+        for func, weight in self.mix:
+            value -= weight
+            if value <= 0:
+                return func
+        return self.mix[-1][0]
+
+    def _proxy_client(self):
+        from lib_openmolar.common.datatypes import Connection230Data
+        from lib_openmolar.common.connect import ProxyClient, ProxyUser
+        conn_data = Connection230Data()
+        conn_data.host = self.host
+        conn_data.port = self.port
+        proxy_client = ProxyClient(conn_data,
+            ProxyUser(self.user, self.password))
+        if self.cafile:
+            proxy_client.ssl_context = ssl.create_default_context(
+                cafile=self.cafile)
+        return proxy_client
+
+    def _record(self, func, seconds, ok):
+        with self._lock:
+            self.results.setdefault(func, []).append((seconds, ok))
+
+    def _client(self, index, deadline):
+        rand = random.Random(index)
+        proxy_client = self._proxy_client()
+        while time.time() < deadline:
+            if not proxy_client.is_connected:
+                start = time.time()
+                try:
+                    proxy_client.connect()
+                except proxy_client.ConnectionError:
+                    self._record("(connect)", time.time() - start, False)
+                    time.sleep(0.1)
+                    continue
+            func = self._choose(rand)
+            start = time.time()
+            try:
+                if func == "ping":
+                    # answered by the server itself, not in a payload
+                    ok = proxy_client.ping() is True
+                else:
+                    payload = proxy_client.call(func, *self.args(func))
+                    # no payload means no connection, "" a server side error
+                    ok = payload.payload not in (None, "")
+            except Exception:
+                ok = False
+            self._record(func, time.time() - start, ok)
+
+    def run(self):
+        '''
+        run the clients, and return the report (see report)
+        '''
+        LOGGER.info("running %d clients for %d seconds"% (
+            self.clients, self.duration))
+        self.results = {}
+        deadline = time.time() + self.duration
+        threads = []
+        for i in range(self.clients):
+            thread = threading.Thread(target=self._client,
+                args=(i, deadline), name="load_test_%d"% i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        start = time.time()
+        for thread in threads:
+            thread.join()
+        return self.report(time.time() - start)
+
+    def report(self, elapsed):
+        '''
+        a dictionary {func: statistics} ("all" for every call)
+        latencies are in milliseconds.
+        '''
+        report = {}
+        everything = []
+        for func, results in self.results.items():
+            report[func] = self._statistics(results, elapsed)
+            everything.extend(results)
+        report["all"] = self._statistics(everything, elapsed)
+        return report
+
+    def _statistics(self, results, elapsed):
+        latencies = sorted([seconds * 1000 for seconds, ok in results])
+        errors = len([ok for seconds, ok in results if not ok])
+        statistics = {
+            "calls" : len(results),
+            "errors" : errors,
+            "error_rate" : float(errors) / len(results) if results else 0,
+            "per_second" : len(results) / elapsed if elapsed else 0,
+            "max_ms" : latencies[-1] if latencies else 0,
+            }
+        for percent in PERCENTILES:
+            statistics["p%d_ms"% percent] = percentile(latencies, percent)
+        return statistics
+
+def format_report(report):
+    '''
+    the report as a text table
+    '''
+    columns = ["calls", "per_second", "errors", "error_rate"] + [
+        "p%d_ms"% percent for percent in PERCENTILES] + ["max_ms"]
+    lines = ["%-24s"% "function" + "".join(["%12s"% column
+        for column in columns])]
+    for func in sorted(report, key=lambda func: (func == "all", func)):
+        statistics = report[func]
+        line = "%-24s"% func
+        for column in columns:
+            value = statistics[column]
+            if column == "error_rate":
+                line += "%11.2f%%"% (value * 100)
+            elif isinstance(value, float):
+                line += "%12.1f"% value
+            else:
+                line += "%12d"% value
+        lines.append(line)
+    return "\n".join(lines)
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-c", "--clients", type="int", default=DEFAULT_CLIENTS,
+        help="number of concurrent clients (default %d)"% DEFAULT_CLIENTS)
+    parser.add_option("-d", "--duration", type="int",
+        default=DEFAULT_DURATION,
+        help="seconds to run the test for (default %d)"% DEFAULT_DURATION)
+    parser.add_option("--mix", default=DEFAULT_MIX,
+        help="functions called, and their weights (default %s)"%
+        DEFAULT_MIX)
+    parser.add_option("--processes", type="int", default=0,
+        help="server worker processes (0 for a single process)")
+    parser.add_option("--workers", type="int", default=4,
+        help="request threads in each server process")
+    parser.add_option("--postgres-bindir",
+        help="directory of initdb and pg_ctl")
+    parser.add_option("--keep", action="store_true",
+        help="keep the temporary directory (with the server logs)")
+    parser.add_option("--json", help="also write the report to this file")
+
+    parser.add_option("--host",
+        help="test a running server on this host (no cluster is created)")
+    parser.add_option("--port", type="int", default=1430)
+    parser.add_option("--user", default="admin")
+    parser.add_option("--password", default="")
+    parser.add_option("--database", default="openmolar_demo")
+    parser.add_option("--db-user", default="om_demo",
+        help="login role passed to get_user_permissions")
+    parser.add_option("--cafile",
+        help="certificate(s) to verify the running server with")
+
+    parser.add_option("--serve", help=SUPPRESS_HELP)
+
+    options, args = parser.parse_args()
+
+    if options.serve:
+        serve(options.serve)
+        return
+
+    logging.basicConfig(level=logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s')
+    __builtin__.LOGGER = logging.getLogger("openmolar_load_test")
+
+    directory = postgres = server = None
+    try:
+        if options.host:
+            host, port = options.host, options.port
+            user, password = options.user, options.password
+            dbname, db_user = options.database, options.db_user
+            cafile = options.cafile
+        else:
+            directory = tempfile.mkdtemp(prefix="openmolar_load_test_")
+            postgres = ThrowawayPostgres(directory, options.postgres_bindir)
+            postgres.start()
+            server = ThrowawayServer(directory, postgres, options.processes,
+                options.workers)
+            server.start()
+            host, port = "localhost", server.port
+            user, password = "admin", server.password
+            dbname, db_user = LOAD_TEST_DB, LOAD_TEST_USER
+            cafile = server.cert
+
+        load_test = LoadTest(host, port, user, password, dbname, db_user,
+            options.clients, options.duration, options.mix, cafile)
+        report = load_test.run()
+    finally:
+        if server is not None:
+            server.stop()
+        if postgres is not None:
+            postgres.stop()
+        if directory is not None:
+            if options.keep:
+                LOGGER.info("logs and config kept in %s"% directory)
+            else:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    print format_report(report)
+    if options.json:
+        f = open(options.json, "w")
+        json.dump(report, f, indent=2)
+        f.close()
+    # a non zero exit code if any call failed (eg. for a ci job)
+    if report["all"]["errors"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+incremental reading of the server log.
+
+a client remembers the offset (and inode) returned by each call to read_log,
+and passes them back next time, so only lines written since the last poll
+are read - however large the log has grown.
+'''
+
+import os
+import re
+
+#: the most bytes returned by a single call
+MAX_CHUNK = 256 * 1024
+
+#: the bytes returned when a client first opens the log (offset < 0)
+INITIAL_TAIL = 64 * 1024
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+# lines written by lib_openmolar.server.misc.logger start with
+# "2012-10-02 10:18:33,003 LEVEL"
+_RECORD = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d+ ([A-Z]+) ")
+
+def filter_lines(lines, level):
+    '''
+    remove lines logged below level.
+    lines which do not start a record (eg. tracebacks) share the fate of
+    the record they follow.
+    '''
+    threshold = LEVELS.get(str(level).upper(), 0)
+    if threshold == 0:
+        return lines
+    keep, result = True, []
+    for line in lines:
+        match = _RECORD.match(line)
+        if match:
+            keep = LEVELS.get(match.group(1), 0) >= threshold
+        if keep:
+            result.append(line)
+    return result
+
+def read_log(path, offset=-1, max_bytes=MAX_CHUNK, level=None, inode=None):
+    '''
+    read complete lines from the log at path, starting at offset.
+
+    an offset < 0 means "the last few lines".
+    if inode is given and no longer matches the file (or the file is now
+    shorter than offset) the log has been rotated, and reading restarts
+    at the beginning of the new file.
+
+    returns a dictionary with keys
+        lines, offset (to pass next time), size, inode, rotated, more
+
+    NOTE - xmlrpc integers are only 32 bit, so offset and inode
+    may be passed (and inode is returned) as strings.
+    '''
+    offset = int(offset)
+    max_bytes = max(1, min(int(max_bytes), MAX_CHUNK))
+    try:
+        f = open(path, "rb")
+    except IOError as exc:
+        LOGGER.warning("unable to open log file %s"% exc)
+        return {"lines": [], "offset": 0, "size": 0, "inode": None,
+            "rotated": False, "more": False}
+    try:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        rotated = False
+        if (inode is not None and str(inode) != str(stat.st_ino)
+        or offset > size):
+            rotated, offset = True, 0
+        elif offset < 0:
+            offset = max(0, size - INITIAL_TAIL)
+            if offset:
+                # start at the beginning of a line
+                f.seek(offset)
+                offset += len(f.readline())
+
+        f.seek(offset)
+        data = f.read(max_bytes)
+    finally:
+        f.close()
+
+    end = data.rfind("\n")
+    if end == -1 and len(data) == max_bytes:
+        # a single line longer than max_bytes, return it in pieces
+        end = len(data) - 1
+    data = data[:end + 1]
+    next_offset = offset + len(data)
+
+    lines = data.decode("utf-8", "replace").splitlines()
+    return {
+        "lines": filter_lines(lines, level),
+        "offset": next_offset,
+        "size": size,
+        "inode": str(stat.st_ino),
+        "rotated": rotated,
+        "more": next_offset < size,
+        }
+
+def _test():
+    import tempfile
+    f = tempfile.NamedTemporaryFile()
+    for i in range(10000):
+        f.write("2012-10-02 10:18:33,003 %s message %d\n"% (
+            "DEBUG" if i % 2 else "WARNING", i))
+    f.flush()
+
+    result = read_log(f.name)
+    LOGGER.debug("tail %d lines, offset %d of %d"% (
+        len(result["lines"]), result["offset"], result["size"]))
+
+    f.write("2012-10-02 10:18:33,003 ERROR new\nTraceback\n")
+    f.flush()
+    result = read_log(f.name, result["offset"], level="WARNING",
+        inode=result["inode"])
+    LOGGER.debug(result)
+    f.close()
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
@@ -0,0 +1,414 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+per method call counts, errors, latencies and response sizes
+for the functions called on the openmolar server.
+
+these are served (without authentication) by the request handler as
+json at /stats and in the prometheus text format at /metrics
+
+in pre-fork mode each worker process keeps its own metrics, and writes them
+to a file (see SharedMetrics), so that the totals for all the workers are
+served whichever process accepts the connection.
+'''
+
+from collections import deque
+import errno
+import json
+import os
+import threading
+import time
+
+from lib_openmolar.server.misc.om_server_config import RUN_DIR
+
+#: upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+#: the number of recent calls from which percentiles are calculated
+SAMPLE_SIZE = 512
+
+#: where SharedMetrics writes the metrics of each worker process
+METRICS_DIR = os.path.join(RUN_DIR, "metrics")
+
+#: seconds between writes of a worker's metrics
+SHARE_INTERVAL = 5
+
+#: the attributes of :doc:`MethodStats` which are summed across processes
+SUMMED = ("calls", "errors", "denied", "in_flight", "total_seconds",
+    "response_bytes", "responses")
+
+def percentile(ordered, fraction):
+    '''
+    the value at fraction (0-1) of the way through an ordered list
+    (None for an empty list)
+    '''
+    if not ordered:
+        return None
+    index = int(round(fraction * (len(ordered) - 1)))
+    return ordered[index]
+
+class MethodStats(object):
+    '''
+    the statistics for one method.
+    '''
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.denied = 0
+        self.in_flight = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.response_bytes = 0
+        self.responses = 0
+        self.max_response_bytes = 0
+        self.recent = deque(maxlen=SAMPLE_SIZE)
+
+    def add(self, seconds, error=False, denied=False):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        if denied:
+            self.denied += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def add_response(self, n_bytes):
+        self.responses += 1
+        self.response_bytes += n_bytes
+        self.max_response_bytes = max(self.max_response_bytes, n_bytes)
+
+    def state(self):
+        '''
+        the statistics as a dictionary (which can be written as json)
+        '''
+        state = dict([(name, getattr(self, name)) for name in SUMMED])
+        state["max_seconds"] = self.max_seconds
+        state["max_response_bytes"] = self.max_response_bytes
+        state["bucket_counts"] = list(self.bucket_counts)
+        state["recent"] = list(self.recent)
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls()
+        for name, value in state.iteritems():
+            setattr(stats, name, value)
+        stats.recent = deque(state["recent"], maxlen=SAMPLE_SIZE)
+        return stats
+
+    def merge(self, other):
+        '''
+        add the statistics of other (the same method in another process)
+        '''
+        for name in SUMMED:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.max_response_bytes = max(self.max_response_bytes,
+            other.max_response_bytes)
+        self.bucket_counts = [a + b for a, b in
+            zip(self.bucket_counts, other.bucket_counts)]
+        # percentiles are taken from the recent calls of every process
+        self.recent = deque(list(self.recent) + list(other.recent))
+
+    def summary(self):
+        ordered = sorted(self.recent)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "denied": self.denied,
+            "in_flight": self.in_flight,
+            "mean_ms": round(1000 * self.total_seconds / self.calls, 2)
+                if self.calls else None,
+            "p50_ms": _ms(percentile(ordered, 0.5)),
+            "p95_ms": _ms(percentile(ordered, 0.95)),
+            "p99_ms": _ms(percentile(ordered, 0.99)),
+            "max_ms": _ms(self.max_seconds),
+            "response_bytes": self.response_bytes,
+            "mean_response_bytes": self.response_bytes / self.responses
+                if self.responses else None,
+            "max_response_bytes": self.max_response_bytes,
+            }
+
+def _ms(seconds):
+    if seconds is None:
+        return None
+    return round(seconds * 1000, 2)
+
+class Metrics(object):
+    '''
+    a thread safe collection of :doc:`MethodStats`, keyed by method name.
+    '''
+    def __init__(self):
+        self.started = time.time()
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, method):
+        try:
+            return self._methods[method]
+        except KeyError:
+            stats = self._methods[method] = MethodStats()
+            return stats
+
+    def call_started(self, method):
+        '''
+        note that a call has started, returns the start time.
+        '''
+        with self._lock:
+            self._stats(method).in_flight += 1
+        return time.time()
+
+    def call_finished(self, method, started, error=False, denied=False):
+        seconds = time.time() - started
+        with self._lock:
+            stats = self._stats(method)
+            stats.in_flight -= 1
+            stats.add(seconds, error, denied)
+
+    def response_sent(self, method, n_bytes):
+        with self._lock:
+            self._stats(method).add_response(n_bytes)
+
+    def _state(self):
+        '''
+        the metrics as a dictionary (which can be written as json)
+        '''
+        with self._lock:
+            methods = dict([(method, stats.state())
+                for method, stats in self._methods.iteritems()])
+        return {"pid": os.getpid(), "started": self.started,
+            "methods": methods}
+
+    def _served(self):
+        '''
+        returns (start time, {method: MethodStats}), the metrics to serve.
+        '''
+        state = self._state()
+        return state["started"], dict([
+            (method, MethodStats.from_state(stats))
+            for method, stats in state["methods"].iteritems()])
+
+    def snapshot(self):
+        '''
+        a dictionary summarising all methods
+        '''
+        started, stats = self._served()
+        methods = dict([(method, method_stats.summary())
+            for method, method_stats in stats.iteritems()])
+        return {
+            "uptime": int(time.time() - started),
+            "in_flight": sum([m["in_flight"] for m in methods.values()]),
+            "methods": methods,
+            }
+
+    def prometheus(self):
+        '''
+        the metrics in the prometheus text exposition format
+        '''
+        started, stats = self._served()
+        lines = [
+            "# HELP openmolar_uptime_seconds seconds since the server started",
+            "# TYPE openmolar_uptime_seconds gauge",
+            "openmolar_uptime_seconds %d"% (time.time() - started),
+            ]
+
+        def add(name, type_, help_text, values):
+            lines.append("# HELP %s %s"% (name, help_text))
+            lines.append("# TYPE %s %s"% (name, type_))
+            lines.extend(values)
+
+        methods = sorted(stats.items())
+        label = lambda method: 'method="%s"'% method
+
+        add("openmolar_rpc_calls_total", "counter", "calls per method",
+            ["openmolar_rpc_calls_total{%s} %d"% (label(m), s.calls)
+            for m, s in methods])
+        add("openmolar_rpc_errors_total", "counter",
+            "calls which raised an exception",
+            ["openmolar_rpc_errors_total{%s} %d"% (label(m), s.errors)
+            for m, s in methods])
+        add("openmolar_rpc_denied_total", "counter",
+            "calls refused for lack of permission",
+            ["openmolar_rpc_denied_total{%s} %d"% (label(m), s.denied)
+            for m, s in methods])
+        add("openmolar_rpc_in_flight", "gauge", "calls in progress",
+            ["openmolar_rpc_in_flight{%s} %d"% (label(m), s.in_flight)
+            for m, s in methods])
+
+        values = []
+        for m, s in methods:
+            cumulative = 0
+            for bound, count in zip(BUCKETS, s.bucket_counts):
+                cumulative += count
+                values.append(
+                    'openmolar_rpc_duration_seconds_bucket{%s,le="%s"} %d'
+                    % (label(m), bound, cumulative))
+            values.append(
+                'openmolar_rpc_duration_seconds_bucket{%s,le="+Inf"} %d'
+                % (label(m), s.calls))
+            values.append("openmolar_rpc_duration_seconds_sum{%s} %f"% (
+                label(m), s.total_seconds))
+            values.append("openmolar_rpc_duration_seconds_count{%s} %d"% (
+                label(m), s.calls))
+        add("openmolar_rpc_duration_seconds", "histogram",
+            "time taken by each call", values)
+
+        values = []
+        for m, s in methods:
+            values.append("openmolar_rpc_response_bytes_sum{%s} %d"% (
+                label(m), s.response_bytes))
+            values.append("openmolar_rpc_response_bytes_count{%s} %d"% (
+                label(m), s.responses))
+        add("openmolar_rpc_response_bytes", "summary",
+            "size of the (serialised) responses", values)
+
+        return "\n".join(lines) + "\n"
+
+def _alive(pid):
+    '''
+    True if a process with this pid is running
+    '''
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+def clear_shared_metrics(directory=METRICS_DIR):
+    '''
+    remove the metrics written by the worker processes of a previous server.
+    '''
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+class SharedMetrics(Metrics):
+    '''
+    the metrics of one of several worker processes.
+    these are written to a file in directory every SHARE_INTERVAL seconds
+    (and before serving), the totals of all the files are served.
+    the files of workers which have stopped are kept, so that the counters
+    served never go backwards.
+    '''
+    def __init__(self, directory=METRICS_DIR):
+        Metrics.__init__(self)
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        self._path = os.path.join(directory, "%d-%d.json"% (
+            os.getpid(), self.started * 1000000))
+        self._write_lock = threading.Lock()
+        self._write()
+        thread = threading.Thread(target=self._share_forever,
+            name="share_metrics")
+        thread.daemon = True
+        thread.start()
+
+    def _share_forever(self):
+        while True:
+            time.sleep(SHARE_INTERVAL)
+            try:
+                self._write()
+            except (IOError, OSError):
+                LOGGER.exception("unable to write metrics to %s"% self._path)
+
+    def _write(self):
+        '''
+        write the metrics of this process (under a hidden name, then
+        renamed, so other processes never read a partly written file)
+        '''
+        with self._write_lock:
+            temp_path = os.path.join(self.directory,
+                "." + os.path.basename(self._path))
+            f = open(temp_path, "w")
+            try:
+                json.dump(self._state(), f)
+            finally:
+                f.close()
+            os.rename(temp_path, self._path)
+
+    def _read(self, path):
+        try:
+            f = open(path)
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+
+    def _served(self):
+        '''
+        returns (start time, {method: MethodStats}), the totals of all the
+        worker processes.
+        '''
+        self._write()
+        started, methods = self.started, {}
+        for name in os.listdir(self.directory):
+            if name.startswith("."):
+                continue
+            state = self._read(os.path.join(self.directory, name))
+            if state is None:
+                continue
+            started = min(started, state["started"])
+            alive = _alive(state["pid"])
+            for method, method_state in state["methods"].iteritems():
+                stats = MethodStats.from_state(method_state)
+                if not alive:
+                    stats.in_flight = 0
+                if method in methods:
+                    methods[method].merge(stats)
+                else:
+                    methods[method] = stats
+        return started, methods
+
+def _test():
+    import random
+    metrics = Metrics()
+    for i in range(200):
+        method = random.choice(("admin_welcome", "backup_db", "ping"))
+        started = metrics.call_started(method)
+        metrics.call_finished(method, started - random.random(),
+            error=random.random() < 0.1)
+        metrics.response_sent(method, random.randint(100, 10000))
+    LOGGER.debug(metrics.snapshot())
+    LOGGER.debug(metrics.prometheus())
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
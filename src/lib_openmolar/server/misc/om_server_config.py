@@ -22,6 +22,8 @@
 
 import os
 import sys
+import threading
+import time
 import ConfigParser
 
 from lib_openmolar.server.misc.password_generator import (
@@ -31,9 +33,18 @@ ROOT_DIR = "/etc/openmolar/"
 PASSWORD_FILE = os.path.join(ROOT_DIR, "manager_password.txt")
 
 SERVER_DIR = os.path.join(ROOT_DIR, "server")
-CONF_FILE = os.path.join(SERVER_DIR, "server.conf")
+#: (may be moved with the environment variable OPENMOLAR_SERVER_CONF,
+#: eg. to run a throwaway server for load testing)
+CONF_FILE = os.environ.get("OPENMOLAR_SERVER_CONF",
+    os.path.join(SERVER_DIR, "server.conf"))
 BACKUP_FILE = os.path.join(SERVER_DIR, "backup.conf")
 
+#: where the server keeps the files shared by its processes
+#: (session tokens, metrics and locks)
+#: (may be moved with the environment variable OPENMOLAR_RUN_DIR,
+#: eg. to run a throwaway server as a normal user)
+RUN_DIR = os.environ.get("OPENMOLAR_RUN_DIR", "/var/run/openmolar")
+
 KEY_DIR = "/usr/share/openmolar/"
 
 HEADER = '''
@@ -63,9 +74,29 @@ PASSWORD = '''
 # alter this whenever changing the config file format
 CONFIG_VERSION = "1.0"
 
+# defaults for options added to the 230server section since version 1.0
+DEFAULT_PROCESSES = 0
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_DEPTH = 32
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_SESSION_TTL = 900
+DEFAULT_KEEPALIVE_TIMEOUT = 5
+
+# defaults for the postgres connection pools
+DEFAULT_POOL_MIN = 1
+DEFAULT_POOL_MAX = 8
+DEFAULT_POOL_IDLE_TIMEOUT = 300
+
+#: seconds between checks of the modification time of the config file
+RELOAD_CHECK_INTERVAL = 2
+
 class OMServerConfig(ConfigParser.SafeConfigParser):
     def __init__(self):
         ConfigParser.SafeConfigParser.__init__(self)
+        self._reload_callbacks = []
+        self._reload_lock = threading.Lock()
+        self._checked = time.time()
+        self._mtime = self._file_mtime()
         try:
             self.readfp(open(CONF_FILE))
             self.__good_read = True
@@ -82,6 +113,62 @@ class OMServerConfig(ConfigParser.SafeConfigParser):
                 "Unknown error in parsing config file.")
                 raise exc
 
+    def _file_mtime(self):
+        try:
+            return os.stat(CONF_FILE).st_mtime
+        except OSError:
+            return None
+
+    def add_reload_callback(self, callback):
+        '''
+        callback(config) will be called whenever the file is reloaded.
+        '''
+        self._reload_callbacks.append(callback)
+
+    def reload(self):
+        '''
+        re-read the config file.
+        the new settings replace the old in one step, so other threads never
+        see a partially read file.
+        if the file cannot be read, the current settings are kept.
+        '''
+        mtime = self._file_mtime()
+        parser = ConfigParser.SafeConfigParser()
+        try:
+            parser.readfp(open(CONF_FILE))
+        except (IOError, ConfigParser.Error):
+            LOGGER.exception(
+                "unable to reload config file - keeping current settings")
+            return False
+        self._mtime = mtime
+        self._defaults, self._sections = parser._defaults, parser._sections
+        LOGGER.info("reloaded config file %s"% CONF_FILE)
+        for callback in self._reload_callbacks:
+            try:
+                callback(self)
+            except Exception:
+                LOGGER.exception("error applying new configuration")
+        return True
+
+    def reload_if_changed(self):
+        '''
+        reload if the file has been modified.
+        cheap enough to call often, as the file is examined at most once
+        every RELOAD_CHECK_INTERVAL seconds.
+        '''
+        if time.time() - self._checked < RELOAD_CHECK_INTERVAL:
+            return False
+        if not self._reload_lock.acquire(False):
+            return False
+        try:
+            self._checked = time.time()
+            mtime = self._file_mtime()
+            if mtime is None or mtime == self._mtime:
+                return False
+            return self.reload()
+        finally:
+            self._reload_lock.release()
+
     @property
     def is_installed(self):
         '''
@@ -123,6 +210,10 @@ class OMServerConfig(ConfigParser.SafeConfigParser):
         self.set("postgresql", "port", "5432")
         self.set("postgresql", "user", "openmolar")
         self.set("postgresql", "password", new_password())
+        self.set("postgresql", "pool_min", str(DEFAULT_POOL_MIN))
+        self.set("postgresql", "pool_max", str(DEFAULT_POOL_MAX))
+        self.set("postgresql", "pool_idle_timeout",
+            str(DEFAULT_POOL_IDLE_TIMEOUT))
 
         plain, hash = pass_hash(8)
         f = open(PASSWORD_FILE, "w")
@@ -136,6 +227,14 @@ class OMServerConfig(ConfigParser.SafeConfigParser):
         self.add_section("230server")
         self.set("230server", "listen", "")
         self.set("230server", "port", "1430")
+        self.set("230server", "processes", str(DEFAULT_PROCESSES))
+        self.set("230server", "workers", str(DEFAULT_WORKERS))
+        self.set("230server", "queue_depth", str(DEFAULT_QUEUE_DEPTH))
+        self.set("230server", "job_workers", str(DEFAULT_JOB_WORKERS))
+        self.set("230server", "session_ttl", str(DEFAULT_SESSION_TTL))
+        self.set("230server", "keepalive_timeout",
+            str(DEFAULT_KEEPALIVE_TIMEOUT))
+        self.set("230server", "stats", "True")
 
         self.add_section("ssl")
         self.set("ssl", "cert", os.path.join(KEY_DIR, "cert.pem"))
@@ -177,6 +276,33 @@ class OMServerConfig(ConfigParser.SafeConfigParser):
         '''
         return self.get("postgresql", "password")
 
+    @property
+    def pool_min(self):
+        '''
+        the number of idle connections kept open to each database
+        '''
+        if not self.has_option("postgresql", "pool_min"):
+            return DEFAULT_POOL_MIN
+        return max(0, self.getint("postgresql", "pool_min"))
+
+    @property
+    def pool_max(self):
+        '''
+        the maximum number of connections open to each database
+        '''
+        if not self.has_option("postgresql", "pool_max"):
+            return DEFAULT_POOL_MAX
+        return max(1, self.getint("postgresql", "pool_max"))
+
+    @property
+    def pool_idle_timeout(self):
+        '''
+        seconds after which an unused pooled connection is closed
+        '''
+        if not self.has_option("postgresql", "pool_idle_timeout"):
+            return DEFAULT_POOL_IDLE_TIMEOUT
+        return self.getint("postgresql", "pool_idle_timeout")
+
     @property
     def conf_dir(self):
         return SERVER_DIR
@@ -205,6 +331,76 @@ class OMServerConfig(ConfigParser.SafeConfigParser):
     def port(self):
         return self.getint("230server", "port")
 
+    @property
+    def processes(self):
+        '''
+        the number of worker processes sharing the listening socket.
+        0 means the server runs in a single process.
+        '''
+        if not self.has_option("230server", "processes"):
+            return DEFAULT_PROCESSES
+        return max(0, self.getint("230server", "processes"))
+
+    @property
+    def workers(self):
+        '''
+        the number of threads handling requests concurrently.
+        0 means requests are handled one at a time (the old behaviour).
+        '''
+        if not self.has_option("230server", "workers"):
+            return DEFAULT_WORKERS
+        return max(0, self.getint("230server", "workers"))
+
+    @property
+    def queue_depth(self):
+        '''
+        the maximum number of accepted requests allowed to wait for a worker.
+        requests beyond this limit are refused with a 503 error.
+        '''
+        if not self.has_option("230server", "queue_depth"):
+            return DEFAULT_QUEUE_DEPTH
+        return max(1, self.getint("230server", "queue_depth"))
+
+    @property
+    def job_workers(self):
+        '''
+        the number of long running jobs (backups etc.) run at the same time.
+        further jobs wait their turn.
+        '''
+        if not self.has_option("230server", "job_workers"):
+            return DEFAULT_JOB_WORKERS
+        return max(1, self.getint("230server", "job_workers"))
+
+    @property
+    def session_ttl(self):
+        '''
+        seconds for which an unused session token remains valid.
+        0 disables session tokens (clients authenticate every request).
+        '''
+        if not self.has_option("230server", "session_ttl"):
+            return DEFAULT_SESSION_TTL
+        return max(0, self.getint("230server", "session_ttl"))
+
+    @property
+    def keepalive_timeout(self):
+        '''
+        seconds an idle keep-alive connection is held open
+        (and holds a worker thread) before the server closes it.
+        '''
+        if not self.has_option("230server", "keepalive_timeout"):
+            return DEFAULT_KEEPALIVE_TIMEOUT
+        return max(1, self.getint("230server", "keepalive_timeout"))
+
+    @property
+    def serve_stats(self):
+        '''
+        whether call statistics are served (without authentication)
+        at https://host:port/stats and /metrics
+        '''
+        if not self.has_option("230server", "stats"):
+            return True
+        return self.getboolean("230server", "stats")
+
     @property
     def managers(self):
         '''
@@ -232,6 +428,21 @@ class OMServerConfig(ConfigParser.SafeConfigParser):
         self.set("postgresql", "password", existing_pass)
         self.write()
 
+_shared_config = None
+_shared_lock = threading.Lock()
+
+def shared_config():
+    '''
+    the process wide :doc:`OMServerConfig`.
+    the file is parsed once, and thereafter only when it changes
+    (see OMServerConfig.reload_if_changed)
+    '''
+    global _shared_config
+    with _shared_lock:
+        if _shared_config is None:
+            _shared_config = OMServerConfig()
+        return _shared_config
+
 def _test():
     conf = OMServerConfig()
     #conf.new_config()
@@ -240,6 +451,7 @@ def _test():
     conf.update()
     LOGGER.debug("installed = %s"% conf.is_installed)
     LOGGER.debug("managers - %s"% conf.managers)
+    LOGGER.debug("workers %s queue depth %s"% (conf.workers, conf.queue_depth))
     LOGGER.debug("postgres host %s"% conf.postgres_host)
     LOGGER.debug("postgres port %s"% conf.postgres_port)
     LOGGER.debug("postgres user %s"% conf.postgres_user)
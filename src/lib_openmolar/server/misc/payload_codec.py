@@ -0,0 +1,330 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+A compact binary encoding of :doc:`PayLoad` objects.
+
+Clients which send the header
+    X-Openmolar-Payload: binary[, zlib]
+receive their payloads in this format (as an xmlrpclib.Binary)
+rather than as a pickled string.
+
+A frame is laid out as
+    "OMP" + version (1 byte) + flags (1 byte) + body length (4 bytes) + body
+
+flags bit 0 is set if the body is zlib compressed.
+The body is the tuple (method, permission, payload, exception) where
+exception is None or a tuple (exception type name, message).
+
+Values are a one byte tag followed by (big-endian) data.
+
+    N None, T True, F False,
+    i 8 byte signed integer, L long (as a length prefixed decimal string)
+    d 8 byte float, c Decimal (as a length prefixed string)
+    s length prefixed byte string, u length prefixed utf-8 unicode
+    l list, t tuple (item count, then items)
+    D dict (item count, then key, value pairs)
+    z datetime, y date (length prefixed isoformat strings, a datetime
+      with a timezone has its utc offset appended, eg. +01:00)
+
+NOTE - the decoder in lib_openmolar.common.connect.payload_codec must be
+kept in step with this module.
+'''
+
+from datetime import date, datetime, timedelta, tzinfo
+from decimal import Decimal
+import struct
+import zlib
+
+MAGIC = "OMP"
+VERSION = 1
+FLAG_ZLIB = 1
+
+#: the value of the http header sent by clients accepting this format
+HEADER = "X-Openmolar-Payload"
+
+#: bodies smaller than this are not worth compressing
+COMPRESS_THRESHOLD = 1024
+
+_HEAD = struct.Struct(">3sBBI")
+_INT = struct.Struct(">q")
+_LEN = struct.Struct(">I")
+_FLOAT = struct.Struct(">d")
+
+class PayloadCodecError(ValueError):
+    '''
+    raised if data cannot be decoded.
+    '''
+    pass
+
+class FixedOffset(tzinfo):
+    '''
+    the timezone of a decoded datetime which had a utc offset.
+    '''
+    def __init__(self, minutes):
+        self._offset = timedelta(minutes=minutes)
+
+    def __repr__(self):
+        return "FixedOffset(%d)"% (self._offset.days * 1440 +
+            self._offset.seconds // 60)
+
+    def utcoffset(self, dt):
+        return self._offset
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+def _parse_datetime(text):
+    '''
+    the inverse of datetime.isoformat()
+    '''
+    tz = None
+    if len(text) > 19 and text[-6] in "+-":
+        minutes = int(text[-5:-3]) * 60 + int(text[-2:])
+        tz = FixedOffset(-minutes if text[-6] == "-" else minutes)
+        text = text[:-6]
+    format_ = "%Y-%m-%dT%H:%M:%S"
+    if "." in text:
+        format_ += ".%f"
+    return datetime.strptime(text, format_).replace(tzinfo=tz)
+
+def _encode(value, parts):
+    if value is None:
+        parts.append("N")
+    elif value is True:
+        parts.append("T")
+    elif value is False:
+        parts.append("F")
+    elif isinstance(value, (int, long)):
+        if -2**63 <= value < 2**63:
+            parts.append("i" + _INT.pack(value))
+        else:
+            data = str(value)
+            parts.append("L" + _LEN.pack(len(data)) + data)
+    elif isinstance(value, float):
+        parts.append("d" + _FLOAT.pack(value))
+    elif isinstance(value, Decimal):
+        data = str(value)
+        parts.append("c" + _LEN.pack(len(data)) + data)
+    elif isinstance(value, str):
+        parts.append("s" + _LEN.pack(len(value)))
+        parts.append(value)
+    elif isinstance(value, unicode):
+        data = value.encode("utf-8")
+        parts.append("u" + _LEN.pack(len(data)))
+        parts.append(data)
+    elif isinstance(value, (list, tuple)):
+        tag = "l" if isinstance(value, list) else "t"
+        parts.append(tag + _LEN.pack(len(value)))
+        for item in value:
+            _encode(item, parts)
+    elif isinstance(value, dict):
+        parts.append("D" + _LEN.pack(len(value)))
+        for key, item in value.iteritems():
+            _encode(key, parts)
+            _encode(item, parts)
+    elif isinstance(value, datetime):
+        data = value.isoformat()
+        parts.append("z" + _LEN.pack(len(data)) + data)
+    elif isinstance(value, date):
+        data = value.isoformat()
+        parts.append("y" + _LEN.pack(len(data)) + data)
+    else:
+        raise TypeError("cannot encode objects of type %s"% type(value))
+
+def _decode(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == "N":
+        return None, pos
+    if tag == "T":
+        return True, pos
+    if tag == "F":
+        return False, pos
+    if tag == "i":
+        return _INT.unpack_from(data, pos)[0], pos + _INT.size
+    if tag == "d":
+        return _FLOAT.unpack_from(data, pos)[0], pos + _FLOAT.size
+    if tag in "lt":
+        count = _LEN.unpack_from(data, pos)[0]
+        pos += _LEN.size
+        items = []
+        for i in xrange(count):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return (items if tag == "l" else tuple(items)), pos
+    if tag == "D":
+        count = _LEN.unpack_from(data, pos)[0]
+        pos += _LEN.size
+        result = {}
+        for i in xrange(count):
+            key, pos = _decode(data, pos)
+            result[key], pos = _decode(data, pos)
+        return result, pos
+
+    # the remaining types are all length prefixed strings
+    length = _LEN.unpack_from(data, pos)[0]
+    pos += _LEN.size
+    chunk = data[pos:pos + length]
+    if len(chunk) != length:
+        raise PayloadCodecError("truncated payload")
+    pos += length
+    if tag == "s":
+        return chunk, pos
+    if tag == "u":
+        return chunk.decode("utf-8"), pos
+    if tag == "L":
+        return long(chunk), pos
+    if tag == "c":
+        return Decimal(chunk), pos
+    if tag == "z":
+        return _parse_datetime(chunk), pos
+    if tag == "y":
+        return datetime.strptime(chunk, "%Y-%m-%d").date(), pos
+    raise PayloadCodecError("unknown tag %r"% tag)
+
+def accepts(header_value):
+    '''
+    parse the value of the X-Openmolar-Payload header sent by a client.
+    returns a tuple of booleans (binary, zlib)
+    '''
+    if not header_value:
+        return False, False
+    options = [opt.strip().lower() for opt in header_value.split(",")]
+    return "binary" in options, "zlib" in options
+
+def dumps(payload, compress=False):
+    '''
+    encode a :doc:`PayLoad` object.
+    raises TypeError if the payload contains an unsupported type.
+    '''
+    exc = payload.exception
+    if exc is not None:
+        exc = (type(exc).__name__, payload.exception_message)
+    parts = []
+    _encode((payload.method, payload.permission, payload.payload, exc), parts)
+    body = "".join(parts)
+    flags = 0
+    if compress and len(body) > COMPRESS_THRESHOLD:
+        body = zlib.compress(body, 6)
+        flags |= FLAG_ZLIB
+    return _HEAD.pack(MAGIC, VERSION, flags, len(body)) + body
+
+def loads(data):
+    '''
+    decode data produced by dumps.
+    returns a tuple (method, permission, payload, exception)
+    '''
+    try:
+        magic, version, flags, length = _HEAD.unpack_from(data, 0)
+    except struct.error:
+        raise PayloadCodecError("payload too short")
+    if magic != MAGIC or version != VERSION:
+        raise PayloadCodecError("unrecognised payload header")
+    body = data[_HEAD.size:]
+    if len(body) != length:
+        raise PayloadCodecError("truncated payload")
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    try:
+        value, pos = _decode(body, 0)
+    except (IndexError, ValueError, struct.error):
+        raise PayloadCodecError("malformed payload")
+    return value
+
+def _benchmark(repeats=20):
+    '''
+    compare the size on the wire and the cpu cost of the pickled
+    transport with the binary one.
+    '''
+    import pickle
+    import time
+    import xmlrpclib
+
+    from lib_openmolar.server.misc.payload import PayLoad
+
+    row = u'''
+        <tr class="even"><td><b>openmolar_demo</b></td>
+        <td class="list"><table class="sessions"><tr><td>om_demo</td>
+        <td>192.168.0.%d</td><td>openmolar-client</td></tr></table></td>
+        <td>1.3</td></tr>'''
+    log_line = ("2012-10-02 10:18:%02d,003 DEBUG _dispatch called for "
+        "method admin_welcome by user 'admin'\n")
+
+    samples = (
+        ("admin_welcome", u"<html>%s</html>"% "".join(
+            [row% i for i in range(200)])),
+        ("message_link", "<html><body><pre>%s</pre></body></html>"% "".join(
+            [log_line% (i % 60) for i in range(20000)])),
+        ("login_roles", ["om_user_%d"% i for i in range(500)]),
+        )
+
+    def xml_size(value):
+        return len(xmlrpclib.dumps((value,), methodresponse=True))
+
+    for method, value in samples:
+        pl = PayLoad(method)
+        pl.permission = True
+        pl.set_payload(value)
+
+        start = time.time()
+        for i in range(repeats):
+            wire = xmlrpclib.dumps((pickle.dumps(pl),), methodresponse=True)
+            pickle.loads(xmlrpclib.loads(wire)[0][0])
+        pickle_time = (time.time() - start) / repeats
+        pickle_size = xml_size(pickle.dumps(pl))
+
+        start = time.time()
+        for i in range(repeats):
+            wire = xmlrpclib.dumps((xmlrpclib.Binary(dumps(pl, True)),),
+                methodresponse=True)
+            loads(xmlrpclib.loads(wire)[0][0].data)
+        binary_time = (time.time() - start) / repeats
+        binary_size = xml_size(xmlrpclib.Binary(dumps(pl, True)))
+
+        LOGGER.info("%-14s pickle %9d bytes %7.2fms | "
+            "binary+zlib %9d bytes %7.2fms"% (method,
+            pickle_size, pickle_time * 1000,
+            binary_size, binary_time * 1000))
+
+def _test():
+    from lib_openmolar.server.misc.payload import PayLoad
+    value = [None, True, False, 1, -2**70, 1.5, Decimal("2.50"), "abc",
+        u"\xe9", (1, 2), {"admin": True}, datetime.now(), date.today(),
+        datetime(2012, 10, 2, 10, 18, tzinfo=FixedOffset(60))]
+    pl = PayLoad("test")
+    pl.permission = True
+    pl.set_payload(value)
+    decoded = loads(dumps(pl, True))
+    LOGGER.debug(decoded)
+    assert decoded[2] == value, "round trip failed"
+    _benchmark()
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
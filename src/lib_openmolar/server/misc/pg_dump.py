@@ -0,0 +1,417 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+provides PgDump, which runs pg_dump and streams the output to disk
+in fixed size chunks, so that the size of a backup is not limited by the
+memory of the server.
+'''
+
+from datetime import datetime
+from distutils.spawn import find_executable
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from lib_openmolar.server.misc.backup_config import (
+    FORMATS, COMPRESSIONS, IONICE_CLASSES, DEFAULT_BACKUP_DIR)
+from lib_openmolar.server.misc.job_manager import (
+    report_progress, check_cancelled, register_process)
+
+#: pg_dump's -F option for each format
+FORMAT_FLAGS = {"plain" : "p", "custom" : "c", "directory" : "d"}
+
+#: the file (in each database's backup directory) describing the last backup
+RECORD_FILE = "last_backup.json"
+
+def priority_prefix(backup_config):
+    '''
+    nice and ionice (if installed) so that a command runs at the priority
+    given in the backup config.
+    '''
+    prefix = []
+    nice = backup_config.nice
+    if nice and find_executable("nice"):
+        prefix += ["nice", "-n", str(nice)]
+    ionice = IONICE_CLASSES[backup_config.ionice]
+    if ionice and find_executable("ionice"):
+        prefix += ["ionice"] + ionice
+    return prefix
+
+def connection_args(config):
+    '''
+    the arguments telling a postgres client (pg_dump, psql etc.) how to
+    connect. the password is passed in the environment.
+    '''
+    return ["-h", config.postgres_host, "-p", str(config.postgres_port),
+        "-U", config.postgres_user, "-w"]
+
+def client_env(config):
+    '''
+    the environment for a postgres client.
+    the password is passed in the environment, as pg_dump will not read
+    it from stdin.
+    '''
+    env = os.environ.copy()
+    env["PGPASSWORD"] = config.postgres_pass
+    return env
+
+def read_record(backup_root, dbname, filename=RECORD_FILE):
+    '''
+    the record of the last successful backup of dbname (a dictionary, see
+    PgDump.dump) or None.
+    '''
+    try:
+        f = open(os.path.join(backup_root, dbname, filename))
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return None
+
+
+class _HashingFile(object):
+    '''
+    a file wrapper which keeps a checksum and a count of the bytes written.
+    '''
+    def __init__(self, f):
+        self._file = f
+        self.hash = hashlib.sha256()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self.hash.update(data)
+        self.bytes_written += len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class PgDump(object):
+    '''
+    runs pg_dump for a database, using the connection details in
+    :doc:`OMServerConfig` and the options in :doc:`BackupConfig`.
+    '''
+    def __init__(self, config, backup_config):
+        self.config = config
+        self.backup_config = backup_config
+
+    @property
+    def backup_root(self):
+        try:
+            return self.backup_config.backup_dir
+        except IOError:
+            return DEFAULT_BACKUP_DIR
+
+    def _env(self):
+        return client_env(self.config)
+
+    def command(self, dbname, format_="plain", schema_only=False,
+    target=None, jobs=1, snapshot=None):
+        '''
+        the pg_dump command line.
+        if snapshot (as returned by pg_export_snapshot) is given, the dump
+        shows the database as seen by the transaction which exported it.
+        '''
+        command = (priority_prefix(self.backup_config) + ["pg_dump"] +
+            connection_args(self.config) + ["-F", FORMAT_FLAGS[format_]])
+        if schema_only:
+            command.append("-s")
+        if snapshot is not None:
+            command.append("--snapshot=%s"% snapshot)
+        if target is not None:
+            command += ["-f", target]
+        if format_ == "directory" and jobs > 1:
+            command += ["-j", str(jobs)]
+        command.append(dbname)
+        return command
+
+    def target_path(self, dbname, format_, compression, schema_only=False):
+        backup_dir = os.path.join(self.backup_root, dbname)
+        if not os.path.isdir(backup_dir):
+            os.makedirs(backup_dir)
+
+        filename = "schema" if schema_only else "backup"
+        filename += datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename += FORMATS[format_]
+        if format_ == "plain":
+            filename += COMPRESSIONS[compression]
+        return os.path.join(backup_dir, filename)
+
+    def _progress(self, done, size_hint):
+        if size_hint:
+            report_progress(min(99, 100 * done / size_hint))
+
+    def _stream(self, command, path, compression, size_hint):
+        '''
+        pipe the output of pg_dump into the file at path, chunk by chunk.
+        returns (size of the file, checksum of the file)
+        '''
+        chunk_size = self.backup_config.chunk_size
+        stderr = tempfile.TemporaryFile()
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE,
+            stderr=stderr, env=self._env())
+        register_process(proc)
+
+        source, zproc = proc.stdout, None
+        if compression == "zstd":
+            zproc = subprocess.Popen(["zstd", "-q", "-c"],
+                stdin=proc.stdout, stdout=subprocess.PIPE)
+            proc.stdout.close()
+            source = zproc.stdout
+
+        out = _HashingFile(open(path, "wb"))
+        if compression == "gzip":
+            writer = gzip.GzipFile(os.path.basename(path), "wb", 6, out)
+        else:
+            writer = out
+
+        rate_limit = self.backup_config.rate_limit
+        bytes_read, completed, started = 0, False, time.time()
+        try:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    completed = True
+                    break
+                writer.write(chunk)
+                bytes_read += len(chunk)
+                if rate_limit:
+                    # reading slowly throttles pg_dump (and the postgres
+                    # backend serving it) through the pipe.
+                    delay = (started + bytes_read / float(rate_limit)
+                        - time.time())
+                    if delay > 0:
+                        time.sleep(delay)
+                if zproc is None:
+                    self._progress(bytes_read, size_hint)
+                check_cancelled()
+        finally:
+            if writer is not out:
+                writer.close()
+            out.close()
+            for process in (zproc, proc):
+                if process is None:
+                    continue
+                if not completed and process.poll() is None:
+                    process.terminate()
+                process.wait()
+
+        stderr.seek(0)
+        errors = stderr.read()
+        if errors:
+            LOGGER.warning("pg_dump wrote to stderr %s"% errors)
+        if proc.returncode != 0 or (zproc and zproc.returncode != 0):
+            raise IOError("pg_dump failed (exit code %s) %s"% (
+                proc.returncode, errors))
+        return out.bytes_written, out.hash.hexdigest()
+
+    def _dump_directory(self, command, path, size_hint):
+        '''
+        let pg_dump write a directory format dump (possibly in parallel),
+        polling the size of the directory for progress.
+        returns (bytes written, checksum of all files)
+        '''
+        stderr = tempfile.TemporaryFile()
+        proc = subprocess.Popen(command, stderr=stderr, env=self._env())
+        register_process(proc)
+        try:
+            while proc.poll() is None:
+                time.sleep(1)
+                self._progress(_directory_size(path), size_hint)
+                check_cancelled()
+        finally:
+            if proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+
+        stderr.seek(0)
+        errors = stderr.read()
+        if proc.returncode != 0:
+            raise IOError("pg_dump failed (exit code %s) %s"% (
+                proc.returncode, errors))
+
+        # write a manifest of checksums of the individual files
+        overall = hashlib.sha256()
+        manifest = open(os.path.join(path, "SHA256SUMS"), "w")
+        for filename in sorted(os.listdir(path)):
+            if filename == "SHA256SUMS":
+                continue
+            checksum = _file_checksum(os.path.join(path, filename))
+            manifest.write("%s  %s\n"% (checksum, filename))
+            overall.update(checksum)
+        manifest.close()
+        return _directory_size(path), overall.hexdigest()
+
+    def dump(self, dbname, schema_only=False, size_hint=None, snapshot=None,
+    row_counts=None):
+        '''
+        dump the database to the backup directory.
+        size_hint (the size of the database in bytes) is used to estimate
+        progress.
+        snapshot is passed to pg_dump (see command), and row_counts
+        (the rows in each table in that snapshot) kept with the record of
+        the backup so that restores can be checked.
+        returns a dictionary describing the backup.
+        '''
+        format_ = self.backup_config.format
+        compression = self.backup_config.compression
+        path = self.target_path(dbname, format_, compression, schema_only)
+        partial = path + ".partial"
+        LOGGER.info("backing up %s to %s"% (dbname, path))
+        report_progress(0, "backing up %s to %s"% (dbname, path))
+
+        start = time.time()
+        try:
+            if format_ == "directory":
+                command = self.command(dbname, format_, schema_only, partial,
+                    self.backup_config.jobs, snapshot)
+                size, checksum = self._dump_directory(command, partial,
+                    size_hint)
+            else:
+                command = self.command(dbname, format_, schema_only,
+                    snapshot=snapshot)
+                if format_ != "plain":
+                    compression = "none"
+                size, checksum = self._stream(command, partial, compression,
+                    size_hint)
+        except:
+            LOGGER.exception("backup of %s failed - removing %s"% (
+                dbname, partial))
+            if os.path.isdir(partial):
+                shutil.rmtree(partial, True)
+            elif os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+        os.rename(partial, path)
+        f = open(path + ".sha256", "w")
+        f.write("%s  %s\n"% (checksum, os.path.basename(path)))
+        f.close()
+
+        result = {
+            "path" : path,
+            "format" : format_,
+            "compression" : compression,
+            "bytes" : size,
+            "sha256" : checksum,
+            "seconds" : round(time.time() - start, 1),
+            }
+        LOGGER.info("backup complete %s"% result)
+        if row_counts is not None:
+            result["row_counts"] = row_counts
+        report_progress(100, "backup saved as %s (%d bytes, sha256 %s)"% (
+            path, size, checksum))
+        if not schema_only:
+            self._write_record(dbname, result)
+            self.prune(dbname)
+        return result
+
+    def _write_record(self, dbname, result):
+        record = dict(result)
+        record["finished"] = datetime.now().isoformat()
+        path = os.path.join(self.backup_root, dbname, RECORD_FILE)
+        f = open(path + ".tmp", "w")
+        json.dump(record, f)
+        f.close()
+        os.rename(path + ".tmp", path)
+
+    def prune(self, dbname):
+        '''
+        remove backups of dbname (and their checksums) beyond the number, or
+        older than the age, given in the backup config.
+        the most recent backup is always kept.
+        returns a list of the backups removed.
+        '''
+        keep = self.backup_config.keep
+        max_age = self.backup_config.max_age_days * 86400
+        backup_dir = os.path.join(self.backup_root, dbname)
+
+        # names are "backup" + a timestamp, so sort in date order
+        backups = sorted([filename for filename in os.listdir(backup_dir)
+            if filename.startswith("backup") and not
+            filename.endswith((".sha256", ".partial"))], reverse=True)
+
+        removed = []
+        now = time.time()
+        for i, filename in enumerate(backups):
+            path = os.path.join(backup_dir, filename)
+            if i == 0:
+                continue
+            if not ((keep and i >= keep) or
+            (max_age and now - os.path.getmtime(path) > max_age)):
+                continue
+            LOGGER.info("removing old backup %s"% path)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                if os.path.exists(path + ".sha256"):
+                    os.remove(path + ".sha256")
+                removed.append(path)
+            except OSError:
+                LOGGER.exception("unable to remove %s"% path)
+        return removed
+
+def _file_checksum(path, chunk_size=1024*1024):
+    checksum = hashlib.sha256()
+    f = open(path, "rb")
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        checksum.update(chunk)
+    f.close()
+    return checksum.hexdigest()
+
+def _directory_size(path):
+    size = 0
+    try:
+        for filename in os.listdir(path):
+            size += os.path.getsize(os.path.join(path, filename))
+    except OSError:
+        pass
+    return size
+
+def _test():
+    from lib_openmolar.server.misc.om_server_config import OMServerConfig
+    from lib_openmolar.server.misc.backup_config import BackupConfig
+    pg_dump = PgDump(OMServerConfig(), BackupConfig())
+    LOGGER.debug(pg_dump.command("openmolar_demo"))
+    LOGGER.debug(pg_dump.dump("openmolar_demo", schema_only=True))
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
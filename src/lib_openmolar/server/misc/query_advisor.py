@@ -0,0 +1,328 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+query performance information for the admin welcome page.
+
+the slowest statements are read from the pg_stat_statements extension
+(if it is installed in any database of the cluster), large tables which are
+read by sequential scans are found in pg_stat_user_tables, and indexes are
+suggested for the columns those statements filter or join on.
+'''
+
+import os
+import re
+
+import lib_openmolar
+
+#: the number of statements (by total and by mean time) shown per database
+TOP_N = 10
+
+#: tables with fewer rows than this are not worth indexing
+MIN_ROWS = 10000
+
+#: pg_stat_statements renamed its timing columns in postgres 13
+EXEC_TIME_VERSION = 130000
+
+#: pg_stat_activity has a query_id column from postgres 14
+QUERY_ID_VERSION = 140000
+
+HAS_STATEMENTS_QUERY = '''
+select exists(select 1 from pg_catalog.pg_extension
+    where extname = 'pg_stat_statements')
+'''
+
+STATEMENTS_QUERY = '''
+SELECT datname, queryid, query, calls, total, mean, rows FROM (
+    SELECT d.datname, s.queryid::text AS queryid, s.query, s.calls,
+        s.%(total)s AS total, s.%(mean)s AS mean, s.rows,
+        rank() OVER (PARTITION BY d.datname ORDER BY s.%(total)s DESC)
+            AS total_rank,
+        rank() OVER (PARTITION BY d.datname ORDER BY s.%(mean)s DESC)
+            AS mean_rank
+    FROM pg_stat_statements s
+    JOIN pg_catalog.pg_database d ON d.oid = s.dbid
+    WHERE d.datname = ANY(%%(databases)s)
+) ranked
+WHERE total_rank <= %%(limit)s OR mean_rank <= %%(limit)s
+ORDER BY datname, total DESC
+'''
+
+#: the applications which last ran each statement (postgres 14 and later)
+APPLICATIONS_QUERY = '''
+SELECT query_id::text, application_name FROM pg_catalog.pg_stat_activity
+WHERE query_id IS NOT NULL AND application_name != ''
+'''
+
+#: run in each database - sequential scans, and the columns of large tables,
+#: the leading column of each index, and foreign keys.
+TABLES_QUERY = '''
+select
+array(select array[relname::text, seq_scan::text, seq_tup_read::text,
+        coalesce(idx_scan, 0)::text, n_live_tup::text]
+    from pg_catalog.pg_stat_user_tables
+    where schemaname = 'public' and n_live_tup >= %(min_rows)s),
+array(select array[c.relname::text, a.attname::text]
+    from pg_catalog.pg_attribute a
+    join pg_catalog.pg_class c on c.oid = a.attrelid
+    join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+    where n.nspname = 'public' and c.relkind = 'r'
+    and a.attnum > 0 and not a.attisdropped
+    and c.reltuples >= %(min_rows)s),
+array(select array[c.relname::text, a.attname::text]
+    from pg_catalog.pg_index x
+    join pg_catalog.pg_class c on c.oid = x.indrelid
+    join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+    join pg_catalog.pg_attribute a on a.attrelid = c.oid
+        and a.attnum = x.indkey[0]
+    where n.nspname = 'public'),
+array(select array[c.relname::text, a.attname::text]
+    from pg_catalog.pg_constraint f
+    join pg_catalog.pg_class c on c.oid = f.conrelid
+    join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+    join pg_catalog.pg_attribute a on a.attrelid = c.oid
+        and a.attnum = f.conkey[1]
+    where n.nspname = 'public' and f.contype = 'f')
+'''
+
+# tables named in a statement
+_TABLE_RE = re.compile(r"\b(?:from|join|update|into)\s+(?:public\.)?\"?(\w+)",
+    re.IGNORECASE)
+
+# columns compared with a value or another column,
+# eg. "patient_id = $1", "t.date > $2", "a.id = b.patient_id", "x in ($1)"
+_PREDICATE_RE = re.compile(
+    r"(?:\b(\w+)\.)?\b(\w+)\s*(?:=|<=|>=|<|>|\bin\b|\blike\b|\bilike\b)",
+    re.IGNORECASE)
+
+_CLIENT_MODULES = None
+
+def client_modules():
+    '''
+    a dictionary {table name: client module} found from the TABLENAME
+    constants of the client's db_orm package (if installed).
+    '''
+    global _CLIENT_MODULES
+    if _CLIENT_MODULES is not None:
+        return _CLIENT_MODULES
+    _CLIENT_MODULES = {}
+    root = os.path.dirname(lib_openmolar.__file__)
+    orm_dir = os.path.join(root, "client", "db_orm")
+    tablename = re.compile(r"^TABLENAME\s*=\s*[\"'](\w+)[\"']", re.MULTILINE)
+    for dirpath, dirnames, filenames in os.walk(orm_dir):
+        for filename in filenames:
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                source = open(path).read()
+            except IOError:
+                continue
+            for table in tablename.findall(source):
+                _CLIENT_MODULES.setdefault(table,
+                    os.path.relpath(path, os.path.dirname(root)))
+    return _CLIENT_MODULES
+
+def tables_in(query):
+    '''
+    the (lower case) names of the tables a statement reads or writes
+    '''
+    return sorted(set([table.lower() for table in _TABLE_RE.findall(query)]))
+
+def code_paths(query, applications=()):
+    '''
+    where a statement probably comes from - the applications which ran it
+    (if known) and the client modules for the tables it uses.
+    '''
+    paths = sorted(set(applications))
+    modules = client_modules()
+    for table in tables_in(query):
+        if table in modules:
+            paths.append(modules[table])
+    return paths
+
+def predicate_columns(query, columns):
+    '''
+    the (table, column) pairs a statement filters or joins on.
+    columns is a dictionary {table: set of column names}, only columns of
+    tables named in the statement are returned.
+    '''
+    tables = [table for table in tables_in(query) if table in columns]
+    found = set()
+    for qualifier, column in _PREDICATE_RE.findall(query):
+        column = column.lower()
+        for table in tables:
+            if column in columns[table]:
+                found.add((table, column))
+    return found
+
+class QueryAdvisor(object):
+    '''
+    gathers the query report. connect is a callable returning a context
+    manager which lends a connection to a database (see FunctionStore)
+    '''
+    def __init__(self, connect):
+        self.connect = connect
+
+    def _find_statements_db(self, databases):
+        '''
+        the database in which pg_stat_statements is installed (or None)
+        '''
+        for dbname in ["openmolar_master"] + list(databases):
+            try:
+                with self.connect(dbname) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(HAS_STATEMENTS_QUERY)
+                    if cursor.fetchone()[0]:
+                        return dbname
+            except Exception:
+                LOGGER.debug("unable to check %s for pg_stat_statements"%
+                    dbname)
+        return None
+
+    def statements(self, databases, limit=TOP_N):
+        '''
+        the top statements (by total and by mean time) of each database.
+        returns None if pg_stat_statements is not installed.
+        '''
+        statements_db = self._find_statements_db(databases)
+        if statements_db is None:
+            return None
+        with self.connect(statements_db) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "select current_setting('server_version_num')::int")
+            version = cursor.fetchone()[0]
+            if version >= EXEC_TIME_VERSION:
+                columns = {"total": "total_exec_time",
+                    "mean": "mean_exec_time"}
+            else:
+                columns = {"total": "total_time", "mean": "mean_time"}
+            cursor.execute(STATEMENTS_QUERY% columns,
+                {"databases": list(databases), "limit": limit})
+            rows = cursor.fetchall()
+
+            applications = {}
+            if version >= QUERY_ID_VERSION:
+                cursor.execute(APPLICATIONS_QUERY)
+                for queryid, application in cursor.fetchall():
+                    applications.setdefault(queryid, set()).add(application)
+
+        statements = []
+        for dbname, queryid, query, calls, total, mean, n_rows in rows:
+            statements.append({
+                "database" : dbname,
+                "query" : query,
+                "calls" : calls,
+                "total_ms" : round(total, 1),
+                "mean_ms" : round(mean, 2),
+                "rows" : n_rows,
+                "code_paths" : code_paths(query,
+                    applications.get(queryid, ())),
+                })
+        return statements
+
+    def table_advice(self, dbname, statements=(), min_rows=MIN_ROWS):
+        '''
+        large tables of dbname read by sequential scans, and suggested
+        indexes - for the columns the statements filter or join on, and for
+        foreign keys, which have no index starting with that column.
+        '''
+        with self.connect(dbname) as conn:
+            cursor = conn.cursor()
+            cursor.execute(TABLES_QUERY, {"min_rows": min_rows})
+            scans, columns, indexed, foreign_keys = cursor.fetchone()
+
+        seq_scans = []
+        for table, seq_scan, seq_read, idx_scan, live in scans or []:
+            seq_scan, seq_read, idx_scan = (int(seq_scan), int(seq_read),
+                int(idx_scan))
+            # a table which is mostly read in full, rather than via an index
+            if seq_scan and seq_read / seq_scan >= min_rows and (
+            seq_scan > idx_scan):
+                seq_scans.append({
+                    "table" : table,
+                    "seq_scans" : seq_scan,
+                    "rows_per_scan" : seq_read / seq_scan,
+                    "index_scans" : idx_scan,
+                    "live_rows" : int(live),
+                    })
+
+        table_columns = {}
+        for table, column in columns or []:
+            table_columns.setdefault(table, set()).add(column)
+        indexed = set([tuple(pair) for pair in indexed or []])
+        scanned = set([scan["table"] for scan in seq_scans])
+
+        suggestions = {}
+        for statement in statements:
+            for table, column in predicate_columns(statement["query"],
+            table_columns):
+                if table in scanned and (table, column) not in indexed:
+                    suggestions[(table, column)] = "filtered or joined on"
+        for table, column in foreign_keys or []:
+            if table in table_columns and (table, column) not in indexed:
+                suggestions.setdefault((table, column), "foreign key")
+
+        return {
+            "seq_scans" : seq_scans,
+            "suggestions" : [{
+                "table" : table,
+                "column" : column,
+                "reason" : reason,
+                "sql" : "CREATE INDEX CONCURRENTLY ON %s (%s)"% (
+                    table, column),
+                } for (table, column), reason in sorted(suggestions.items())],
+            }
+
+    def report(self, databases, limit=TOP_N):
+        '''
+        returns a dictionary
+            {"statements": list or None, "tables": {dbname: table_advice}}
+        '''
+        statements = self.statements(databases, limit)
+        tables = {}
+        for dbname in databases:
+            db_statements = [statement for statement in statements or []
+                if statement["database"] == dbname]
+            try:
+                tables[dbname] = self.table_advice(dbname, db_statements)
+            except Exception:
+                LOGGER.exception("unable to get table statistics for %s"%
+                    dbname)
+        return {"statements" : statements, "tables" : tables}
+
+def _test():
+    LOGGER.debug(client_modules())
+    query = ("SELECT * FROM notes_clinical n JOIN patients p "
+        "ON n.patient_id = p.ix WHERE n.date > $1")
+    LOGGER.debug(code_paths(query, ["openmolar-client"]))
+    LOGGER.debug(predicate_columns(query, {
+        "notes_clinical": set(["patient_id", "date", "line"]),
+        "patients": set(["ix"])}))
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
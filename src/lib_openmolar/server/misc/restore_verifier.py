@@ -0,0 +1,312 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+provides RestoreVerifier, which proves that backups can be restored.
+
+each backup is restored (in the background, at low priority) into a scratch
+database, the rows in each table are counted and compared with the counts
+taken (in the same snapshot as the dump) when the backup was made, and the
+scratch database is dropped.
+the time taken by the restore is recorded, as it is a realistic measure of
+how long recovery from the backup would take.
+'''
+
+from datetime import datetime
+import gzip
+import json
+import os
+import Queue
+import re
+import subprocess
+import tempfile
+import threading
+import time
+
+from lib_openmolar.server.misc.backup_config import BackupConfig
+from lib_openmolar.server.misc.pg_dump import (PgDump, priority_prefix,
+    connection_args, client_env, read_record)
+
+#: scratch databases are named VERIFY_PREFIX + process id + database name
+VERIFY_PREFIX = "openmolar_verify_"
+
+#: the file (in each database's backup directory) describing the last check
+VERIFY_FILE = "last_verify.json"
+
+VERIFIED = "verified"
+MISMATCH = "mismatch"
+FAILED = "failed"
+
+#: the user tables of a database
+TABLES_QUERY = '''
+SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'r'
+AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+AND n.nspname NOT LIKE 'pg_toast%'
+ORDER BY 1
+'''
+
+def row_counts(cursor):
+    '''
+    a dictionary of the number of rows in each user table of the database
+    the cursor is connected to (counted in a single query).
+    '''
+    cursor.execute(TABLES_QUERY)
+    tables = [row[0] for row in cursor.fetchall()]
+    if not tables:
+        return {}
+    cursor.execute(" UNION ALL ".join(
+        ["SELECT %%s, count(*) FROM %s"% table.replace("%", "%%")
+        for table in tables]),
+        tables)
+    return dict(cursor.fetchall())
+
+def compare_counts(expected, found):
+    '''
+    returns a dictionary {table: [expected rows, rows found]} of the tables
+    whose counts differ (None for a missing table).
+    '''
+    mismatches = {}
+    for table in set(expected) | set(found):
+        if expected.get(table) != found.get(table):
+            mismatches[table] = [expected.get(table), found.get(table)]
+    return mismatches
+
+def _pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+class RestoreVerifier(object):
+    '''
+    verifies backups made by a :doc:`FunctionStore`, on a bounded number of
+    background threads (see :doc:`BackupConfig` verify_workers)
+    '''
+    def __init__(self, function_store):
+        self.function_store = function_store
+        self._queue = None
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def submit(self, dbname, backup):
+        '''
+        queue the backup of dbname (a dictionary returned by PgDump.dump)
+        to be verified.
+        '''
+        with self._lock:
+            if self._queue is None:
+                # started on demand, as the server forks after the
+                # FunctionStore may have been created.
+                self._queue = Queue.Queue()
+                self._drop_abandoned()
+                for i in range(BackupConfig().verify_workers):
+                    thread = threading.Thread(target=self._work,
+                        name="restore_verifier_%d"% i)
+                    thread.daemon = True
+                    thread.start()
+        LOGGER.info("queued verification of %s"% backup["path"])
+        self._queue.put((dbname, backup))
+
+    def _work(self):
+        while True:
+            dbname, backup = self._queue.get()
+            try:
+                self.verify(dbname, backup)
+            except Exception:
+                LOGGER.exception("unable to verify %s"% backup["path"])
+
+    def _scratch_name(self, dbname):
+        with self._lock:
+            self._counter += 1
+            counter = self._counter
+        name = "%s%d_%d_%s"% (VERIFY_PREFIX, os.getpid(), counter,
+            re.sub(r"\W", "_", dbname))
+        return name[:63]
+
+    def _execute_master(self, statement):
+        with self.function_store._connection(autocommit=True) as conn:
+            conn.cursor().execute(statement)
+
+    def _drop(self, scratch):
+        self.function_store._pools.discard(scratch)
+        self._execute_master('DROP DATABASE IF EXISTS "%s"'% scratch)
+
+    def _drop_abandoned(self):
+        '''
+        drop scratch databases left by processes which have died.
+        '''
+        try:
+            with self.function_store._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT datname FROM pg_database WHERE datname LIKE %s",
+                    (VERIFY_PREFIX.replace("_", r"\_") + "%",))
+                names = [row[0] for row in cursor.fetchall()]
+            for name in names:
+                pid = name[len(VERIFY_PREFIX):].split("_")[0]
+                if pid.isdigit() and not _pid_running(int(pid)):
+                    LOGGER.warning("dropping abandoned database %s"% name)
+                    self._drop(name)
+        except Exception:
+            LOGGER.exception("unable to drop abandoned scratch databases")
+
+    def _restore_command(self, scratch, backup, backup_config):
+        args = connection_args(self.function_store.config) + ["-d", scratch]
+        if backup["format"] == "plain":
+            return (priority_prefix(backup_config) +
+                ["psql", "-X", "-q", "-v", "ON_ERROR_STOP=1"] + args)
+        command = (priority_prefix(backup_config) +
+            ["pg_restore", "--exit-on-error"] + args)
+        if backup_config.jobs > 1:
+            command += ["-j", str(backup_config.jobs)]
+        return command + [backup["path"]]
+
+    def restore(self, scratch, backup, backup_config):
+        '''
+        restore the backup into database scratch (which must exist).
+        '''
+        command = self._restore_command(scratch, backup, backup_config)
+        stderr = tempfile.TemporaryFile()
+        env = client_env(self.function_store.config)
+        stdout = open(os.devnull, "w")
+        path = backup["path"]
+        if backup["format"] != "plain":
+            proc = subprocess.Popen(command, stdout=stdout, stderr=stderr,
+                env=env)
+        elif backup["compression"] == "gzip":
+            proc = subprocess.Popen(command, stdin=subprocess.PIPE,
+                stdout=stdout, stderr=stderr, env=env)
+            source = gzip.open(path, "rb")
+            try:
+                while True:
+                    chunk = source.read(backup_config.chunk_size)
+                    if not chunk:
+                        break
+                    proc.stdin.write(chunk)
+            except IOError:
+                # psql has exited, its return code explains why
+                pass
+            finally:
+                source.close()
+                proc.stdin.close()
+        elif backup["compression"] == "zstd":
+            zproc = subprocess.Popen(["zstd", "-q", "-d", "-c", path],
+                stdout=subprocess.PIPE)
+            proc = subprocess.Popen(command, stdin=zproc.stdout,
+                stdout=stdout, stderr=stderr, env=env)
+            zproc.stdout.close()
+            zproc.wait()
+        else:
+            proc = subprocess.Popen(command, stdin=open(path, "rb"),
+                stdout=stdout, stderr=stderr, env=env)
+        proc.wait()
+        stdout.close()
+        if proc.returncode != 0:
+            stderr.seek(0)
+            raise IOError("restore failed (exit code %s) %s"% (
+                proc.returncode, stderr.read()[-2000:]))
+
+    def verify(self, dbname, backup):
+        '''
+        restore the backup of dbname into a scratch database and compare
+        the rows in each table with those counted when the backup was made.
+        returns (and records) a dictionary describing the result.
+        '''
+        backup_config = BackupConfig()
+        scratch = self._scratch_name(dbname)
+        result = {
+            "backup" : backup["path"],
+            "started" : datetime.now().isoformat(),
+            "restore_seconds" : None,
+            "tables" : None,
+            "rows" : None,
+            "mismatches" : {},
+            "status" : FAILED,
+            "error" : None,
+            }
+        LOGGER.info("verifying %s (restoring into %s)"% (
+            backup["path"], scratch))
+        start = time.time()
+        try:
+            self._execute_master(
+                'CREATE DATABASE "%s" TEMPLATE template0'% scratch)
+            try:
+                self.restore(scratch, backup, backup_config)
+                result["restore_seconds"] = round(time.time() - start, 1)
+                with self.function_store._connection(scratch) as conn:
+                    counts = row_counts(conn.cursor())
+            finally:
+                self._drop(scratch)
+        except Exception as exc:
+            LOGGER.exception("verification of %s failed"% backup["path"])
+            result["error"] = u"%s"% exc
+        else:
+            result["tables"] = len(counts)
+            result["rows"] = sum(counts.values())
+            expected = backup.get("row_counts")
+            if expected is None:
+                result["status"] = VERIFIED
+            else:
+                result["mismatches"] = compare_counts(expected, counts)
+                result["status"] = (MISMATCH if result["mismatches"]
+                    else VERIFIED)
+
+        result["seconds"] = round(time.time() - start, 1)
+        result["finished"] = datetime.now().isoformat()
+        if result["status"] == VERIFIED:
+            LOGGER.info("%s restored in %s seconds (%d tables, %d rows)"% (
+                backup["path"], result["restore_seconds"], result["tables"],
+                result["rows"]))
+        elif result["status"] == MISMATCH:
+            LOGGER.error("restore of %s has the wrong number of rows %s"% (
+                backup["path"], result["mismatches"]))
+        self._write(dbname, result, backup_config)
+        return result
+
+    def _write(self, dbname, result, backup_config):
+        backup_root = PgDump(self.function_store.config,
+            backup_config).backup_root
+        path = os.path.join(backup_root, dbname, VERIFY_FILE)
+        f = open(path + ".tmp", "w")
+        json.dump(result, f)
+        f.close()
+        os.rename(path + ".tmp", path)
+
+def read_verification(backup_root, dbname):
+    '''
+    the result of the last verification of a backup of dbname (or None)
+    '''
+    return read_record(backup_root, dbname, VERIFY_FILE)
+
+def _test():
+    LOGGER.debug(compare_counts({"a": 1, "b": 2}, {"a": 1, "b": 3, "c": 0}))
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
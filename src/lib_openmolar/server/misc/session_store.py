@@ -0,0 +1,253 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2011-2012,  Neil Wallace <neil@openmolar.com>                  ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+short lived session tokens.
+
+a client which has authenticated with a username and password may ask for
+a token, and send only that with subsequent requests.
+tokens expire after a period without use, and are forgotten if the server
+restarts.
+in pre-fork mode the tokens are kept in files (see SharedSessionStore),
+so that a token issued by one worker process is honoured by the others.
+'''
+
+import binascii
+import os
+import string
+import threading
+import time
+
+from lib_openmolar.server.misc.om_server_config import RUN_DIR
+
+#: the http header carrying the token (or "new" to request one)
+HEADER = "X-Openmolar-Session"
+
+#: the value of HEADER sent by a client wanting a token
+REQUEST_NEW = "new"
+
+#: where SharedSessionStore keeps its tokens
+SESSION_DIR = os.path.join(RUN_DIR, "sessions")
+
+class SessionStore(object):
+    '''
+    maps tokens to users.
+    '''
+    def __init__(self, ttl=900):
+        self.ttl = ttl
+        self._sessions = {}     # token: [user, expiry time]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _prune(self, now):
+        for token, (user, expires) in self._sessions.items():
+            if expires < now:
+                self._sessions.pop(token)
+
+    def create(self, user):
+        '''
+        returns a new token for user.
+        '''
+        token = binascii.hexlify(os.urandom(16))
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._sessions[token] = [user, now + self.ttl]
+        return token
+
+    def validate(self, token):
+        '''
+        returns the user the token was issued to (or None if the token is
+        unknown or has expired).
+        a valid token's lifetime is extended.
+        '''
+        now = time.time()
+        with self._lock:
+            try:
+                session = self._sessions[token]
+            except KeyError:
+                return None
+            if session[1] < now:
+                self._sessions.pop(token)
+                return None
+            session[1] = now + self.ttl
+            return session[0]
+
+    def revoke_user(self, user):
+        '''
+        forget all tokens issued to user (eg. when their password changes).
+        '''
+        with self._lock:
+            for token, session in self._sessions.items():
+                if session[0] == user:
+                    self._sessions.pop(token)
+
+    def clear(self):
+        '''
+        forget all tokens.
+        '''
+        with self._lock:
+            self._sessions.clear()
+
+class SharedSessionStore(SessionStore):
+    '''
+    maps tokens to users, keeping one file per token in directory, which
+    can be read by all the worker processes.
+    the modification time of a token's file is the time it was last used.
+    '''
+    def __init__(self, ttl=900, directory=SESSION_DIR):
+        SessionStore.__init__(self, ttl)
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+
+    def __len__(self):
+        return len(self._tokens())
+
+    def _tokens(self):
+        return [token for token in os.listdir(self.directory)
+            if not token.startswith(".")]
+
+    def _path(self, token):
+        '''
+        the file for token, or None if token is not a token we would issue
+        (so a client cannot name another file).
+        '''
+        if not token or token.strip(string.hexdigits):
+            return None
+        return os.path.join(self.directory, token)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _read(self, path):
+        try:
+            f = open(path)
+            try:
+                return f.read()
+            finally:
+                f.close()
+        except IOError:
+            return None
+
+    def _prune(self, now):
+        for token in self._tokens():
+            path = os.path.join(self.directory, token)
+            try:
+                if os.path.getmtime(path) + self.ttl < now:
+                    self._remove(path)
+            except OSError:
+                pass
+
+    def create(self, user):
+        '''
+        returns a new token for user.
+        '''
+        token = binascii.hexlify(os.urandom(16))
+        self._prune(time.time())
+        # written under a hidden name, then renamed, so other processes
+        # never read a partly written file.
+        temp_path = os.path.join(self.directory, "." + token)
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        try:
+            os.write(fd, user.encode("utf8"))
+        finally:
+            os.close(fd)
+        os.rename(temp_path, self._path(token))
+        return token
+
+    def validate(self, token):
+        '''
+        returns the user the token was issued to (or None if the token is
+        unknown or has expired).
+        a valid token's lifetime is extended.
+        '''
+        path = self._path(token)
+        if path is None:
+            return None
+        try:
+            expired = os.path.getmtime(path) + self.ttl < time.time()
+        except OSError:
+            return None
+        if expired:
+            self._remove(path)
+            return None
+        user = self._read(path)
+        if user is None:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            # revoked by another process
+            return None
+        return user.decode("utf8")
+
+    def revoke_user(self, user):
+        '''
+        forget all tokens issued to user (eg. when their password changes).
+        '''
+        for token in self._tokens():
+            path = os.path.join(self.directory, token)
+            content = self._read(path)
+            if content is not None and content.decode("utf8") == user:
+                self._remove(path)
+
+    def clear(self):
+        '''
+        forget all tokens.
+        '''
+        for token in os.listdir(self.directory):
+            self._remove(os.path.join(self.directory, token))
+
+def _test():
+    store = SessionStore(ttl=1)
+    token = store.create("admin")
+    LOGGER.debug("token %s is for user %s"% (token, store.validate(token)))
+    time.sleep(1.1)
+    LOGGER.debug("after expiry %s"% store.validate(token))
+
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        store = SharedSessionStore(ttl=1, directory=directory)
+        other_process = SharedSessionStore(ttl=1, directory=directory)
+        token = store.create("admin")
+        LOGGER.debug("token %s is for user %s"% (
+            token, other_process.validate(token)))
+        other_process.revoke_user("admin")
+        LOGGER.debug("after revoke %s"% store.validate(token))
+        LOGGER.debug("a path is not a token %s"% store.validate("../x"))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level = logging.DEBUG)
+
+    LOGGER = logging.getLogger("test")
+    _test()
@@ -24,9 +24,13 @@ import hashlib
 import random
 import pickle
 import string
+import threading
+import xmlrpclib
 
 from lib_openmolar.server.functions import FunctionStore
 from lib_openmolar.server.misc.payload import PayLoad
+from lib_openmolar.server.misc import payload_codec
+from lib_openmolar.server.misc.metrics import Metrics, SharedMetrics
 
 
 ## if you want a method to be displayed by the admin application's
@@ -36,7 +40,11 @@ from lib_openmolar.server.misc.payload import PayLoad
 MANAGER_METHODS = ( 'drop_db',
                     'drop_user',
                     'grant_user_permissions',
+                    'grant_users_permissions',
+                    'query_report',
+                    'reindex_bloated',
                     'truncate_all_tables',
+                    'vacuum_analyze',
                     )
 
 
@@ -45,13 +53,30 @@ class PermissionDispatcher(FunctionStore):
     wraps all the calls and checks if the user has permissions to run
     that method
     '''
-    _user = None
     PERMISSIONS = {}
 
     def __init__(self):
+        # requests may be handled concurrently by a pool of threads,
+        # each request is authenticated and dispatched within one thread,
+        # so the user is remembered per thread.
+        self._context = threading.local()
         FunctionStore.__init__(self)
+        self._metrics = self._new_metrics()
         self._init_permissions()
 
+    def _new_metrics(self):
+        '''
+        the call metrics, which are shared with the other worker processes
+        in pre-fork mode.
+        '''
+        if self._prefork_mode():
+            try:
+                return SharedMetrics()
+            except (IOError, OSError):
+                LOGGER.exception("unable to share metrics - "
+                    "the statistics served will be for one process only")
+        return Metrics()
+
     def _init_permissions(self):
         '''
         parse the tuples above into a dictionary of lists
@@ -79,33 +104,123 @@ class PermissionDispatcher(FunctionStore):
         '''
         overwrite the special _dispatch function which is a wrapper
         around all functions.
-        returns a pickled object of type ..doc `Payload`
+        returns an object of type ..doc `Payload`, pickled or
+        (if the client accepts it) in the compact binary format.
+        '''
+
+        LOGGER.debug("_dispatch called for method %s by user '%s'"% (
+            method, self.user))
+        if method == "call_many":
+            started = self._metrics.call_started(method)
+            error = True
+            try:
+                pl = self._call_many(*params)
+                error = False
+            finally:
+                # or the call would be counted as in flight forever
+                self._metrics.call_finished(method, started, error=error)
+        else:
+            pl = self._execute(method, params)
+        packed = self._pack(pl)
+        self._metrics.response_sent(self._metric_name(method),
+            len(packed.data) if isinstance(packed, xmlrpclib.Binary)
+            else len(packed))
+        return packed
+
+    def _metric_name(self, method):
+        '''
+        the name under which calls are counted
+        (calls to unknown methods are lumped together)
         '''
+        if method == "call_many" or (
+        not method.startswith("_") and hasattr(self, method)):
+            return method
+        return "unknown"
 
-        LOGGER.debug("_dispatch called for method %s"% method)
+    def _execute(self, method, params):
+        '''
+        check the user's permission, and call the method.
+        returns a :doc:`PayLoad`
+        '''
         pl = PayLoad(method)
         pl.permission = self._get_permission(method)
+        if pl.permission and method == "submit_job" and params:
+            # a job needs the permissions of the method it runs
+            pl.permission = self._get_permission(params[0])
+        metric_name = self._metric_name(method)
+        started = self._metrics.call_started(metric_name)
         if pl.permission:
             try:
+                if method.startswith("_"):
+                    raise AttributeError(
+                        'attempt to access private attribute "%s"'% method)
                 #this line executes the method!
                 pl.set_payload(getattr(self, method)(*params))
             except Exception as exc:
                 pl.set_payload("openmolar server error - check the server log")
                 pl.set_exception(exc)
                 LOGGER.exception("exception in method %s"% method)
+        self._metrics.call_finished(metric_name, started,
+            error=pl.exception is not None, denied=not pl.permission)
+        return pl
 
+    def _call_many(self, calls):
+        '''
+        execute a sequence of calls [(method, params), ...] in one request.
+        each is permission checked, and may fail, independently.
+
+        the payload is a list of tuples
+        (method, permission, result, exception) in the order of the calls,
+        where exception is None or a tuple (exception type name, message).
+        '''
+        pl = PayLoad("call_many")
+        pl.permission = True
+        results = []
+        for method, params in calls:
+            item = self._execute(method, params)
+            exc = item.exception
+            if exc is not None:
+                exc = (type(exc).__name__, item.exception_message)
+            results.append((method, item.permission, item.payload, exc))
+        pl.set_payload(results)
+        return pl
+
+    def _pack(self, pl):
+        '''
+        serialise the payload in the format negotiated with the client.
+        '''
+        binary, compress = getattr(self._context, "payload_format",
+            (False, False))
+        if binary:
+            try:
+                data = payload_codec.dumps(pl, compress)
+                LOGGER.debug("returning (binary) %s"% pl)
+                return xmlrpclib.Binary(data)
+            except TypeError as exc:
+                LOGGER.debug("%s - falling back to pickle"% exc)
         LOGGER.debug("returning (pickled) %s"% pl)
         return pickle.dumps(pl)
 
     @property
     def user(self):
-        return self._user
+        return getattr(self._context, "user", None)
+
+    @property
+    def _user(self):
+        return self.user
 
     def _remember_user(self, user):
         '''
-        remember the current user
+        remember the user for the request being handled by this thread
+        '''
+        self._context.user = user
+
+    def _remember_payload_format(self, header_value):
+        '''
+        remember the payload formats accepted by the client whose request is
+        being handled by this thread.
         '''
-        self._user = user
+        self._context.payload_format = payload_codec.accepts(header_value)
 
     def management_functions(self):
         '''
@@ -118,6 +233,9 @@ class PermissionDispatcher(FunctionStore):
             ("backup_db", _("Backup this database")),
             ("update_pt_index",
                 _("Update Patient index (after import)")),
+            ("bloat_report", _("Show table and index bloat")),
+            ("vacuum_analyze", _("Vacuum and analyze bloated tables")),
+            ("reindex_bloated", _("Rebuild bloated indexes")),
             )
 
     def pre_execution_warning(self, func_name):
@@ -26,15 +26,20 @@ This module provides the OpenMolar Server.
 
 import logging
 import os
+import signal
 import socket
 import time
 import threading
 
-from lib_openmolar.server.daemon.service import Service
+from lib_openmolar.server.daemon.service import Service, STOP_TIMEOUT
 from lib_openmolar.server.permission_dispatcher import PermissionDispatcher
 from lib_openmolar.server.misc import logger
-from lib_openmolar.server.servers.verifying_servers import VerifyingServerSSL
-from lib_openmolar.server.misc.om_server_config import OMServerConfig
+from lib_openmolar.server.servers.verifying_servers import (
+    VerifyingServerSSL, PooledVerifyingServerSSL)
+from lib_openmolar.server.misc.metrics import clear_shared_metrics
+from lib_openmolar.server.misc.om_server_config import shared_config
+from lib_openmolar.server.misc.session_store import (SessionStore,
+    SharedSessionStore)
 
 
 ##############################################################################
@@ -51,6 +56,9 @@ class OMServer(Service):
     '''
     A pointer to the :doc:`VerifyingServerSSL`
     '''
+
+    #: True in the worker processes forked in pre-fork mode
+    is_worker_process = False
     def __init__(self, verbose=False):
         if verbose:
             LOGGER.setLevel(logging.DEBUG)
@@ -61,12 +69,18 @@ class OMServer(Service):
         else:
             LOGGER.setLevel(logging.INFO)
 
-    def start(self):
+    def _server_settings(self, config):
         '''
-        start the server
+        the settings which cannot be changed without a new socket.
+        '''
+        return (config.location, config.port, config.private_key,
+            config.pub_key, config.workers, config.queue_depth)
+
+    def _create_server(self, config):
+        '''
+        create (and bind) a server using the current settings.
+        returns None if the port is unavailable.
         '''
-        LOGGER.info("starting OMServer Process")
-        config = OMServerConfig()
         loc = config.location
         port = config.port
         key = config.private_key
@@ -75,12 +89,16 @@ class OMServer(Service):
             raise IOError, "certificate '%s' and/or key '%s' not found"% (
                                                                 cert, key)
         try:
-            self.server = VerifyingServerSSL((loc, port), key, cert)
+            if config.workers:
+                server = PooledVerifyingServerSSL((loc, port), key, cert,
+                    config.workers, config.queue_depth)
+            else:
+                server = VerifyingServerSSL((loc, port), key, cert)
         except socket.error:
             LOGGER.error('Unable to start the server.' +
                 (' Port %d is in use' % port ) +
                 ' (Perhaps openmolar server is already running?)')
-            return
+            return None
 
         if loc == "":
             readable_loc = "on all interfaces"
@@ -90,20 +108,225 @@ class OMServer(Service):
             "listening for ssl connections %s port %d"% (readable_loc, port))
         LOGGER.debug("using cert %s"% cert)
         LOGGER.debug("using key %s"% key)
+        return server
 
-        # daemonise the process and write to /var/run
-        self.start_(stderr=logger.LOCATION)
+    def _apply_settings(self, server, config):
+        '''
+        apply the settings which can be changed on a running server.
+        '''
+        server.keepalive_timeout = config.keepalive_timeout
+        server.serve_stats = config.serve_stats
+        if not config.session_ttl:
+            server.sessions = None
+        elif self.processes and not isinstance(
+        server.sessions, SharedSessionStore):
+            # worker processes must honour each other's tokens
+            server.sessions = SharedSessionStore(config.session_ttl)
+        elif server.sessions is None:
+            server.sessions = SessionStore(config.session_ttl)
+        else:
+            server.sessions.ttl = config.session_ttl
 
-        self.server.register_instance(PermissionDispatcher())
-        for manager, hash in config.managers:
-            self.server.add_user(manager, hash)
+    def _sync_managers(self, config):
+        '''
+        add new (or changed) managers to the server, and remove any which
+        are no longer in the config file.
+        '''
+        managers = dict(config.managers)
+        for manager, hash in managers.iteritems():
+            if self._managers.get(manager) != hash:
+                self.server.add_user(manager, hash)
+        for manager in set(self._managers) - set(managers):
+            self.server.remove_user(manager)
+        self._managers = managers
 
-        server_thread = threading.Thread(target=self.server.serve_forever)
-        server_thread.start()
+    def _serve(self):
+        self._server_thread = threading.Thread(
+            target=self.server.serve_forever)
+        self._server_thread.start()
 
-    def stop(self):
+    def _release(self, server, stop_workers):
+        '''
+        stop listening on the server's socket.
+        '''
+        if self.processes:
+            # the master process, whose workers share the socket
+            if stop_workers:
+                self.stop_workers_()
+        else:
+            server.shutdown()
+        server.server_close()
+
+    def _rebind(self, config):
+        '''
+        replace the server with one using the new address, port, certificate
+        or worker settings.
+        requests in progress are completed by the old server.
+        returns True if the server was replaced.
+        '''
+        old_server = self.server
+        if (config.location, config.port) == self._bound_settings[:2]:
+            # the address is unchanged, so must be released first.
+            self._release(old_server, True)
+            new_server = self._create_server(config)
+            if new_server is None:
+                LOGGER.error("the server has stopped - please restart it")
+                self._stopping = True
+                return False
+        else:
+            new_server = self._create_server(config)
+            if new_server is None:
+                LOGGER.warning("keeping the existing server")
+                return False
+            self._release(old_server, False)
+
+        new_server.sessions = old_server.sessions
+        self.server = new_server
+        return True
+
+    def config_reloaded(self, config):
+        '''
+        called when the config file is reloaded, applies the new settings
+        to the running server.
+        '''
+        settings = self._server_settings(config)
+        if settings != self._bound_settings:
+            if self.is_worker_process:
+                LOGGER.debug(
+                    "server settings changed - leaving rebind to the master")
+            else:
+                LOGGER.info("server settings changed - rebinding")
+                old_server = self.server
+                if self._rebind(config):
+                    self.server.register_instance(
+                        old_server.registered_instance)
+                    self._serve()
+                self._bound_settings = settings
+        self._apply_settings(self.server, config)
+        self._sync_managers(config)
+
+    def supervise_(self, hup):
+        '''
+        called regularly by the master process (in pre-fork mode).
+        reloads the config file if it has changed (or on SIGHUP), and
+        rebinds if neccessary.
+        returns True if the worker processes should be replaced.
+        '''
+        config = shared_config()
+        if hup:
+            config.reload()
+        elif not config.reload_if_changed():
+            return False
+
+        replace = False
+        if config.processes and config.processes != self.processes:
+            LOGGER.info("%d worker processes requested"% config.processes)
+            self.processes = config.processes
+            replace = True
+        elif not config.processes:
+            LOGGER.warning(
+                "a restart is needed to run the server in a single process")
+
+        settings = self._server_settings(config)
+        if settings != self._bound_settings:
+            LOGGER.info("server settings changed - rebinding")
+            if self._rebind(config):
+                self._apply_settings(self.server, config)
+                replace = True
+            self._bound_settings = settings
+        return replace
+
+    def release_(self):
+        self.server.server_close()
+
+    def _sighup(self, signum, frame):
+        LOGGER.info("SIGHUP received - config will be reloaded")
+        self._reload_requested = True
+
+    def _sigterm(self, signum, frame):
+        self._stopping = True
+
+    def _run(self, config):
+        '''
+        handle requests in this process until SIGTERM is received,
+        reloading the config file when it changes (or on SIGHUP).
+        '''
+        dispatcher = PermissionDispatcher()
+        self.server.register_instance(dispatcher)
+        dispatcher._start_backup_scheduler()
+        self._managers = {}
+        self._sync_managers(config)
+        config.add_reload_callback(self.config_reloaded)
+
+        self._reload_requested = False
+        self._stopping = False
+        signal.signal(signal.SIGHUP, self._sighup)
+        signal.signal(signal.SIGTERM, self._sigterm)
+
+        self._serve()
+
+        # the main thread watches for changes to the config file
+        # (or a signal) until the server stops.
+        while self._server_thread.is_alive():
+            self._server_thread.join(1)
+            if self._stopping:
+                LOGGER.info("process %d stopping"% os.getpid())
+                self.server.shutdown()
+                # close the listening socket at once, so a new server can
+                # bind to the port while requests are completed.
+                self.server.server_close()
+                if hasattr(self.server, "join_workers"):
+                    self.server.join_workers(STOP_TIMEOUT)
+                break
+            if self._reload_requested:
+                self._reload_requested = False
+                config.reload()
+            else:
+                config.reload_if_changed()
+
+    def _worker_process(self):
+        '''
+        the body of each worker process in pre-fork mode.
+        '''
+        self.is_worker_process = True
+        # the workers share the listening socket, don't block in accept
+        # when another worker has taken the connection.
+        self.server.socket.setblocking(0)
+        self._run(shared_config())
+
+    def start(self, daemonise=True):
+        '''
+        start the server
+        if daemonise is False, the server runs in the calling process
+        (in the foreground) until it receives SIGTERM.
+        '''
+        LOGGER.info("starting OMServer Process")
+        config = shared_config()
+        self.server = self._create_server(config)
+        if self.server is None:
+            return
+        self.processes = config.processes
+        self._apply_settings(self.server, config)
+        if self.server.sessions is not None:
+            # tokens issued before a restart are not honoured.
+            self.server.sessions.clear()
+        if self.processes:
+            clear_shared_metrics()
+        self._bound_settings = self._server_settings(config)
+
+        if daemonise:
+            # daemonise the process and write to /var/run
+            self.start_(stderr=logger.LOCATION)
+
+        if self.processes:
+            self.prefork(self._worker_process)
+        else:
+            self._run(config)
+
+    def stop(self, wait=False):
         '''
         stop the server
+        if wait is True, wait for requests in progress to be completed.
         '''
         if not self.is_running:
             return
@@ -114,13 +337,20 @@ class OMServer(Service):
             # will be thrown if self.server is None
             # or pre 2.6 Baseserver(which lacks this function)
             pass
-        self.stop_()
+        self.stop_(STOP_TIMEOUT if wait else 0)
+
+    def reload(self):
+        '''
+        ask the running server to reload its config (and replace its
+        worker processes)
+        '''
+        self.reload_()
 
     def restart(self):
         '''
         restart the server
         '''
-        self.stop()
+        self.stop(wait=True)
         time.sleep(1)
         self.start()
 
@@ -22,15 +22,23 @@
 
 from base64 import b64decode
 from hashlib import md5
+import json
 import pickle
+import Queue
 import socket
 import ssl
+import threading
+import time
 from SocketServer import BaseServer
 from SimpleXMLRPCServer import (
     SimpleXMLRPCServer,
     SimpleXMLRPCDispatcher,
     SimpleXMLRPCRequestHandler)
 
+from lib_openmolar.server.misc.payload_codec import HEADER as PAYLOAD_HEADER
+from lib_openmolar.server.misc.session_store import (SessionStore,
+    HEADER as SESSION_HEADER, REQUEST_NEW)
+
 
 def ping():
     '''
@@ -39,6 +47,105 @@ def ping():
     #LOGGER.debug("server has been pinged")
     return True
 
+#: paths served (without authentication) to http GET requests
+STATS_PATHS = ("/stats", "/metrics")
+
+BUSY_RESPONSE = (
+    "HTTP/1.0 503 Service Unavailable\r\n"
+    "Content-Type: text/plain\r\n"
+    "Connection: close\r\n"
+    "\r\n"
+    "openmolar server is busy - please try again\r\n")
+
+class ThreadPoolMixIn:
+    '''
+    Mix-in class to handle each request in one of a fixed number of worker
+    threads.
+    Accepted requests wait in a bounded queue, when this is full further
+    requests are refused rather than allowed to consume memory.
+    '''
+    #: number of worker threads
+    workers = 4
+
+    #: maximum number of requests waiting for a worker
+    queue_depth = 32
+
+    _request_queue = None
+    _worker_threads = ()
+
+    def start_workers(self):
+        '''
+        create the request queue and start the worker threads.
+        '''
+        LOGGER.info("starting %d request workers (queue depth %d)"% (
+            self.workers, self.queue_depth))
+        self._request_queue = Queue.Queue(self.queue_depth)
+        self._worker_threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._process_queue,
+                args=(self._request_queue,), name="request_worker_%d"% i)
+            thread.daemon = True
+            thread.start()
+            self._worker_threads.append(thread)
+
+    def _process_queue(self, request_queue):
+        '''
+        the main loop of each worker thread.
+        '''
+        while True:
+            item = request_queue.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        '''
+        overwrite BaseServer.process_request so that the request is queued
+        for a worker thread instead of being handled immediately.
+        '''
+        if self._request_queue is None:
+            self.start_workers()
+        try:
+            self._request_queue.put_nowait((request, client_address))
+        except Queue.Full:
+            LOGGER.warning(
+                "request queue full - refusing connection from %s"% (
+                client_address,))
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except socket.error:
+                pass
+            self.shutdown_request(request)
+
+    def stop_workers(self):
+        '''
+        tell the worker threads to exit once the queue has drained.
+        '''
+        if self._request_queue is None:
+            return
+        for i in range(self.workers):
+            self._request_queue.put(None)
+        self._request_queue = None
+
+    def join_workers(self, timeout=None):
+        '''
+        wait (at most timeout seconds) for the worker threads to finish the
+        requests they have been given. call stop_workers first.
+        '''
+        if timeout is not None:
+            deadline = time.time() + timeout
+        for thread in self._worker_threads:
+            if timeout is None:
+                thread.join()
+            else:
+                thread.join(max(0, deadline - time.time()))
+
 class VerifyingServer(SimpleXMLRPCServer):
     '''
     an extension of SimpleXMLPRCServer
@@ -47,12 +154,31 @@ class VerifyingServer(SimpleXMLRPCServer):
 
     USERDICT = {"default":md5("eihjfosdhvpwi").hexdigest()}
 
+    #: hold connections open between requests (HTTP/1.1)
+    #: a server handling one request at a time should not do this, as a
+    #: single idle client would block all others.
+    keepalive = False
+
+    #: seconds an idle keep-alive connection is held open
+    keepalive_timeout = 5
+
+    #: serve call statistics at STATS_PATHS, without authentication
+    serve_stats = True
+
+    sessions = None
+    '''
+    a :doc:`SessionStore` or None if session tokens are not issued
+    '''
+
     registered_instance = None
     '''
     this attribute is a pointer to the instance passed into
     SimpleXMLRPCServer.register_instance()
     if this instance needs to know the user.. give it a special function
     _remember_user(user)
+    NOTE - if requests are handled concurrently (see
+    :doc:`PooledVerifyingServerSSL`) the instance must remember the user
+    per thread.
     '''
 
     def __init__(self, addr):
@@ -61,6 +187,7 @@ class VerifyingServer(SimpleXMLRPCServer):
         self.logRequests = False # the request handler logs enough detail
 
         self.register_function(ping, "ping")
+        self.sessions = SessionStore()
 
     def register_instance(self, klass):
         '''
@@ -84,9 +211,23 @@ class VerifyingServer(SimpleXMLRPCServer):
         password should be MD5 hashed.
         '''
         LOGGER.debug("adding user %s with hashed pass %s"% (user, hash))
+        previous = self.USERDICT.get(user)
         self.USERDICT[user] = hash
+        # a worker process starting in pre-fork mode adds every user, but
+        # must not revoke tokens issued by the other workers.
+        if self.sessions is not None and previous not in (None, hash):
+            self.sessions.revoke_user(user)
         LOGGER.debug("current user list is %s"% sorted(self.USERDICT.keys()))
 
+    def remove_user(self, user):
+        '''
+        remove a user from the userdict, and forget their sessions.
+        '''
+        LOGGER.debug("removing user %s"% user)
+        self.USERDICT.pop(user, None)
+        if self.sessions is not None:
+            self.sessions.revoke_user(user)
+
 
 class VerifyingServerSSL(VerifyingServer):
     '''
@@ -110,25 +251,111 @@ class VerifyingServerSSL(VerifyingServer):
         self.server_bind()
         self.server_activate()
 
+class PooledVerifyingServerSSL(ThreadPoolMixIn, VerifyingServerSSL):
+    '''
+    A :doc:`VerifyingServerSSL` which handles requests concurrently using a
+    bounded pool of worker threads.
+    The workers are started when the first request arrives, as the
+    server object is created before the process is daemonised
+    (threads do not survive a fork).
+    '''
+    keepalive = True
+
+    def __init__(self, addr, KEYFILE, CERTFILE, workers=4, queue_depth=32):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        VerifyingServerSSL.__init__(self, addr, KEYFILE, CERTFILE)
+
+    def server_close(self):
+        self.stop_workers()
+        VerifyingServerSSL.server_close(self)
+
 class VerifyingRequestHandler(SimpleXMLRPCRequestHandler):
     '''
     Request Handler that verifies username and password passed to
     XML RPC server in HTTP URL sent by client.
+
+    Clients may send the header
+        X-Openmolar-Session: new
+    with their credentials, and will receive a token in the same header of
+    the response. Sending that token instead of credentials avoids
+    re-checking the password on every request.
     '''
+    session_token = None
+
+    def setup(self):
+        if self.server.keepalive:
+            self.protocol_version = "HTTP/1.1"
+            self.timeout = self.server.keepalive_timeout
+        SimpleXMLRPCRequestHandler.setup(self)
+
+    def handle_one_request(self):
+        try:
+            SimpleXMLRPCRequestHandler.handle_one_request(self)
+        except (socket.timeout, ssl.SSLError):
+            # an idle keep-alive connection has timed out
+            # (ssl sockets raise SSLError rather than socket.timeout)
+            self.close_connection = 1
+
+    def end_headers(self):
+        if self.session_token is not None:
+            self.send_header(SESSION_HEADER, self.session_token)
+            self.session_token = None
+        if self.protocol_version == "HTTP/1.1":
+            # let the client know when an idle connection will be closed
+            self.send_header("Keep-Alive", "timeout=%d"% self.timeout)
+        SimpleXMLRPCRequestHandler.end_headers(self)
 
     def parse_request(self):
         # first, call the original implementation which returns
         # True if all OK so far
         if SimpleXMLRPCRequestHandler.parse_request(self):
+            if (self.command == "GET" and self.path in STATS_PATHS and
+            self.server.serve_stats):
+                return True
             # next we authenticate
             if self.authenticate(self.headers):
+                self.set_payload_format(self.headers.get(PAYLOAD_HEADER))
                 return True
             else:
                 # if authentication fails, tell the client
                 self.send_error(401, 'Authentication failed')
         return False
 
+    def do_GET(self):
+        '''
+        serve the statistics gathered by the registered instance
+        as json (/stats) or in the prometheus text format (/metrics)
+        '''
+        metrics = getattr(self.server.registered_instance, "_metrics", None)
+        if metrics is None or self.path not in STATS_PATHS:
+            self.report_404()
+            return
+        try:
+            queued = self.server._request_queue.qsize()
+        except AttributeError:
+            queued = 0
+        if self.path == "/stats":
+            stats = metrics.snapshot()
+            stats["queued_requests"] = queued
+            body = json.dumps(stats, indent=1, sort_keys=True)
+            content_type = "application/json"
+        else:
+            body = metrics.prometheus() + (
+                "# TYPE openmolar_queued_requests gauge\n"
+                "openmolar_queued_requests %d\n"% queued)
+            content_type = "text/plain; version=0.0.4"
+        self.send_response(200)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def authenticate(self, headers):
+        session = headers.get(SESSION_HEADER)
+        if (session and session != REQUEST_NEW and
+        self.server.sessions is not None):
+            return self.check_session(session)
 
         auth_header = headers.get('Authorization')
         if auth_header is None:
@@ -150,7 +377,24 @@ class VerifyingRequestHandler(SimpleXMLRPCRequestHandler):
 
         #    Get the username and password from the string
         (username, _, password) = decodedString.partition(':')
-        return self.check_user(username,password)
+        if not self.check_user(username,password):
+            return False
+        if session == REQUEST_NEW and self.server.sessions is not None:
+            self.session_token = self.server.sessions.create(username)
+            LOGGER.debug("issued session token to user '%s'"% username)
+        return True
+
+    def check_session(self, token):
+        '''
+        see if the token is a valid session token.
+        return a simple True or False
+        '''
+        user = self.server.sessions.validate(token)
+        self.set_proxy_user(user)
+        if user is None:
+            LOGGER.info("unknown or expired session token")
+            return False
+        return True
 
     def check_user(self, username, password):
         '''
@@ -174,6 +418,17 @@ class VerifyingRequestHandler(SimpleXMLRPCRequestHandler):
         '''
         self.server.registered_instance._remember_user(user)
 
+    def set_payload_format(self, header_value):
+        '''
+        pass the payload formats accepted by the client (if any) to the
+        registered instance.
+        '''
+        try:
+            self.server.registered_instance._remember_payload_format(
+                header_value)
+        except AttributeError:
+            pass
+
 def _test():
     s = VerifyingServer(("",1430))
     s.serve_forever()
@@ -48,6 +48,8 @@ def main():
         help="stop the server")
     parser.add_option("--restart", action="store_true",
         help="restart the server")
+    parser.add_option("--reload", action="store_true",
+        help="reload the server's config file (and replace worker processes)")
     parser.add_option("--status", action="store_true",
         help="check the status of the server")
 
@@ -88,6 +90,8 @@ def main():
     elif options.restart:
         first_run()
         omserver.restart()
+    elif options.reload:
+        omserver.reload()
     elif options.status:
         omserver.status()
     else:
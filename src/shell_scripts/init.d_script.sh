@@ -31,16 +31,17 @@ case "$1" in
         echo "Checking for running $DESC: "
 	    openmolar-server -q --restart
 	    ;;      
-  force-reload)
-	# nothing
-	;;
+  reload|force-reload)
+        echo "Reloading $DESC: "
+	    openmolar-server -q --reload
+	    ;;
   status)
         echo "Checking for running $DESC: "
 	    openmolar-server -q --status
 	    ;;      
   *)
     N=/etc/init.d/$NAME
-    echo "Usage: $N {start|stop|restart|force-reload|status}" >&2
+    echo "Usage: $N {start|stop|restart|reload|force-reload|status}" >&2
     exit 1
     ;;
 esac
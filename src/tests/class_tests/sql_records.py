@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+'''
+QSqlRecords standing in for those loaded from the database,
+shared by the tests of treatments and their metadata.
+'''
+
+from PyQt4 import QtCore, QtSql
+
+TREATMENT_FIELDS = (("ix", QtCore.QVariant.Int),
+    ("patient_id", QtCore.QVariant.Int),
+    ("om_code", QtCore.QVariant.String),
+    ("description", QtCore.QVariant.String),
+    ("completed", QtCore.QVariant.Bool),
+    ("comment", QtCore.QVariant.String),
+    ("px_clinician", QtCore.QVariant.Int),
+    ("tx_clinician", QtCore.QVariant.Int),
+    ("tx_date", QtCore.QVariant.Date),
+    ("added_by", QtCore.QVariant.String))
+
+METADATA_FIELDS = (("treatment_id", QtCore.QVariant.Int),
+    ("tooth", QtCore.QVariant.Int),
+    ("tx_type", QtCore.QVariant.String),
+    ("surfaces", QtCore.QVariant.String),
+    ("material", QtCore.QVariant.String),
+    ("type", QtCore.QVariant.String),
+    ("technition", QtCore.QVariant.String))
+
+def record(fields, values):
+    '''
+    a QSqlRecord with fields [(name, QVariant type), ...] set to values
+    '''
+    result = QtSql.QSqlRecord()
+    for name, field_type in fields:
+        result.append(QtSql.QSqlField(name, field_type))
+    for name, value in values.iteritems():
+        result.setValue(name, QtCore.QVariant(value))
+    return result
@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+import __builtin__
+import logging
+__builtin__.LOGGER = logging.getLogger("openmolar_server")
+
+from datetime import datetime
+import shutil
+import tempfile
+import threading
+
+from lib_openmolar.server.functions import db_functions
+from lib_openmolar.server.misc.backup_scheduler import due_slot
+from lib_openmolar.server.misc.job_manager import Job, CANCELLED
+
+import unittest
+
+class FakeBackupConfig(object):
+    def __init__(self, backup_dir, max_concurrent=1):
+        self.backup_dir = backup_dir
+        self.max_concurrent = max_concurrent
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.times = [(2, 0), (13, 30)]
+
+    def tearDown(self):
+        pass
+
+    def test_within_window(self):
+        self.assertEqual(due_slot(datetime(2012, 10, 2, 2, 0), self.times, 60),
+            datetime(2012, 10, 2, 2, 0))
+        self.assertEqual(
+            due_slot(datetime(2012, 10, 2, 14, 29), self.times, 60),
+            datetime(2012, 10, 2, 13, 30))
+
+    def test_outside_window(self):
+        self.assertEqual(
+            due_slot(datetime(2012, 10, 2, 3, 0), self.times, 60), None)
+        self.assertEqual(
+            due_slot(datetime(2012, 10, 2, 13, 29), self.times, 60), None)
+
+    def test_only_most_recent_slot(self):
+        # the 02:00 slot has passed, even though its window is open
+        self.assertEqual(
+            due_slot(datetime(2012, 10, 2, 13, 45), self.times, 720),
+            datetime(2012, 10, 2, 13, 30))
+
+    def test_yesterday(self):
+        self.assertEqual(
+            due_slot(datetime(2012, 10, 3, 0, 30), [(23, 0)], 180),
+            datetime(2012, 10, 2, 23, 0))
+        self.assertEqual(
+            due_slot(datetime(2012, 10, 3, 0, 30), [(1, 0)], 180), None)
+
+    def test_no_times(self):
+        self.assertEqual(due_slot(datetime(2012, 10, 3), [], 180), None)
+
+class BackupSlotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backup_dir = tempfile.mkdtemp()
+        self.backup_config = FakeBackupConfig(self.backup_dir)
+        self.functions = db_functions.DBFunctions.__new__(
+            db_functions.DBFunctions)
+        self.functions.config = None
+        self.poll = db_functions.BACKUP_SLOT_POLL
+        db_functions.BACKUP_SLOT_POLL = 0.01
+
+    def tearDown(self):
+        db_functions.BACKUP_SLOT_POLL = self.poll
+        shutil.rmtree(self.backup_dir)
+
+    def take_slot(self):
+        return self.functions._take_backup_slot("openmolar_demo",
+            self.backup_config)
+
+    def test_direct_call_does_not_wait(self):
+        slot = self.take_slot()
+        self.assertRaises(IOError, self.take_slot)
+        slot.close()
+        self.take_slot().close()
+
+    def test_job_waits(self):
+        slot = self.take_slot()
+        job = Job(1, "backup_db", ("openmolar_demo",), self.take_slot)
+        thread = threading.Thread(target=job.run)
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        job.cancel()
+        thread.join(1)
+        self.assertEqual(job.status, CANCELLED)
+        slot.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+
+import __builtin__
+import logging
+__builtin__.LOGGER = logging.getLogger("openmolar_server")
+
+from lib_openmolar.server.functions.job_functions import JobFunctions
+from lib_openmolar.server.misc.job_manager import (Job, FINISHED, FAILED,
+    failed_result)
+
+import unittest
+
+class FakeJobFunctions(JobFunctions):
+    '''
+    JobFunctions with the permissions of a :doc:`PermissionDispatcher`,
+    only "admin" may run methods in ADMIN_METHODS.
+    '''
+    ADMIN_METHODS = ("truncate_all_tables",)
+
+    def __init__(self, user):
+        JobFunctions.__init__(self, workers=1)
+        self._user = user
+
+    def _get_permission(self, method):
+        return self._user == "admin" or method not in self.ADMIN_METHODS
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.functions = FakeJobFunctions("fred")
+        jobs = self.functions._jobs
+        for method, user in (
+        ("backup_db", "fred"),
+        ("truncate_all_tables", "fred"),
+        ("truncate_all_tables", "admin"),
+        ("backup_db", "admin")):
+            job = Job(jobs._ids.next(), method, (), None, user)
+            jobs._jobs[job.id] = job
+
+    def tearDown(self):
+        pass
+
+    def listed(self, user):
+        self.functions._user = user
+        return [job["id"] for job in self.functions.list_jobs()]
+
+    def test_list_jobs(self):
+        self.assertEqual(self.listed("fred"), [1, 2, 4])
+        self.assertEqual(self.listed("default"), [1, 4])
+        self.assertEqual(self.listed("admin"), [1, 2, 3, 4])
+
+    def test_job_status(self):
+        self.assertEqual(self.functions.job_status(2)["user"], "fred")
+        self.assertRaises(KeyError, self.functions.job_status, 3)
+        self.assertRaises(KeyError, self.functions.job_status, 99)
+
+    def test_cancel_job(self):
+        self.functions._user = "default"
+        self.assertRaises(KeyError, self.functions.cancel_job, 2)
+        self.assertEqual(self.functions._jobs.get(2).cancel_requested, False)
+        self.assertTrue(self.functions.cancel_job(1))
+        self.functions._user = "admin"
+        self.assertTrue(self.functions.cancel_job(2))
+
+    def run_job(self, result):
+        job = Job(1, "backup_db", ("openmolar_demo",), lambda: result)
+        job.run()
+        return job
+
+    def test_failed_result(self):
+        for result in ("", u"", False, None):
+            self.assertTrue(failed_result(result))
+        for result in (True, "/backups/demo.sql", [], 0):
+            self.assertFalse(failed_result(result))
+
+    def test_failed_job(self):
+        job = self.run_job("")
+        self.assertEqual(job.status, FAILED)
+        self.assertNotEqual(job.error, None)
+        job = self.run_job("/backups/demo.sql")
+        self.assertEqual(job.status, FINISHED)
+        self.assertEqual(job.error, None)
+        self.assertEqual(job.progress, 100)
+
+if __name__ == "__main__":
+    unittest.main()
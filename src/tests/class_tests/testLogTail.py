@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+import shutil
+import tempfile
+
+from lib_openmolar.server.misc.log_tail import (read_log, filter_lines,
+    INITIAL_TAIL)
+
+import unittest
+
+LINE = "2012-10-02 10:18:33,003 %s %s\n"
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "server.log")
+        self.write(LINE% ("INFO", "started"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data, mode="a"):
+        f = open(self.path, mode)
+        f.write(data)
+        f.close()
+
+    def test_filter_lines(self):
+        lines = [l.rstrip("\n") for l in (
+            LINE% ("DEBUG", "detail"),
+            LINE% ("ERROR", "failed"),
+            "Traceback (most recent call last):",
+            LINE% ("INFO", "carrying on"),
+            "continued info line")]
+        self.assertEqual(filter_lines(lines, None), lines)
+        self.assertEqual(filter_lines(lines, "debug"), lines)
+        self.assertEqual(filter_lines(lines, "INFO"), lines[1:])
+        self.assertEqual(filter_lines(lines, "ERROR"), lines[1:3])
+
+    def test_incremental(self):
+        result = read_log(self.path)
+        self.assertEqual(len(result["lines"]), 1)
+        self.assertFalse(result["more"])
+        self.write(LINE% ("WARNING", "second") + "partial")
+        result = read_log(self.path, result["offset"], inode=result["inode"])
+        self.assertEqual(result["lines"],
+            [LINE.rstrip("\n")% ("WARNING", "second")])
+        self.assertFalse(result["rotated"])
+        # the partial line is returned once complete
+        self.write(" line\n")
+        result = read_log(self.path, result["offset"], inode=result["inode"])
+        self.assertEqual(result["lines"], ["partial line"])
+
+    def test_offset_as_string(self):
+        result = read_log(self.path)
+        self.write(LINE% ("INFO", "again"))
+        result = read_log(self.path, str(result["offset"]),
+            inode=str(result["inode"]))
+        self.assertEqual(len(result["lines"]), 1)
+
+    def test_max_bytes(self):
+        self.write(LINE% ("INFO", "x" * 100) * 10)
+        # the first line, and two of 130 bytes
+        result = read_log(self.path, 0, max_bytes=300)
+        self.assertTrue(result["more"])
+        self.assertEqual(len(result["lines"]), 3)
+        while result["more"]:
+            result = read_log(self.path, result["offset"], max_bytes=300)
+        self.assertEqual(result["offset"], result["size"])
+
+    def test_rotated(self):
+        result = read_log(self.path)
+        os.rename(self.path, self.path + ".1")
+        self.write(LINE% ("INFO", "new file"), "w")
+        result = read_log(self.path, result["offset"], inode=result["inode"])
+        self.assertTrue(result["rotated"])
+        self.assertEqual(len(result["lines"]), 1)
+
+    def test_truncated(self):
+        self.write(LINE% ("INFO", "more") * 5)
+        result = read_log(self.path)
+        self.write(LINE% ("INFO", "short"), "w")
+        result = read_log(self.path, result["offset"])
+        self.assertTrue(result["rotated"])
+        self.assertEqual(len(result["lines"]), 1)
+
+    def test_initial_tail(self):
+        self.write(LINE% ("INFO", "x" * 100) * (2 * INITIAL_TAIL // 100))
+        result = read_log(self.path)
+        self.assertTrue(result["offset"] - INITIAL_TAIL <= result["size"])
+        # reading starts at the beginning of a line
+        self.assertTrue(result["lines"][0].startswith("2012-10-02"))
+
+if __name__ == "__main__":
+    unittest.main()
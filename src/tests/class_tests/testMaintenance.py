@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+import __builtin__
+import logging
+__builtin__.LOGGER = logging.getLogger("openmolar_server")
+
+from contextlib import contextmanager
+
+from lib_openmolar.server.functions.maintenance_functions import (
+    estimate_table_bloat, estimate_index_bloat, MaintenanceFunctions,
+    MIN_DEAD_ROWS, MIN_INDEX_SIZE)
+
+import unittest
+
+BLOCK = 8192
+
+def table(name, dead_rows=0, dead_ratio=0):
+    return {"table": name, "ident": '"%s"'% name, "total_size": BLOCK,
+        "dead_rows": dead_rows, "dead_ratio": dead_ratio}
+
+def index(name, size=MIN_INDEX_SIZE, bloat_ratio=0):
+    return {"index": name, "ident": '"%s"'% name, "table": "patients",
+        "size": size, "bloat_ratio": bloat_ratio}
+
+class FakeCursor(object):
+    '''
+    records the statements executed, and reports the server version.
+    '''
+    def __init__(self, version):
+        self.version = version
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+    def fetchone(self):
+        return (self.version,)
+
+class FakeConnection(object):
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+class FakeMaintenance(MaintenanceFunctions):
+    '''
+    MaintenanceFunctions on a database with the given tables and indexes
+    (whose statistics are unchanged by VACUUM or REINDEX).
+    '''
+    def __init__(self, tables=(), indexes=(), version=120000):
+        self.stats = {"tables": list(tables), "indexes": list(indexes)}
+        self.cursor = FakeCursor(version)
+
+    @contextmanager
+    def _connection(self, dbname, autocommit=False):
+        yield FakeConnection(self.cursor)
+
+    def _bloat_stats(self, cursor):
+        return self.stats
+
+    @property
+    def statements(self):
+        return [statement for statement in self.cursor.statements
+            if not statement.startswith("select")]
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_unanalyzed(self):
+        self.assertEqual(estimate_table_bloat(BLOCK, 10, None, 100, BLOCK),
+            None)
+        self.assertEqual(estimate_index_bloat(BLOCK, 10, 0, 90, BLOCK), None)
+
+    def test_table_bloat(self):
+        # rows of 24 + 104 + 4 = 132 bytes, 61 fit in a full page
+        self.assertEqual(estimate_table_bloat(
+            17 * BLOCK, 1000, 100, 100, BLOCK), 0)
+        self.assertEqual(estimate_table_bloat(
+            80 * BLOCK, 1000, 100, 100, BLOCK), 63 * BLOCK)
+        # a lower fillfactor leaves free space which is not bloat
+        self.assertEqual(estimate_table_bloat(
+            33 * BLOCK, 1000, 100, 50, BLOCK), 0)
+
+    def test_empty_table(self):
+        self.assertEqual(estimate_table_bloat(
+            10 * BLOCK, 0, 100, 100, BLOCK), 10 * BLOCK)
+
+    def test_never_negative(self):
+        self.assertEqual(estimate_table_bloat(0, 1000, 100, 100, BLOCK), 0)
+        self.assertEqual(estimate_index_bloat(0, 1000, 8, 90, BLOCK), 0)
+
+    def test_index_bloat(self):
+        # entries of 8 + 8 + 4 = 20 bytes, 366 fit in a 90% full page,
+        # plus the metapage
+        self.assertEqual(estimate_index_bloat(
+            4 * BLOCK, 1000, 8, 90, BLOCK), 0)
+        self.assertEqual(estimate_index_bloat(
+            50 * BLOCK, 1000, 8, 90, BLOCK), 46 * BLOCK)
+
+class MaintenanceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tables = [
+            table("treatments"),
+            table("patients", MIN_DEAD_ROWS, 0.1),
+            table("addresses", MIN_DEAD_ROWS - 1, 0.5),
+            table("diary", MIN_DEAD_ROWS, 0.09),
+            table("empty", MIN_DEAD_ROWS, None),
+            ]
+        self.indexes = [
+            index("patients_pkey", bloat_ratio=0.3),
+            index("small_idx", MIN_INDEX_SIZE - 1, 0.9),
+            index("tidy_idx", bloat_ratio=0.29),
+            index("gist_idx", bloat_ratio=None),
+            ]
+
+    def tearDown(self):
+        pass
+
+    def test_vacuum_targets(self):
+        targets = MaintenanceFunctions()._vacuum_targets(self.tables)
+        self.assertEqual([t["table"] for t in targets],
+            ["treatments", "patients"])
+
+    def test_vacuum_analyze(self):
+        functions = FakeMaintenance(self.tables)
+        results = functions.vacuum_analyze("openmolar_demo")
+        self.assertEqual([r["table"] for r in results],
+            ["treatments", "patients"])
+        self.assertEqual(functions.statements, [
+            'VACUUM (ANALYZE) "treatments"', 'VACUUM (ANALYZE) "patients"'])
+
+    def test_vacuum_given_tables(self):
+        functions = FakeMaintenance(self.tables)
+        results = functions.vacuum_analyze("openmolar_demo",
+            ["empty", "addresses", "unknown"])
+        self.assertEqual([r["table"] for r in results], ["addresses", "empty"])
+        self.assertEqual(results[0]["dead_rows_before"], MIN_DEAD_ROWS - 1)
+
+    def test_reindex_bloated(self):
+        functions = FakeMaintenance(indexes=self.indexes)
+        results = functions.reindex_bloated("openmolar_demo")
+        self.assertEqual([r["index"] for r in results], ["patients_pkey"])
+        self.assertTrue(results[0]["rebuilt"])
+        self.assertEqual(functions.statements,
+            ['REINDEX INDEX CONCURRENTLY "patients_pkey"'])
+
+    def test_reindex_given_indexes(self):
+        functions = FakeMaintenance(indexes=self.indexes)
+        results = functions.reindex_bloated("openmolar_demo",
+            ["tidy_idx", "small_idx"])
+        self.assertEqual([r["index"] for r in results],
+            ["small_idx", "tidy_idx"])
+
+    def test_reindex_needs_postgres_12(self):
+        functions = FakeMaintenance(indexes=self.indexes, version=110005)
+        self.assertEqual(functions.reindex_bloated("openmolar_demo"), [])
+        self.assertEqual(functions.statements, [])
+
+if __name__ == "__main__":
+    unittest.main()
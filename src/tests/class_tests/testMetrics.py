@@ -0,0 +1,152 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+import shutil
+import tempfile
+
+from lib_openmolar.server.misc.metrics import (Metrics, MethodStats,
+    SharedMetrics, clear_shared_metrics, percentile, BUCKETS)
+
+import unittest
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        pass
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 0.5), None)
+        self.assertEqual(percentile([3], 0.99), 3)
+        ordered = range(101)
+        self.assertEqual(percentile(ordered, 0), 0)
+        self.assertEqual(percentile(ordered, 0.5), 50)
+        self.assertEqual(percentile(ordered, 0.95), 95)
+        self.assertEqual(percentile(ordered, 1), 100)
+
+    def test_method_stats(self):
+        stats = MethodStats()
+        for seconds in (0.001, 0.02, 0.02, 100):
+            stats.add(seconds)
+        stats.add(0.3, error=True)
+        stats.add(0, denied=True)
+        stats.add_response(100)
+        stats.add_response(300)
+        summary = stats.summary()
+        self.assertEqual(summary["calls"], 6)
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(summary["denied"], 1)
+        self.assertEqual(summary["max_ms"], 100000)
+        self.assertEqual(summary["mean_response_bytes"], 200)
+        self.assertEqual(summary["max_response_bytes"], 300)
+        # calls slower than the last bucket are counted only in +Inf
+        self.assertEqual(sum(stats.bucket_counts), 5)
+        self.assertEqual(stats.bucket_counts[0], 2)
+        self.assertEqual(stats.bucket_counts[BUCKETS.index(0.025)], 2)
+
+    def test_empty_summary(self):
+        summary = MethodStats().summary()
+        self.assertEqual(summary["calls"], 0)
+        self.assertEqual(summary["mean_ms"], None)
+        self.assertEqual(summary["p50_ms"], None)
+        self.assertEqual(summary["mean_response_bytes"], None)
+
+    def test_in_flight(self):
+        started = self.metrics.call_started("ping")
+        self.assertEqual(self.metrics.snapshot()["in_flight"], 1)
+        self.metrics.call_finished("ping", started, error=True)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot["in_flight"], 0)
+        self.assertEqual(snapshot["methods"]["ping"]["calls"], 1)
+        self.assertEqual(snapshot["methods"]["ping"]["errors"], 1)
+
+    def test_prometheus(self):
+        started = self.metrics.call_started("ping")
+        self.metrics.call_finished("ping", started - 0.02)
+        self.metrics.response_sent("ping", 123)
+        lines = self.metrics.prometheus().splitlines()
+        self.assertTrue('openmolar_rpc_calls_total{method="ping"} 1' in lines)
+        self.assertTrue(
+            'openmolar_rpc_duration_seconds_bucket{method="ping",le="0.01"} 0'
+            in lines)
+        self.assertTrue(
+            'openmolar_rpc_duration_seconds_bucket{method="ping",le="+Inf"} 1'
+            in lines)
+        self.assertTrue(
+            'openmolar_rpc_response_bytes_sum{method="ping"} 123' in lines)
+        # cumulative bucket counts never decrease
+        counts = [int(line.split()[-1]) for line in lines
+            if line.startswith("openmolar_rpc_duration_seconds_bucket")]
+        self.assertEqual(counts, sorted(counts))
+
+    def test_merge(self):
+        first, second = MethodStats(), MethodStats()
+        first.add(0.001)
+        first.add_response(100)
+        second.add(0.3, error=True)
+        second.add(0.02)
+        second.add_response(300)
+        second.in_flight = 1
+        merged = MethodStats.from_state(first.state())
+        merged.merge(second)
+        summary = merged.summary()
+        self.assertEqual(summary["calls"], 3)
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(summary["in_flight"], 1)
+        self.assertEqual(summary["max_ms"], 300)
+        self.assertEqual(summary["p50_ms"], 20)
+        self.assertEqual(summary["max_response_bytes"], 300)
+        self.assertEqual(sum(merged.bucket_counts), 3)
+
+    def test_shared(self):
+        directory = tempfile.mkdtemp()
+        try:
+            first = SharedMetrics(directory)
+            second = SharedMetrics(directory)
+            for metrics in (first, second, second):
+                metrics.call_finished("ping", metrics.call_started("ping"))
+            second.call_started("ping")
+            # the metrics of other processes are those they last wrote
+            self.assertEqual(
+                first.snapshot()["methods"]["ping"]["calls"], 1)
+            second._write()
+            # either process serves the totals of both
+            for metrics in (first, second):
+                snapshot = metrics.snapshot()
+                self.assertEqual(snapshot["methods"]["ping"]["calls"], 3)
+                self.assertEqual(snapshot["in_flight"], 1)
+            self.assertTrue('openmolar_rpc_calls_total{method="ping"} 3'
+                in first.prometheus().splitlines())
+
+            clear_shared_metrics(directory)
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
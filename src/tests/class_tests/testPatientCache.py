@@ -0,0 +1,157 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+
+from PyQt4 import QtSql
+
+from lib_openmolar.client.connect import DemoClientConnection
+from lib_openmolar.client.db_orm.patient_cache import PatientCache
+from lib_openmolar.client.db_orm.patient_loader import RecordSet
+from lib_openmolar.client.db_orm.patient_model import (patient_loader,
+    PatientModel)
+
+import unittest
+
+class FakePatient(object):
+    '''
+    stands in for a :doc:`PatientModel` in the tests needing no database
+    '''
+    def __init__(self, patient_id, is_loaded=True, is_dirty=False):
+        self.patient_id = patient_id
+        self.is_loaded = is_loaded
+        self.is_dirty = is_dirty
+
+def fake_records(size):
+    return {"patient": RecordSet(QtSql.QSqlRecord(), size=size)}
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = PatientCache(size=2, prefetch_budget=100)
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def test_least_recently_used(self):
+        for patient_id in (1, 2, 3):
+            self.assertTrue(self.cache.add(FakePatient(patient_id)))
+        self.assertEqual(self.cache.patient_ids, [2, 3])
+        self.cache.add(FakePatient(2))
+        self.cache.add(FakePatient(4))
+        self.assertEqual(self.cache.patient_ids, [2, 4])
+
+    def test_unsaved_or_partial_not_kept(self):
+        self.cache.add(FakePatient(1))
+        self.assertFalse(self.cache.add(FakePatient(1, is_dirty=True)))
+        self.assertFalse(1 in self.cache)
+        self.assertFalse(self.cache.add(FakePatient(2, is_loaded=False)))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_prefetch_budget(self):
+        self.assertTrue(self.cache.add_records(1, fake_records(60)))
+        self.assertTrue(self.cache.add_records(2, fake_records(30)))
+        self.assertEqual(self.cache.prefetched_size, 90)
+        self.assertTrue(self.cache.add_records(3, fake_records(30)))
+        self.assertEqual(self.cache.patient_ids, [2, 3])
+        self.assertFalse(self.cache.add_records(4, fake_records(101)))
+        self.assertFalse(4 in self.cache)
+
+    def test_opened_patient_not_prefetched(self):
+        self.cache.add(FakePatient(1))
+        self.assertFalse(self.cache.add_records(1, fake_records(10)))
+        self.cache.add_records(2, fake_records(10))
+        self.cache.add(FakePatient(2))
+        self.assertEqual(self.cache.prefetched_size, 0)
+        self.assertEqual(self.cache.patient_ids, [1, 2])
+
+    def test_new_connection_empties_cache(self):
+        self.cache.add(FakePatient(1))
+        self.cache._connection = object()
+        self.assertEqual(self.cache.get(1), None)
+        self.assertEqual(len(self.cache), 0)
+
+    def _cache_patient(self):
+        '''
+        load patient 1 from the demo database, and cache it.
+        '''
+        DemoClientConnection().connect()
+        self.cache = PatientCache()
+        self.patient = PatientModel(1)
+        self.assertTrue(self.cache.add(self.patient))
+
+    def _restore_with_stale(self, keys):
+        '''
+        pretend the record sets named in keys have changed on the server,
+        and take the patient from the cache.
+        '''
+        for key in keys:
+            self.patient.digests[key] = "stale"
+        return self.cache.get(1)
+
+    def test_unchanged(self):
+        self._cache_patient()
+        notes_model = self.patient["notes_model"]
+        patient = self.cache.get(1)
+        self.assertTrue(patient is self.patient)
+        self.assertTrue(patient["notes_model"] is notes_model)
+        self.assertTrue(patient.is_loaded)
+
+    def test_partial_restore_notes_clinical(self):
+        self._cache_patient()
+        notes_model = self.patient["notes_model"]
+        clerical = notes_model.clerical
+        patient = self._restore_with_stale(["notes_clinical"])
+        self.assertTrue(patient is self.patient)
+        self.assertTrue(patient["notes_model"] is notes_model)
+        self.assertTrue(notes_model.clerical is clerical)
+        self.assertNotEqual(patient.digests["notes_clinical"], "stale")
+
+    def test_partial_restore_notes_clerical(self):
+        self._cache_patient()
+        notes_model = self.patient["notes_model"]
+        clinical = notes_model.clinical
+        patient = self._restore_with_stale(["notes_clerical"])
+        self.assertTrue(patient["notes_model"] is notes_model)
+        self.assertTrue(notes_model.clinical is clinical)
+        self.assertNotEqual(patient.digests["notes_clerical"], "stale")
+
+    def test_partial_restore_treatments(self):
+        self._cache_patient()
+        patient = self._restore_with_stale(["treatment_metadata"])
+        self.assertTrue(patient.is_loaded)
+        self.assertNotEqual(patient.digests["treatment_metadata"], "stale")
+
+    def test_restore_prefetched(self):
+        self._cache_patient()
+        records = patient_loader().load(2)
+        records["notes_clerical"].digest = "stale"
+        self.assertTrue(self.cache.add_records(2, records))
+        patient = self.cache.get(2)
+        self.assertTrue(patient.is_loaded)
+        self.assertFalse(2 in self.cache)
+
+if __name__ == "__main__":
+    unittest.main()
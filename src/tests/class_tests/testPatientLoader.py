@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+import json
+
+from PyQt4 import QtCore, QtSql
+
+from lib_openmolar.client.db_orm.patient_loader import (RecordSet,
+    json_value, json_records, records_size, _pg_array, FIELD_BYTES)
+
+import unittest
+
+def template(*fields):
+    '''
+    a record with the fields given as (name, QVariant type) pairs
+    '''
+    record = QtSql.QSqlRecord()
+    for name, field_type in fields:
+        record.append(QtSql.QSqlField(name, field_type))
+    return record
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.template = template(
+            ("ix", QtCore.QVariant.Int),
+            ("name", QtCore.QVariant.String),
+            ("dob", QtCore.QVariant.Date))
+
+    def tearDown(self):
+        pass
+
+    def test_pg_array(self):
+        self.assertEqual(_pg_array([]), u"{}")
+        self.assertEqual(_pg_array([1, 2.5]), u"{1,2.5}")
+        self.assertEqual(_pg_array([None, True, False]), u"{NULL,t,f}")
+        self.assertEqual(_pg_array([[1, 2], [3, None]]), u"{{1,2},{3,NULL}}")
+        self.assertEqual(_pg_array([u"ab", u"a b", u"", u"null", u'q"',
+            u"b\\s", u"{x}"]),
+            u'{ab,"a b","","null","q\\"","b\\\\s","{x}"}')
+
+    def test_json_value_scalars(self):
+        self.assertEqual(json_value(42, QtCore.QVariant.Int).toInt()[0], 42)
+        self.assertEqual(
+            json_value(1, QtCore.QVariant.Double).toDouble()[0], 1.0)
+        self.assertTrue(json_value(True, QtCore.QVariant.Bool).toBool())
+        self.assertEqual(
+            json_value(u"\xe9t\xe9", QtCore.QVariant.String).toString(),
+            u"\xe9t\xe9")
+        self.assertEqual(json_value(u"\\x6162",
+            QtCore.QVariant.ByteArray).toByteArray(), QtCore.QByteArray("ab"))
+
+    def test_json_value_containers(self):
+        self.assertEqual(json_value([1, 2], QtCore.QVariant.String).toString(),
+            u"{1,2}")
+        value = json_value({"a": 1}, QtCore.QVariant.String)
+        self.assertEqual(json.loads(unicode(value.toString())), {"a": 1})
+
+    def test_json_value_dates(self):
+        self.assertEqual(
+            json_value(u"2012-10-02", QtCore.QVariant.Date).toDate(),
+            QtCore.QDate(2012, 10, 2))
+        self.assertEqual(
+            json_value(u"10:18:33.25", QtCore.QVariant.Time).toTime(),
+            QtCore.QTime(10, 18, 33, 250))
+        self.assertEqual(json_value(u"2012-10-02T10:18:33.5",
+            QtCore.QVariant.DateTime).toDateTime(),
+            QtCore.QDateTime(QtCore.QDate(2012, 10, 2),
+            QtCore.QTime(10, 18, 33, 500)))
+
+    def test_json_value_timestamptz(self):
+        utc = QtCore.QDateTime(QtCore.QDate(2012, 10, 2),
+            QtCore.QTime(9, 18, 33), QtCore.Qt.UTC)
+        for value in (u"2012-10-02T10:18:33+01:00", u"2012-10-02T10:18:33+01",
+        u"2012-10-02T09:18:33Z", u"2012-10-02T04:48:33-04:30"):
+            dt = json_value(value, QtCore.QVariant.DateTime).toDateTime()
+            self.assertEqual(dt.toUTC(), utc, value)
+            self.assertEqual(dt.timeSpec(), QtCore.Qt.LocalTime)
+
+    def test_json_records(self):
+        rows = [{"ix": 1, "name": u"a", "dob": u"2012-10-02"},
+            {"ix": 2, "name": None}]
+        records = json_records(self.template, rows, "digest", 100)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records.digest, "digest")
+        self.assertEqual(records.size, 100)
+        self.assertTrue(records.template is self.template)
+        self.assertEqual(records[0].value("name").toString(), u"a")
+        self.assertEqual(records[0].value("dob").toDate(),
+            QtCore.QDate(2012, 10, 2))
+        self.assertEqual(records[1].value("ix").toInt()[0], 2)
+        self.assertTrue(records[1].isNull("name"))
+        self.assertTrue(records[1].isNull("dob"))
+        self.assertEqual(records.first().value("ix").toInt()[0], 1)
+
+    def test_empty_record_set(self):
+        records = json_records(self.template, [])
+        self.assertEqual(records, [])
+        first = records.first()
+        self.assertEqual(first.count(), 3)
+        self.assertTrue(first.isNull("ix"))
+
+    def test_records_size(self):
+        records = RecordSet(self.template, [QtSql.QSqlRecord(self.template)])
+        self.assertEqual(records.size, 3 * FIELD_BYTES)
+        self.assertEqual(records_size({"a": records,
+            "b": RecordSet(self.template, [], size=10)}), 3 * FIELD_BYTES + 10)
+
+if __name__ == "__main__":
+    unittest.main()
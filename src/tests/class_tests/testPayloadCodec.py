@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+
+from datetime import date, datetime
+from decimal import Decimal
+
+from lib_openmolar.server.misc import payload_codec
+from lib_openmolar.server.misc.payload import PayLoad
+from lib_openmolar.common.connect import payload_codec as client_codec
+
+import unittest
+
+class TestCase(unittest.TestCase):
+    def round_trip(self, value, compress=False):
+        '''
+        encode value as the server does, and decode it as the client does.
+        '''
+        pl = PayLoad("test")
+        pl.permission = True
+        pl.set_payload(value)
+        data = payload_codec.dumps(pl, compress)
+        self.assertEqual(payload_codec.loads(data)[2], value)
+        return client_codec.loads(data).payload
+
+    def test_scalars(self):
+        for value in (None, True, False, 0, -1, 1.5, "abc", u"\xe9t\xe9", ""):
+            result = self.round_trip(value)
+            self.assertEqual(result, value)
+            self.assertEqual(type(result), type(value))
+        # longs are decoded as ints where they fit in 8 bytes
+        for value in (2**63 - 1, -2**63, 2**63, -2**70):
+            self.assertEqual(self.round_trip(value), value)
+
+    def test_decimal(self):
+        for value in (Decimal("2.50"), Decimal("-0.001"), Decimal("1E+3")):
+            result = self.round_trip(value)
+            self.assertEqual(result, value)
+            self.assertEqual(str(result), str(value))
+
+    def test_naive_datetime(self):
+        for value in (datetime(2012, 10, 2, 10, 18),
+        datetime(2012, 10, 2, 10, 18, 5, 123456), date(2012, 10, 2)):
+            result = self.round_trip(value)
+            self.assertEqual(result, value)
+            self.assertEqual(type(result), type(value))
+        self.assertTrue(
+            self.round_trip(datetime(2012, 10, 2)).tzinfo is None)
+
+    def test_aware_datetime(self):
+        for minutes in (0, 60, -330):
+            value = datetime(2012, 10, 2, 10, 18, 5, 123456,
+                tzinfo=payload_codec.FixedOffset(minutes))
+            result = self.round_trip(value)
+            self.assertEqual(result, value)
+            self.assertEqual(result.utcoffset(), value.utcoffset())
+        value = datetime(2012, 10, 2, 23, 0,
+            tzinfo=payload_codec.FixedOffset(-300))
+        self.assertEqual(self.round_trip(value).isoformat(),
+            "2012-10-02T23:00:00-05:00")
+
+    def test_containers(self):
+        value = {"rows": [(1, u"a", None), (2, u"b", Decimal("1.10"))],
+            "nested": {"empty": [], "tuple": (), "dict": {}},
+            3: [[1, [2, [3]]], (datetime(2012, 10, 2), date(2012, 10, 2))]}
+        result = self.round_trip(value, compress=True)
+        self.assertEqual(result, value)
+        self.assertEqual(type(result["rows"][0]), tuple)
+        self.assertEqual(type(result[3]), list)
+
+    def test_compressed(self):
+        value = [u"row %d"% i for i in range(1000)]
+        pl = PayLoad("test")
+        pl.permission = True
+        pl.set_payload(value)
+        data = payload_codec.dumps(pl, True)
+        self.assertTrue(len(data) < len(payload_codec.dumps(pl)))
+        self.assertEqual(client_codec.loads(data).payload, value)
+
+    def test_exception(self):
+        pl = PayLoad("test")
+        pl.set_exception(IOError("no such file"))
+        result = client_codec.loads(payload_codec.dumps(pl))
+        self.assertEqual(result.exception.type_name, "IOError")
+        self.assertEqual(result.exception_message, "no such file")
+
+    def test_unsupported_type(self):
+        pl = PayLoad("test")
+        pl.permission = True
+        pl.set_payload(set([1]))
+        self.assertRaises(TypeError, payload_codec.dumps, pl)
+
+    def test_malformed(self):
+        pl = PayLoad("test")
+        pl.permission = True
+        pl.set_payload(u"abc")
+        data = payload_codec.dumps(pl)
+        for bad in (data[:5], data[:-1], "XYZ" + data[3:]):
+            self.assertRaises(client_codec.PayloadCodecError,
+                client_codec.loads, bad)
+
+if __name__ == "__main__":
+    unittest.main()
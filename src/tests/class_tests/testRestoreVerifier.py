@@ -0,0 +1,55 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+from lib_openmolar.server.misc.restore_verifier import compare_counts
+
+import unittest
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.expected = {"patients": 100, "addresses": 80, "notes": 0}
+
+    def tearDown(self):
+        pass
+
+    def test_match(self):
+        self.assertEqual(compare_counts(self.expected, dict(self.expected)),
+            {})
+        self.assertEqual(compare_counts({}, {}), {})
+
+    def test_differing_count(self):
+        found = dict(self.expected, addresses=79)
+        self.assertEqual(compare_counts(self.expected, found),
+            {"addresses": [80, 79]})
+
+    def test_missing_and_extra_tables(self):
+        found = {"patients": 100, "addresses": 80, "extra": 1}
+        self.assertEqual(compare_counts(self.expected, found),
+            {"notes": [0, None], "extra": [None, 1]})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -34,6 +34,9 @@ from lib_openmolar.client.qt4.widgets import ToothData
 
 
 import unittest
+from PyQt4 import QtCore
+
+from sql_records import record, TREATMENT_FIELDS, METADATA_FIELDS
 
 class TestCase(unittest.TestCase):
     def setUp(self):
@@ -82,6 +85,27 @@ class TestCase(unittest.TestCase):
             valid, errors = item.check_valid()
             self.assertTrue(valid, "%s %s"% (item, errors))
 
+    def test_metadata_given(self):
+        '''
+        metadata loaded with the item is used, rather than polled for.
+        '''
+        code = SETTINGS.PROCEDURE_CODES.exam_codes.next().code
+        treatment = record(TREATMENT_FIELDS,
+            {"ix": 1, "om_code": code, "px_clinician": 1})
+        metadata = [record(METADATA_FIELDS,
+            {"treatment_id": 1, "tooth": tooth, "surfaces": "MO"})
+            for tooth in (7, 8)]
+
+        item = TreatmentItem(treatment, metadata)
+        self.assertEqual([data.tooth for data in item.metadata], [7, 8])
+        self.assertEqual([data.surfaces for data in item.metadata],
+            ["MO", "MO"])
+        self.assertTrue(item.metadata[0].parent_item is item)
+
+        item = TreatmentItem(treatment, [])
+        self.assertEqual(item._metadata, [])
+        self.assertEqual(item.metadata, [])
+
     def test_proc_codes_are_chartable(self):
         for item in self.spawn_all_proc_code_tis():
             if item.is_chartable:
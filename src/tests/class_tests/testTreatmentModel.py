@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+##                                                                           ##
+##  Copyright 2010-2012, Neil Wallace <neil@openmolar.com>                   ##
+##                                                                           ##
+##  This program is free software: you can redistribute it and/or modify     ##
+##  it under the terms of the GNU General Public License as published by     ##
+##  the Free Software Foundation, either version 3 of the License, or        ##
+##  (at your option) any later version.                                      ##
+##                                                                           ##
+##  This program is distributed in the hope that it will be useful,          ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of           ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            ##
+##  GNU General Public License for more details.                             ##
+##                                                                           ##
+##  You should have received a copy of the GNU General Public License        ##
+##  along with this program.  If not, see <http://www.gnu.org/licenses/>.    ##
+##                                                                           ##
+###############################################################################
+
+import os, sys
+
+lib_openmolar_path = os.path.abspath("../../")
+if not lib_openmolar_path == sys.path[0]:
+    sys.path.insert(0, lib_openmolar_path)
+from lib_openmolar.client.db_orm.treatment_model import TreatmentModel
+
+from sql_records import record, TREATMENT_FIELDS, METADATA_FIELDS
+
+import unittest
+
+class TestCase(unittest.TestCase):
+    '''
+    the metadata of all a patient's treatments is loaded in one query
+    (see treatment_model.METADATA_QUERY) and shared out by treatment_id.
+    '''
+    def setUp(self):
+        code = SETTINGS.PROCEDURE_CODES.exam_codes.next().code
+        self.records = [record(TREATMENT_FIELDS, {"ix": ix, "patient_id": 1,
+            "om_code": code, "px_clinician": 1}) for ix in (1, 2, 3)]
+        self.metadata = [record(METADATA_FIELDS,
+            {"treatment_id": treatment_id, "tooth": tooth})
+            for treatment_id, tooth in ((3, 1), (1, 7), (3, 2))]
+        self.model = TreatmentModel()
+
+    def tearDown(self):
+        pass
+
+    def test_metadata_grouped_by_treatment(self):
+        self.model.load_patient(1, self.records, self.metadata)
+        items = dict([(item.id.toInt()[0], item)
+            for item in self.model.treatment_items])
+        self.assertEqual(sorted(items), [1, 2, 3])
+        self.assertEqual([data.tooth for data in items[1].metadata], [7])
+        self.assertEqual([data.tooth for data in items[3].metadata], [1, 2])
+        # known to have no metadata, so the database is not polled
+        self.assertEqual(items[2]._metadata, [])
+
+    def test_no_treatments(self):
+        self.model.load_patient(1, [], self.metadata)
+        self.assertEqual(self.model.treatment_items, [])
+
+if __name__ == "__main__":
+    unittest.main()